@@ -1,39 +1,272 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from preprocessing.text_preprocessing import TextPreprocessor
-from preprocessing.text_augmentation import TextAugmenter
-from preprocessing.image_preprocessing import ImagePreprocessor
-from preprocessing.image_augmentation import ImageAugmenter
-from preprocessing.audio_preprocessing import AudioPreprocessor
-from preprocessing.audio_augmentation import AudioAugmenter
-from preprocessing.threed_preprocessing import ThreeDPreprocessor
-from preprocessing.threed_augmentation import ThreeDAugmenter
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, url_for, g
+from preprocessing.processors import processors
+from preprocessing.model_registry import registry
+from preprocessing.result_store import ResultStore
+from preprocessing.jobs import JobQueue, JobQueueFull, TASKS
+from preprocessing.admission import AdmissionController, AdmissionRejected
+from preprocessing.audio_quality import resolve_tier
+from preprocessing.pipeline import PipelineCancelled, step_context, current_step_context, variant_count
+from preprocessing.result_cache import result_cache
+from preprocessing.metrics import metrics, REQUESTS, REQUEST_SECONDS, REQUEST_BYTES, RESPONSE_BYTES
+from preprocessing.streaming import stream_steps, ndjson, server_sent_events
+import functools
+import io
 import os
+import json
 import logging
+import time
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 
 logging.basicConfig(level=logging.DEBUG)
 
 app = Flask(__name__)
 CORS(app)
 
+@app.before_request
+def before_request():
+    g.request_started = time.perf_counter()
+
 # Add these headers to your response
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+
+    # Label by route pattern, not path, so ids do not create new series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUESTS.inc(route=route, method=request.method, status=str(response.status_code))
+    if 'request_started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, route=route)
+    if request.content_length is not None:
+        REQUEST_BYTES.observe(request.content_length, route=route)
+    if response.content_length is not None:
+        RESPONSE_BYTES.observe(response.content_length, route=route)
+    return response
+
+# Processors are imported per modality on first request. PRELOAD_MODALITIES
+# (e.g. "text,3d" or "all") imports them at boot instead.
+preload_modalities = os.environ.get('PRELOAD_MODALITIES', '').strip()
+if preload_modalities:
+    processors.load(None if preload_modalities == 'all' else preload_modalities.split(','))
+
+# Optionally load heavy models at boot, e.g. WARMUP_MODELS=fill-mask,wordnet or "all"
+warmup_models = os.environ.get('WARMUP_MODELS', '').strip()
+if warmup_models:
+    registry.warm_up(None if warmup_models == 'all' else warmup_models.split(','))
+
+# Binary results of multipart/raw-body requests, fetched via /results/<id>;
+# RESULT_STORE_MAX_BYTES caps their total size (0: count cap only)
+result_store = ResultStore(max_bytes=int(os.environ.get('RESULT_STORE_MAX_BYTES', 256 * 1024 * 1024)))
+
+# Local process pool for long-running jobs; JOB_WORKERS defaults to the CPU count
+job_queue = JobQueue(max_workers=int(os.environ.get('JOB_WORKERS', 0)) or None,
+                     max_queued=int(os.environ.get('JOB_MAX_QUEUED', 64)))
+
+# Per-modality concurrency limits, payload caps and timeouts (see AdmissionController)
+admission = AdmissionController.from_env()
+# Batch bodies may be this many times a single request's payload cap
+BATCH_PAYLOAD_ITEMS = int(os.environ.get('BATCH_PAYLOAD_ITEMS', 32))
+# Backstop for bodies read outside admitted routes; admitted routes lower it per request
+app.config['MAX_CONTENT_LENGTH'] = admission.max_payload_limit(BATCH_PAYLOAD_ITEMS)
+
+@app.errorhandler(RequestEntityTooLarge)
+def payload_too_large(e):
+    return jsonify({'error': 'Payload exceeds the size limit'}), 413
+
+# Invalid options (InvalidOptions, an unknown audio quality, ...) are the
+# client's error; routes with their own handlers catch ValueError the same way
+@app.errorhandler(ValueError)
+def invalid_options(e):
+    return jsonify({'error': str(e)}), 400
+
+@app.errorhandler(PipelineCancelled)
+def pipeline_cancelled(e):
+    return jsonify({'error': str(e)}), 503
+
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = e.status
+    if e.retry_after:
+        response.headers['Retry-After'] = str(e.retry_after)
     return response
 
-preprocessor = TextPreprocessor()
-augmenter = TextAugmenter()  # Initialize the augmenter
+def _admitted(modality, batch=False):
+    """Run a route under its modality's payload cap, concurrency limit and timeout
+
+    Work still running at the deadline is cancelled before its next step and
+    the request gets a 503. Streamed responses hold their slot until the
+    stream ends.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            items = BATCH_PAYLOAD_ITEMS if batch else 1
+            admission.check_payload(modality, request.content_length, items)
+            if request.content_length is None:
+                # Chunked bodies have no length up front: stop reading them at the cap
+                request.max_content_length = admission.payload_limit(modality, items)
+            slot = admission.admit(modality)
+            try:
+                with step_context(deadline=slot.deadline) as context:
+                    response = app.make_response(view(*args, **kwargs))
+            except PipelineCancelled:
+                # Views without their own error handling (the text routes) land here
+                slot.release()
+                return jsonify({'error': f"{modality} processing timed out"}), 503
+            except BaseException:
+                slot.release()
+                raise
+
+            if context.timed_out:
+                slot.release()
+                return jsonify({'error': f"{modality} processing timed out"}), 503
+            if response.is_streamed:
+                response.call_on_close(slot.release)
+            else:
+                slot.release()
+            return response
+        return wrapper
+    return decorator
+
+def _collect_stats():
+    """Expose cache, job queue and model stats at scrape time"""
+    cache = result_cache.stats()
+    yield ('result_cache_bytes', 'gauge', 'Bytes held by the result cache', [({}, cache['bytes'])])
+    yield ('result_cache_entries', 'gauge', 'Entries in the result cache', [({}, cache['entries'])])
+    yield ('result_cache_requests_total', 'counter', 'Result cache lookups by outcome', [
+        ({'outcome': outcome}, cache[outcome]) for outcome in ('hits', 'misses', 'coalesced')
+    ])
+    yield ('result_cache_evictions_total', 'counter', 'Result cache evictions', [({}, cache['evictions'])])
+    yield ('jobs', 'gauge', 'Jobs known to the queue by status', [
+        ({'status': status}, count) for status, count in job_queue.stats().items()
+    ])
+    limits = admission.stats()
+    for name, help in (('active', 'Requests running'), ('waiting', 'Requests waiting for a slot')):
+        yield (f'admission_{name}', 'gauge', f'{help} by modality', [
+            ({'modality': modality}, stats[name]) for modality, stats in limits.items()
+        ])
+    yield ('admission_rejected_total', 'counter', 'Requests turned away by modality and reason', [
+        ({'modality': modality, 'reason': reason}, stats[key])
+        for modality, stats in limits.items()
+        for reason, key in (('queue_full', 'rejected'), ('wait_timeout', 'timed_out'))
+    ])
+    models = registry.stats()
+    yield ('process_resident_memory_bytes', 'gauge', 'Resident memory of the server process',
+           [({}, models['process_rss_bytes'])])
+    yield ('model_loaded', 'gauge', 'Whether each registered model is loaded', [
+        ({'model': name}, int(model['loaded'])) for name, model in models['models'].items()
+    ])
+
+metrics.add_collector(_collect_stats)
+
+def _audio_options(options):
+    """Resolve quality='auto' against the audio backlog before the options are cached or queued"""
+    if options.get('quality') != 'auto':
+        # Unknown tiers are rejected here, not once the work is queued
+        resolve_tier(options)
+        return options
+    backlog = job_queue.stats().get('queued', 0) + admission.limiters['audio'].waiting
+    return dict(options, quality=resolve_tier(options, backlog))
+
+def _read_upload(field):
+    """Return (payload, options) from a multipart or raw-body request
+
+    Multipart requests carry the file in `field` (or `file`) and options as a
+    JSON form field. Raw-body requests carry the file as the body and options
+    as a JSON query parameter.
+    """
+    if request.files:
+        upload = request.files.get(field) or request.files.get('file')
+        options = json.loads(request.form.get('options') or '{}')
+        return (upload.stream if upload else None), options
+    options = json.loads(request.args.get('options') or '{}')
+    return (request.get_data() or None), options
+
+# Image results requested with output_format=npy are NumPy arrays, not PNGs
+NPY_MAGIC = b'\x93NUMPY'
 
-# Initialize processors
-image_preprocessor = ImagePreprocessor()
-image_augmenter = ImageAugmenter()
-audio_preprocessor = AudioPreprocessor()
-audio_augmenter = AudioAugmenter()
-threed_preprocessor = ThreeDPreprocessor()
-threed_augmenter = ThreeDAugmenter()
+def _mimetype_of(value, mimetype):
+    return 'application/x-npy' if value.startswith(NPY_MAGIC) else mimetype
+
+def _store_binary(result, mimetype):
+    """Replace every bytes value of a result (and its steps) with a fetch URL"""
+    def store(value):
+        result_id = result_store.put(value, _mimetype_of(value, mimetype))
+        return url_for('get_result', result_id=result_id)
+
+    response = {}
+    for key, value in result.items():
+        if isinstance(value, bytes):
+            response[key] = store(value)
+        elif isinstance(value, dict):
+            response[key] = {name: store(step) if isinstance(step, bytes) else step
+                             for name, step in value.items()}
+        elif key == 'variants':
+            # num_variants results nest one full result per variant
+            response[key] = [_store_binary(variant, mimetype) for variant in value]
+        else:
+            response[key] = value
+    return response
+
+def _binary_response(result, result_key, mimetype):
+    """Return the final result as raw bytes, or URLs for every binary result"""
+    if request.args.get('response') == 'raw':
+        return Response(result[result_key], mimetype=_mimetype_of(result[result_key], mimetype))
+    return jsonify(_store_binary(result, mimetype))
+
+def _batch_response(batch_fn, field, mimetype):
+    """Run a batch method over JSON items or over every uploaded file
+
+    JSON bodies look like {"items": [...], "options": {...}}. Multipart
+    requests repeat the file field once per input and get URLs back for the
+    binary results. Results are returned in input order.
+    """
+    if request.is_json:
+        data = request.json or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'No items provided'}), 400
+        return jsonify({'results': batch_fn(items, data.get('options', {}))})
+
+    uploads = request.files.getlist(field) or request.files.getlist('file')
+    if not uploads:
+        return jsonify({'error': 'No files provided'}), 400
+    options = json.loads(request.form.get('options') or '{}')
+    results = batch_fn([upload.stream for upload in uploads], options, binary=True)
+    return jsonify({'results': [_store_binary(result, mimetype) for result in results]})
+
+# ?stream=<format> (or the matching Accept header) streams step results
+STREAM_FORMATS = {
+    'ndjson': (ndjson, 'application/x-ndjson'),
+    'sse': (server_sent_events, 'text/event-stream'),
+}
+
+def _stream_format():
+    """Return the requested stream format, or None for a plain JSON response"""
+    stream = request.args.get('stream')
+    if stream in STREAM_FORMATS:
+        return stream
+    best = request.accept_mimetypes.best_match(
+        ['application/json'] + [mimetype for _, mimetype in STREAM_FORMATS.values()]
+    )
+    for name, (_, mimetype) in STREAM_FORMATS.items():
+        if best == mimetype:
+            return name
+    return None
+
+def _stream_response(method, payload, options):
+    """Send each step's result of method(payload, options) as soon as it is computed"""
+    # Uploaded streams close with the request, before the response is consumed
+    if hasattr(payload, 'read'):
+        payload = payload.read()
+    formatter, mimetype = STREAM_FORMATS[_stream_format()]
+    context = current_step_context()
+    events = stream_steps(method, payload, options, deadline=context.deadline if context else None)
+    return Response(formatter(events), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/')
 def index():
@@ -55,104 +288,165 @@ def upload_file():
     return jsonify({'error': 'Error processing file'}), 400
 
 @app.route('/preprocess', methods=['POST'])
+@_admitted('text')
 def preprocess():
     data = request.json
     content = data['data']
     options = data['options']
     
     # Process the text and get all results
-    result = preprocessor.preprocess(content, options)
+    result = processors.get('text', 'preprocessor').preprocess(content, options)
     
     return jsonify(result)
 
 @app.route('/augment', methods=['POST'])
+@_admitted('text')
 def augment_text():
+    # Imported here, like every text module, only once a text route is used
+    from preprocessing.text_augmentation import augment_args
     data = request.json
     text = data.get('text', '')
     options = data.get('options', {})
     
     # Convert options format
-    processed_options = {
-        'synonym_replacement': options.get('synonym_replacement', {}).get('enabled', False),
-        'mlm_replacement': options.get('mlm_replacement', {}).get('enabled', False),
-        'random_insertion': options.get('random_insertion', {}).get('enabled', False),
-        'random_deletion': options.get('random_deletion', {}).get('enabled', False)
-    }
+    processed_options, n_words = augment_args(options)
     
-    # Get n_words for each method
-    n_words = {
-        'synonym_replacement': options.get('synonym_replacement', {}).get('n_words', 3),
-        'mlm_replacement': options.get('mlm_replacement', {}).get('n_words', 3),
-        'random_insertion': options.get('random_insertion', {}).get('n_words', 3),
-        'random_deletion': options.get('random_deletion', {}).get('n_words', 2)
-    }
-    
-    augmenter = TextAugmenter()
-    result = augmenter.augment(text, processed_options, n_words)
+    result = processors.get('text', 'augmenter').augment(text, processed_options, n_words)
     return jsonify(result)
 
 @app.route('/preprocess-image', methods=['POST'])
+@_admitted('image')
 def preprocess_image():
     try:
+        if not request.is_json:
+            image, options = _read_upload('image')
+            if image is None:
+                return jsonify({'error': 'No image data provided'}), 400
+            if _stream_format():
+                return _stream_response(processors.get('image', 'preprocessor').preprocess, image, options)
+            result = processors.get('image', 'preprocessor').preprocess(image, options, binary=True)
+            return _binary_response(result, 'processed_image', 'image/png')
+
         data = request.json
         if not data or 'image' not in data:
             return jsonify({'error': 'No image data provided'}), 400
             
-        result = image_preprocessor.preprocess(data['image'], data['options'])
+        if _stream_format():
+            return _stream_response(processors.get('image', 'preprocessor').preprocess, data['image'], data['options'])
+        result = processors.get('image', 'preprocessor').preprocess(data['image'], data['options'])
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/augment-image', methods=['POST'])
+@_admitted('image')
 def augment_image():
     try:
+        if not request.is_json:
+            image, options = _read_upload('image')
+            if image is None:
+                return jsonify({'error': 'No image data provided'}), 400
+            if _stream_format():
+                # Checked up front: once streaming, errors arrive as events
+                variant_count(options)
+                return _stream_response(processors.get('image', 'augmenter').augment, image, options)
+            result = processors.get('image', 'augmenter').augment(image, options, binary=True)
+            return _binary_response(result, 'augmented_image', 'image/png')
+
         data = request.json
         if not data or 'image' not in data:
             return jsonify({'error': 'No image data provided'}), 400
             
-        result = image_augmenter.augment(data['image'], data['options'])
+        if _stream_format():
+            variant_count(data['options'])
+            return _stream_response(processors.get('image', 'augmenter').augment, data['image'], data['options'])
+        result = processors.get('image', 'augmenter').augment(data['image'], data['options'])
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/preprocess-audio', methods=['POST'])
+@_admitted('audio')
 def preprocess_audio():
     try:
+        if not request.is_json:
+            audio_data, options = _read_upload('audio')
+            options = _audio_options(options)
+            if audio_data is None:
+                return jsonify({'error': 'No audio data provided'}), 400
+            if _stream_format():
+                return _stream_response(processors.get('audio', 'preprocessor').preprocess, audio_data, options)
+            result = processors.get('audio', 'preprocessor').preprocess(audio_data, options, binary=True)
+            return _binary_response(result, 'processed_audio', 'audio/wav')
+
         data = request.json
         audio_data = data.get('audio')
-        options = data.get('options', {})
+        options = _audio_options(data.get('options', {}))
         
         if not audio_data:
             return jsonify({'error': 'No audio data provided'}), 400
             
         logging.debug(f"Received options: {options}")
         
-        result = audio_preprocessor.preprocess(audio_data, options)
+        if _stream_format():
+            return _stream_response(processors.get('audio', 'preprocessor').preprocess, audio_data, options)
+        result = processors.get('audio', 'preprocessor').preprocess(audio_data, options)
         return jsonify(result)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error in preprocess_audio: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/augment-audio', methods=['POST'])
+@_admitted('audio')
 def augment_audio():
     try:
+        if not request.is_json:
+            audio_data, options = _read_upload('audio')
+            options = _audio_options(options)
+            if audio_data is None:
+                return jsonify({'error': 'No audio data provided'}), 400
+            if _stream_format():
+                return _stream_response(processors.get('audio', 'augmenter').augment, audio_data, options)
+            result = processors.get('audio', 'augmenter').augment(audio_data, options, binary=True)
+            return _binary_response(result, 'augmented_audio', 'audio/wav')
+
         data = request.json
         audio_data = data.get('audio')
-        options = data.get('options', {})
+        options = _audio_options(data.get('options', {}))
         
         if not audio_data:
             return jsonify({'error': 'No audio data provided'}), 400
             
-        result = audio_augmenter.augment(audio_data, options)
+        if _stream_format():
+            return _stream_response(processors.get('audio', 'augmenter').augment, audio_data, options)
+        result = processors.get('audio', 'augmenter').augment(audio_data, options)
         return jsonify(result)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/preprocess-3d', methods=['POST'])
+@_admitted('3d')
 def preprocess_3d():
     try:
+        if not request.is_json:
+            model_data, options = _read_upload('model')
+            if model_data is None:
+                return jsonify({'error': 'No 3D model data provided'}), 400
+            if _stream_format():
+                return _stream_response(processors.get('3d', 'preprocessor').preprocess, model_data, options)
+            result = processors.get('3d', 'preprocessor').preprocess(model_data, options, binary=True)
+            return _binary_response(result, 'processed_model', 'model/off')
+
         data = request.json
         if not data or 'model' not in data:
             return jsonify({'error': 'No 3D model data provided'}), 400
@@ -163,25 +457,230 @@ def preprocess_3d():
         print("Received 3D model data and options")
         print(f"Options: {options}")
         
-        result = threed_preprocessor.preprocess(model_data, options)
+        if _stream_format():
+            return _stream_response(processors.get('3d', 'preprocessor').preprocess, model_data, options)
+        result = processors.get('3d', 'preprocessor').preprocess(model_data, options)
         return jsonify(result)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error in preprocess_3d: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/augment-3d', methods=['POST'])
+@_admitted('3d')
 def augment_3d():
     try:
+        if not request.is_json:
+            model_data, options = _read_upload('model')
+            if model_data is None:
+                return jsonify({'error': 'No 3D model data provided'}), 400
+            if _stream_format():
+                return _stream_response(processors.get('3d', 'augmenter').augment, model_data, options)
+            result = processors.get('3d', 'augmenter').augment(model_data, options, binary=True)
+            return _binary_response(result, 'augmented_model', 'model/off')
+
         data = request.json
         if not data or 'model' not in data:
             return jsonify({'error': 'No 3D model data provided'}), 400
             
-        result = threed_augmenter.augment(data['model'], data['options'])
+        if _stream_format():
+            return _stream_response(processors.get('3d', 'augmenter').augment, data['model'], data['options'])
+        result = processors.get('3d', 'augmenter').augment(data['model'], data['options'])
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/preprocess/batch', methods=['POST'])
+@_admitted('text', batch=True)
+def preprocess_batch():
+    data = request.json or {}
+    texts = data.get('items')
+    if not isinstance(texts, list) or not texts:
+        return jsonify({'error': 'No items provided'}), 400
+    preprocessor = processors.get('text', 'preprocessor')
+    # ?format=npz returns padded int32 id matrices instead of per-text lists
+    if request.args.get('format') == 'npz':
+        from preprocessing.text_preprocessing import save_batch
+        batch = preprocessor.encode_batch(texts, data.get('options', {}),
+                                          bucket_size=int(data.get('bucket_size') or 0) or None)
+        buffer = io.BytesIO()
+        save_batch(batch, buffer)
+        return Response(buffer.getvalue(), mimetype='application/x-npz')
+    results = preprocessor.preprocess_batch(texts, data.get('options', {}))
+    return jsonify({'results': results})
+
+@app.route('/augment/batch', methods=['POST'])
+@_admitted('text', batch=True)
+def augment_text_batch():
+    data = request.json or {}
+    texts = data.get('items')
+    if not isinstance(texts, list) or not texts:
+        return jsonify({'error': 'No items provided'}), 400
+    from preprocessing.text_augmentation import augment_args
+    processed_options, n_words = augment_args(data.get('options', {}))
+    results = processors.get('text', 'augmenter').augment_batch(texts, processed_options, n_words)
+    return jsonify({'results': results})
+
+@app.route('/preprocess-image/batch', methods=['POST'])
+@_admitted('image', batch=True)
+def preprocess_image_batch():
+    try:
+        return _batch_response(processors.get('image', 'preprocessor').preprocess_batch, 'image', 'image/png')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/augment-image/batch', methods=['POST'])
+@_admitted('image', batch=True)
+def augment_image_batch():
+    try:
+        return _batch_response(processors.get('image', 'augmenter').augment_batch, 'image', 'image/png')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/preprocess-audio/batch', methods=['POST'])
+@_admitted('audio', batch=True)
+def preprocess_audio_batch():
+    try:
+        preprocess_batch = processors.get('audio', 'preprocessor').preprocess_batch
+        return _batch_response(lambda items, options, **kwargs: preprocess_batch(items, _audio_options(options), **kwargs),
+                               'audio', 'audio/wav')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error in preprocess_audio_batch: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/augment-audio/batch', methods=['POST'])
+@_admitted('audio', batch=True)
+def augment_audio_batch():
+    try:
+        augment_batch = processors.get('audio', 'augmenter').augment_batch
+        return _batch_response(lambda items, options, **kwargs: augment_batch(items, _audio_options(options), **kwargs),
+                               'audio', 'audio/wav')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/preprocess-3d/batch', methods=['POST'])
+@_admitted('3d', batch=True)
+def preprocess_3d_batch():
+    try:
+        return _batch_response(processors.get('3d', 'preprocessor').preprocess_batch, 'model', 'model/off')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/augment-3d/batch', methods=['POST'])
+@_admitted('3d', batch=True)
+def augment_3d_batch():
+    try:
+        return _batch_response(processors.get('3d', 'augmenter').augment_batch, 'model', 'model/off')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        if request.is_json:
+            data = request.json
+            task = data.get('task')
+            payload = data.get('data')
+            options = data.get('options', {})
+        else:
+            task = request.form.get('task') or request.args.get('task')
+            payload, options = _read_upload('file')
+            if hasattr(payload, 'read'):
+                payload = payload.read()
+
+        if not payload:
+            return jsonify({'error': 'No input data provided'}), 400
+        if task in TASKS:
+            admission.check_payload(TASKS[task][0], len(payload))
+            variant_count(options)
+            if TASKS[task][0] == 'audio':
+                options = _audio_options(options)
+
+        job_id = job_queue.submit(task, payload, options)
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id),
+            'result_url': url_for('job_result', job_id=job_id)
+        }), 202
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.result(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    status, result = job
+    if status != 'completed':
+        return jsonify({'error': f'Job is {status}', 'status': status}), 409
+    return jsonify(result)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if not job_queue.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    return jsonify(job_queue.status(job_id))
+
+@app.route('/results/<result_id>', methods=['GET'])
+def get_result(result_id):
+    item = result_store.get(result_id)
+    if item is None:
+        return jsonify({'error': 'Result not found or expired'}), 404
+    data, mimetype = item
+    return Response(data, mimetype=mimetype)
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/cache', methods=['DELETE'])
+def clear_cache():
+    result_cache.clear()
+    return jsonify(result_cache.stats())
+
+@app.route('/models', methods=['GET'])
+def model_stats():
+    stats = registry.stats()
+    stats['processors'] = processors.stats()
+    return jsonify(stats)
+
+@app.route('/models/warmup', methods=['POST'])
+def warm_up_models():
+    try:
+        names = (request.get_json(silent=True) or {}).get('models')
+        return jsonify(registry.warm_up(names))
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'),
@@ -0,0 +1,144 @@
+"""Compare fill-mask model variants on latency, memory and top-k agreement.
+
+Each variant is a checkpoint name with an optional ":int8" suffix for
+dynamic quantization. Every variant runs in a fresh interpreter, so its
+resident memory is measured from the same baseline, and its predictions for
+the same masked sentences are compared with those of the first variant.
+
+    python benchmarks/fill_mask.py
+    python benchmarks/fill_mask.py bert-base-uncased bert-base-uncased:int8 \
+        distilbert-base-uncased:int8 --output fill_mask.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_VARIANTS = ['bert-base-uncased', 'bert-base-uncased:int8',
+                    'distilbert-base-uncased', 'distilbert-base-uncased:int8']
+
+SENTENCES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "Data scientists prepare large datasets for training robust models.",
+    "Augmentation often improves the generalization of neural networks.",
+    "She walked to the market to buy fresh bread and vegetables.",
+    "The weather was cold, so we stayed inside and read books.",
+    "He finished the report just before the meeting started.",
+    "Our team released a new version of the library last week.",
+    "The museum is closed on Mondays during the winter season.",
+    "Please send me the results of the experiment by Friday.",
+    "Heavy rain caused delays on most of the trains this morning.",
+    "The children played football in the park after school.",
+    "A good night of sleep helps you concentrate during the day.",
+]
+
+_WORKER = r"""
+import json, os, statistics, sys, time
+sys.path.insert(0, {repo_root!r})
+from preprocessing.model_registry import _current_rss
+rss_before = _current_rss()
+start = time.perf_counter()
+from preprocessing.masked_lm import load_fill_mask, MaskedWordPredictor
+pipeline = load_fill_mask({model!r}, {quantize!r})
+load_seconds = time.perf_counter() - start
+predictor = MaskedWordPredictor.from_pipeline(pipeline)
+texts = {texts!r}
+for _ in range(2):
+    predictor.predict(texts[:1], top_k={top_k})
+single, batched = [], []
+for _ in range({repeat}):
+    for text in texts:
+        start = time.perf_counter()
+        predictor.predict([text], top_k={top_k})
+        single.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    predictions = predictor.predict(texts, top_k={top_k})
+    batched.append(time.perf_counter() - start)
+rss_after = _current_rss()
+print(json.dumps({{
+    'load_seconds': load_seconds,
+    'single_median_seconds': statistics.median(single),
+    'batch_median_seconds': statistics.median(batched),
+    'batch_size': len(texts),
+    'rss_delta_bytes': None if rss_before is None or rss_after is None else rss_after - rss_before,
+    'predictions': predictions,
+}}))
+"""
+
+
+def masked_texts(mask_token='[MASK]'):
+    """Mask every third word of each sentence, giving several masks per text"""
+    texts = []
+    for sentence in SENTENCES:
+        words = sentence.split()
+        texts.append(' '.join(mask_token if index % 3 == 1 else word for index, word in enumerate(words)))
+    return texts
+
+
+def run_variant(variant, texts, top_k, repeat):
+    model, _, quantize = variant.partition(':')
+    completed = subprocess.run(
+        [sys.executable, '-c', _WORKER.format(repo_root=REPO_ROOT, model=model, quantize=quantize or None,
+                                              texts=texts, top_k=top_k, repeat=repeat)],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f"{variant} failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def agreement(reference, candidate):
+    """Top-1 match rate and mean top-k overlap over every masked position"""
+    top1 = []
+    overlap = []
+    for reference_masks, candidate_masks in zip(reference, candidate):
+        for expected, actual in zip(reference_masks, candidate_masks):
+            top1.append(expected[0] == actual[0])
+            overlap.append(len(set(expected) & set(actual)) / len(expected))
+    return {'top1': statistics.mean(top1), 'topk_overlap': statistics.mean(overlap)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('variants', nargs='*', default=DEFAULT_VARIANTS,
+                        help='checkpoint names, optionally suffixed with :int8; the first is the reference')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3, help='timed passes over the sentences')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    texts = masked_texts()
+    report = {'python': sys.version.split()[0], 'top_k': args.top_k, 'variants': {}}
+    reference = None
+    print(f"{'variant':34s} {'load':>7s} {'single':>9s} {'batch':>9s} {'rss MB':>8s} {'top1':>6s} {'top-k':>6s}")
+    for variant in args.variants:
+        try:
+            result = run_variant(variant, texts, args.top_k, args.repeat)
+        except RuntimeError as e:
+            report['variants'][variant] = {'error': str(e)}
+            print(f"{variant:34s} failed: {e}")
+            continue
+
+        predictions = result.pop('predictions')
+        if reference is None:
+            reference = predictions
+        result['agreement'] = agreement(reference, predictions)
+        report['variants'][variant] = result
+        rss = result['rss_delta_bytes']
+        print(f"{variant:34s} {result['load_seconds']:6.1f}s "
+              f"{result['single_median_seconds'] * 1000:7.1f}ms {result['batch_median_seconds'] * 1000:7.1f}ms "
+              f"{rss / 1e6 if rss is not None else float('nan'):8.0f} "
+              f"{result['agreement']['top1']:6.2f} {result['agreement']['topk_overlap']:6.2f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,465 @@
+"""Benchmark every processor and step on synthetic inputs of increasing size.
+
+Each case runs one processor with all of its steps enabled and reports the
+time of every step (Decode included), end-to-end throughput and the peak
+resident memory above the pre-run baseline. The fill-mask model, WordNet and
+the POS tagger are replaced with small stubs unless --real-models is given,
+so the suite runs offline.
+
+    python benchmarks/pipelines.py --preset quick --output before.json
+    python benchmarks/pipelines.py --only image audio --compare before.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import wave
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+
+from preprocessing.model_registry import registry
+from preprocessing.pipeline import step_context
+from preprocessing.processors import processors
+from preprocessing.synonyms import SynonymIndex
+
+KB = 1024
+MB = 1024 * KB
+
+# Input sizes per modality: text bytes, image (width, height), audio seconds,
+# and meshes as 'cube' (samples/sample_cube.off) or icosphere subdivisions
+# (20 * 4**n faces, so 8 is about 1.3M faces)
+PRESETS = {
+    'quick': {
+        'text': [1 * KB, 100 * KB],
+        'image': [(224, 224), (1024, 1024)],
+        'audio': [1, 10],
+        '3d': ['cube', 3],
+    },
+    'default': {
+        'text': [1 * KB, 100 * KB, 1 * MB],
+        'image': [(224, 224), (512, 512), (1920, 1080), (3840, 2160)],
+        'audio': [1, 60, 600],
+        '3d': ['cube', 3, 5, 7],
+    },
+    'full': {
+        'text': [1 * KB, 100 * KB, 1 * MB, 10 * MB],
+        'image': [(224, 224), (512, 512), (1920, 1080), (3840, 2160), (7680, 4320)],
+        'audio': [1, 60, 600, 3600],
+        '3d': ['cube', 3, 5, 7, 8],
+    },
+}
+
+AUDIO_SAMPLE_RATE = 44100
+
+# Options with every step enabled, per (modality, role)
+OPTIONS = {
+    ('text', 'preprocessor'): {
+        'case_normalization': True, 'punctuation_removal': True,
+        'stopword_removal': True, 'padding': True, 'padding_length': 128
+    },
+    ('text', 'augmenter'): {
+        'synonym_replacement': True, 'mlm_replacement': True,
+        'random_insertion': True, 'random_deletion': True
+    },
+    ('image', 'preprocessor'): {
+        'resize': True, 'resize_width': 224, 'resize_height': 224,
+        'normalize': True, 'grayscale': True, 'blur': True, 'blur_kernel': 5
+    },
+    ('image', 'augmenter'): {
+        'rotation': {'enabled': True, 'angle': 30},
+        'flip': {'enabled': True, 'direction': 'horizontal'},
+        'brightness': {'enabled': True, 'factor': 1.2},
+        'noise': {'enabled': True, 'level': 25}
+    },
+    ('audio', 'preprocessor'): {
+        'resample': True, 'target_sample_rate': 16000, 'normalize': True,
+        'noise_reduction': True, 'time_stretch': True, 'stretch_rate': 1.2, 'mfcc': True
+    },
+    ('audio', 'augmenter'): {
+        'time_stretch': {'enabled': True, 'rate': 1.2},
+        'pitch_shift': {'enabled': True, 'steps': 2},
+        'noise': {'enabled': True, 'level': 0.01},
+        'time_mask': {'enabled': True, 'param': 80},
+        'freq_mask': {'enabled': True, 'param': 80}
+    },
+    ('3d', 'preprocessor'): {
+        'normalize': True, 'center': True, 'simplify': True,
+        'simplify_ratio': 0.5, 'smooth': True, 'smooth_iterations': 1
+    },
+    ('3d', 'augmenter'): {
+        'rotation': {'enabled': True},
+        'scale': {'enabled': True, 'factor': 0.2},
+        'noise': {'enabled': True, 'amplitude': 0.01},
+        'deform': {'enabled': True, 'strength': 0.1}
+    },
+}
+
+TEXT_AUGMENT_N_WORDS = {
+    'synonym_replacement': 3, 'mlm_replacement': 3,
+    'random_insertion': 3, 'random_deletion': 2
+}
+
+_WORDS = ('the quick brown fox jumps over a lazy dog while data scientists prepare large '
+          'datasets for training robust models and augmentation improves generalization').split()
+
+
+# --- Offline model stubs -----------------------------------------------------
+
+class _StubFillMask:
+    """Fill-mask pipeline stand-in returning fixed predictions for every [MASK]"""
+
+    def __call__(self, inputs, top_k=5, **kwargs):
+        if isinstance(inputs, str):
+            return self._predict(inputs, top_k)
+        return [self._predict(text, top_k) for text in inputs]
+
+    def _predict(self, text, top_k):
+        predictions = [
+            {'token_str': word, 'token': index, 'score': 1.0 / (index + 1), 'sequence': text}
+            for index, word in enumerate(_WORDS[:top_k])
+        ]
+        masks = text.count('[MASK]')
+        return predictions if masks <= 1 else [predictions] * masks
+
+
+class _StubMaskedLM:
+    """MaskedWordPredictor stand-in returning the same predictions for every mask"""
+
+    mask_token = '[MASK]'
+
+    def predict(self, texts, top_k=10):
+        return [[list(_WORDS[:top_k])] * text.count(self.mask_token) for text in texts]
+
+
+class _StubLemma:
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class _StubSynset:
+    def __init__(self, word):
+        self._word = word
+
+    def lemmas(self):
+        return [_StubLemma(self._word.upper()), _StubLemma(self._word[::-1])]
+
+
+class _StubWordNet:
+    """WordNet stand-in: words longer than three letters get two synonyms"""
+
+    ADJ, NOUN, VERB, ADV = 'a', 'n', 'v', 'r'
+
+    def synsets(self, word, pos=None):
+        return [_StubSynset(word)] if len(word) > 3 else []
+
+
+class _StubTagger:
+    def tag(self, words):
+        return [(word, 'NN') for word in words]
+
+
+def stub_models():
+    """Register offline stand-ins for every model that needs a download"""
+    registry.register('fill-mask', _StubFillMask)
+    registry.register('masked-lm', _StubMaskedLM)
+    registry.register('wordnet', _StubWordNet)
+    # No prebuilt index: every lookup goes through the stub WordNet
+    registry.register('synonym-index', SynonymIndex)
+    registry.register('pos-tagger', _StubTagger)
+
+
+# --- Synthetic inputs --------------------------------------------------------
+
+def make_text(size):
+    """Sentences of common words adding up to about size bytes"""
+    rng = random.Random(0)
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(_WORDS)
+        if rng.random() < 0.1:
+            word = word.capitalize() + rng.choice('.,!?')
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def make_image(width, height):
+    """PNG bytes of a smooth gradient with mild noise, so it compresses like a photo"""
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    pixels += rng.normal(0, 8, pixels.shape).astype(np.float32)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def make_audio(seconds, sample_rate=AUDIO_SAMPLE_RATE):
+    """Mono 16-bit WAV bytes of a chord with background noise"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    signal = sum(np.sin(2 * np.pi * frequency * t) for frequency in (220.0, 277.2, 329.6)) / 4
+    signal += rng.normal(0, 0.02, t.shape).astype(np.float32)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def make_mesh(size):
+    """OFF text of samples/sample_cube.off or of an icosphere with size subdivisions"""
+    if size == 'cube':
+        with open(os.path.join(REPO_ROOT, 'samples', 'sample_cube.off')) as f:
+            return f.read()
+
+    import trimesh
+    mesh = trimesh.creation.icosphere(subdivisions=size)
+    lines = ['OFF', f"{len(mesh.vertices)} {len(mesh.faces)} 0"]
+    lines.extend(' '.join(map(repr, vertex)) for vertex in mesh.vertices.tolist())
+    lines.extend(f"3 {a} {b} {c}" for a, b, c in mesh.faces.tolist())
+    return '\n'.join(lines) + '\n'
+
+
+def make_input(modality, size):
+    """Return (label, payload, units, unit name) for one synthetic input"""
+    if modality == 'text':
+        return f"{size // KB}KB", make_text(size), size, 'chars'
+    if modality == 'image':
+        width, height = size
+        return f"{width}x{height}", make_image(width, height), width * height, 'pixels'
+    if modality == 'audio':
+        return f"{size}s", make_audio(size), size, 'audio_seconds'
+    payload = make_mesh(size)
+    faces = int(payload.split('\n', 2)[1].split()[1])
+    label = 'cube' if size == 'cube' else f"ico{size}"
+    return label, payload, faces, 'faces'
+
+
+def as_json_payload(modality, payload):
+    """Encode a payload the way the JSON routes receive it"""
+    if modality == 'image':
+        return f"data:image/png;base64,{base64.b64encode(payload).decode()}"
+    if modality == 'audio':
+        return f"data:audio/wav;base64,{base64.b64encode(payload).decode()}"
+    return payload
+
+
+# --- Measurement -------------------------------------------------------------
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class PeakMemory:
+    """Sample resident memory in a background thread and keep the peak"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = None
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = _rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.baseline = _rss()
+        self.peak = self.baseline
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def delta(self):
+        if self.baseline is None or self.peak is None:
+            return None
+        return self.peak - self.baseline
+
+
+def run_once(call):
+    """Run call() once and return (total seconds, {step: seconds}, peak memory delta)"""
+    steps = {}
+
+    def on_step(event):
+        if event['event'] == 'step_finished':
+            steps[event['step']] = steps.get(event['step'], 0.0) + event['seconds']
+
+    with PeakMemory() as memory, step_context(on_step=on_step):
+        start = time.perf_counter()
+        call()
+        total = time.perf_counter() - start
+    return total, steps, memory.delta
+
+
+def bench_case(modality, role, size, repeat, json_payloads, final_only):
+    label, payload, units, unit_name = make_input(modality, size)
+    input_bytes = len(payload.encode('utf-8') if isinstance(payload, str) else payload)
+    processor = processors.get(modality, role)
+    options = dict(OPTIONS[(modality, role)])
+    if final_only:
+        options['return_steps'] = 'none'
+
+    if modality == 'text':
+        if role == 'preprocessor':
+            call = lambda: processor.preprocess(payload, options)
+        else:
+            call = lambda: processor.augment(payload, options, TEXT_AUGMENT_N_WORDS)
+    else:
+        method = getattr(processor, 'preprocess' if role == 'preprocessor' else 'augment')
+        if json_payloads:
+            data = as_json_payload(modality, payload)
+            call = lambda: method(data, options)
+        else:
+            call = lambda: method(payload, options, binary=True)
+
+    runs = [run_once(call) for _ in range(repeat)]
+    totals = [total for total, _, _ in runs]
+    step_names = list(runs[0][1])
+    median_total = statistics.median(totals)
+    step_seconds = {name: statistics.median(steps.get(name, 0.0) for _, steps, _ in runs)
+                    for name in step_names}
+    peaks = [peak for _, _, peak in runs if peak is not None]
+    return {
+        'processor': type(processor).__name__,
+        'modality': modality,
+        'role': role,
+        'size': label,
+        'input_bytes': input_bytes,
+        'units': units,
+        'unit': unit_name,
+        'repeat': repeat,
+        'total_seconds': median_total,
+        'min_seconds': min(totals),
+        'steps': step_seconds,
+        # Encoding results and everything between steps
+        'other_seconds': max(0.0, median_total - sum(step_seconds.values())),
+        'bytes_per_second': input_bytes / median_total if median_total else None,
+        'units_per_second': units / median_total if median_total else None,
+        'peak_rss_delta_bytes': max(peaks) if peaks else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _case_key(case):
+    return case['processor'], case['size']
+
+
+def print_case(case, baseline=None):
+    steps = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in case['steps'].items())
+    line = (f"{case['processor']:20s} {case['size']:>10s} {case['total_seconds']:9.3f}s "
+            f"{(case['bytes_per_second'] or 0) / MB:9.2f} MB/s "
+            f"{(case['peak_rss_delta_bytes'] or 0) / MB:8.1f} MB peak")
+    if baseline is not None and baseline.get('total_seconds'):
+        line += f"  x{baseline['total_seconds'] / case['total_seconds']:.2f} vs baseline"
+    print(line)
+    print(f"{'':32s}{steps}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick')
+    parser.add_argument('--only', nargs='*', choices=sorted(PRESETS['full']),
+                        help='modalities to run (all by default)')
+    parser.add_argument('--roles', nargs='*', choices=['preprocessor', 'augmenter'],
+                        default=['preprocessor', 'augmenter'])
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; medians are reported')
+    parser.add_argument('--max-seconds', type=float, default=300.0,
+                        help='skip larger sizes of a case once one run takes longer than this')
+    parser.add_argument('--json-payloads', action='store_true',
+                        help='pass base64/text payloads like the JSON routes instead of raw bytes')
+    parser.add_argument('--final-only', action='store_true',
+                        help="request the final result only (return_steps='none')")
+    parser.add_argument('--real-models', action='store_true',
+                        help='use the real fill-mask, WordNet and tagger models (needs downloads)')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report of an earlier run to compare against')
+    args = parser.parse_args()
+
+    if not args.real_models:
+        stub_models()
+    random.seed(0)
+    np.random.seed(0)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {_case_key(case): case for case in json.load(f)['cases'] if 'error' not in case}
+
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'git_commit': _git_commit(),
+        'preset': args.preset,
+        'stub_models': not args.real_models,
+        'json_payloads': args.json_payloads,
+        'final_only': args.final_only,
+        'cases': []
+    }
+    for modality, sizes in PRESETS[args.preset].items():
+        if args.only and modality not in args.only:
+            continue
+        for role in args.roles:
+            for size in sizes:
+                try:
+                    case = bench_case(modality, role, size, args.repeat,
+                                      args.json_payloads, args.final_only)
+                except Exception as e:
+                    case = {'modality': modality, 'role': role, 'size': str(size), 'error': str(e)}
+                    print(f"{modality} {role} {size}: failed: {e}")
+                    report['cases'].append(case)
+                    break
+                report['cases'].append(case)
+                print_case(case, baseline.get(_case_key(case)))
+                if case['min_seconds'] > args.max_seconds:
+                    print(f"{'':32s}over --max-seconds, skipping larger {modality} sizes")
+                    break
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Measure the cold import cost of the server and of each preprocessing module.
+
+Every measurement runs in a fresh interpreter so earlier imports do not hide
+the cost of shared dependencies such as torch.
+
+    python benchmarks/startup.py --repeat 3 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    'app',
+    'preprocessing.text_preprocessing',
+    'preprocessing.text_augmentation',
+    'preprocessing.image_preprocessing',
+    'preprocessing.image_augmentation',
+    'preprocessing.audio_preprocessing',
+    'preprocessing.audio_augmentation',
+    'preprocessing.threed_preprocessing',
+    'preprocessing.threed_augmentation',
+]
+
+_TIMER = (
+    "import time, sys\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+
+def time_import(module):
+    """Import module in a fresh interpreter and return the seconds it took"""
+    completed = subprocess.run(
+        [sys.executable, '-c', _TIMER.format(module=module)],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f"import {module} failed")
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='cold imports per module')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args()
+
+    report = {'python': sys.version.split()[0], 'repeat': args.repeat, 'modules': {}}
+    for module in args.modules:
+        try:
+            samples = [time_import(module) for _ in range(args.repeat)]
+            report['modules'][module] = {
+                'median_seconds': statistics.median(samples),
+                'min_seconds': min(samples),
+                'samples': samples
+            }
+            print(f"{module:45s} {statistics.median(samples):8.3f}s")
+        except RuntimeError as e:
+            report['modules'][module] = {'error': str(e)}
+            print(f"{module:45s} failed: {e}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+
+MODALITIES = ('text', 'image', 'audio', '3d')
+
+_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away; carries the HTTP status to answer with"""
+
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Lets at most max_concurrent callers run at once, with a bounded wait queue
+
+    Callers beyond the limit wait up to wait_timeout seconds for a free slot.
+    When max_waiting callers are already waiting, new ones are rejected at
+    once with 429; callers that time out while waiting get 503. A limit of 0
+    means unlimited.
+    """
+
+    def __init__(self, max_concurrent, max_waiting, wait_timeout):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._condition = threading.Condition()
+
+    def _has_slot(self):
+        return self.max_concurrent <= 0 or self.active < self.max_concurrent
+
+    def acquire(self):
+        with self._condition:
+            # Newcomers queue behind existing waiters rather than overtaking them
+            if self._has_slot() and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise AdmissionRejected("Too many requests in progress, try again later", 429, retry_after=1)
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.wait_timeout
+            try:
+                while not self._has_slot():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise AdmissionRejected("Timed out waiting for a free worker", 503,
+                                                retry_after=max(1, int(self.wait_timeout)))
+                    self._condition.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_waiting': self.max_waiting,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out
+            }
+
+
+class Slot:
+    """A held concurrency slot and the deadline of the work it admits"""
+
+    def __init__(self, limiter, deadline):
+        self.limiter = limiter
+        self.deadline = deadline
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        """Give the slot back; safe to call more than once"""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.limiter.release()
+
+
+def _parse_size(value):
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(value)
+
+
+def _parse_per_modality(value, parse=int):
+    """Parse "audio=2,3d=2" style settings into a dict"""
+    settings = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            modality, setting = item.split('=', 1)
+            settings[modality.strip()] = parse(setting)
+    return settings
+
+
+def _default_limits():
+    cpus = os.cpu_count() or 1
+    # Text is tokenized a piece (text_preprocessing.CHUNK_SIZE) at a time, so
+    # its cap is set for multi-MB documents, not for what fits one piece
+    return {
+        'concurrency': {'text': cpus * 4, 'image': cpus, 'audio': max(1, cpus // 2), '3d': max(1, cpus // 2)},
+        'max_payload_bytes': {'text': 64 * _UNITS['M'], 'image': 50 * _UNITS['M'],
+                              'audio': 200 * _UNITS['M'], '3d': 100 * _UNITS['M']},
+        'timeout_seconds': {'text': 30.0, 'image': 60.0, 'audio': 300.0, '3d': 300.0},
+    }
+
+
+class AdmissionController:
+    """Per-modality concurrency limits, payload size caps and processing timeouts
+
+    Settings are read from the environment as comma-separated modality=value
+    lists that override the CPU-based defaults:
+
+        CONCURRENCY_LIMITS=audio=2,3d=2    requests running at once (0: unlimited)
+        QUEUE_LIMITS=audio=4               requests waiting (default 2x concurrency)
+        QUEUE_WAIT_SECONDS=10              longest wait for a slot
+        MAX_PAYLOAD_BYTES=image=20M        request body cap (0: unlimited)
+        REQUEST_TIMEOUTS=audio=60          seconds before work is cancelled (0: none)
+    """
+
+    def __init__(self, concurrency, max_waiting, wait_timeout, max_payload_bytes, timeout_seconds):
+        self.max_payload_bytes = max_payload_bytes
+        self.timeout_seconds = timeout_seconds
+        self.limiters = {
+            modality: ConcurrencyLimiter(concurrency.get(modality, 0),
+                                         max_waiting.get(modality, 2 * concurrency.get(modality, 0)),
+                                         wait_timeout)
+            for modality in MODALITIES
+        }
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        defaults = _default_limits()
+        concurrency = dict(defaults['concurrency'], **_parse_per_modality(environ.get('CONCURRENCY_LIMITS')))
+        return cls(
+            concurrency=concurrency,
+            max_waiting=_parse_per_modality(environ.get('QUEUE_LIMITS')),
+            wait_timeout=float(environ.get('QUEUE_WAIT_SECONDS', 10)),
+            max_payload_bytes=dict(defaults['max_payload_bytes'],
+                                   **_parse_per_modality(environ.get('MAX_PAYLOAD_BYTES'), _parse_size)),
+            timeout_seconds=dict(defaults['timeout_seconds'],
+                                 **_parse_per_modality(environ.get('REQUEST_TIMEOUTS'), float)),
+        )
+
+    def payload_limit(self, modality, items=1):
+        """The body size cap for modality (times items for batches), or None for unlimited"""
+        limit = self.max_payload_bytes.get(modality, 0)
+        return limit * items if limit > 0 else None
+
+    def max_payload_limit(self, items=1):
+        """The largest cap of any modality, or None if one of them is unlimited"""
+        limits = [self.payload_limit(modality, items) for modality in MODALITIES]
+        return None if None in limits else max(limits)
+
+    def check_payload(self, modality, size, items=1):
+        """Reject a body larger than the modality's cap (times items for batches) with 413
+
+        Bodies of unknown size (chunked uploads) pass here; the caller must
+        stop reading them at payload_limit().
+        """
+        limit = self.payload_limit(modality, items)
+        if size is not None and limit is not None and size > limit:
+            raise AdmissionRejected(f"Payload of {size} bytes exceeds the {modality} limit of "
+                                    f"{limit} bytes", 413)
+
+    def admit(self, modality):
+        """Wait for a slot for this modality and return it with the work's deadline"""
+        limiter = self.limiters[modality]
+        limiter.acquire()
+        timeout = self.timeout_seconds.get(modality, 0)
+        return Slot(limiter, time.monotonic() + timeout if timeout > 0 else None)
+
+    def stats(self):
+        return {
+            modality: dict(limiter.stats(),
+                           max_payload_bytes=self.max_payload_bytes.get(modality, 0),
+                           timeout_seconds=self.timeout_seconds.get(modality, 0))
+            for modality, limiter in self.limiters.items()
+        }
@@ -5,6 +5,12 @@ import base64
 import logging
 import librosa
 import numpy as np
+from preprocessing.encoding import preview_audio
+from preprocessing.audio_quality import TIERS, resolve_tier, capped_rate
+from preprocessing.pipeline import StepRecorder, BatchStepRecorder
+from preprocessing.randomness import generators
+from preprocessing.result_cache import cached
+from preprocessing.spectral import griffin_lim, mask_along_axis
 
 # Set the audio backend to soundfile
 torchaudio.set_audio_backend("soundfile")
@@ -31,9 +37,8 @@ class AudioAugmenter:
             )
             
             # Convert back to torch tensor and maintain original shape
-            shifted_tensor = torch.FloatTensor(shifted)
-            if len(shifted_tensor.shape) == 1:
-                shifted_tensor = shifted_tensor.unsqueeze(0)
+            # (pitch shifting keeps the length, so stacked batches reshape back too)
+            shifted_tensor = torch.FloatTensor(shifted).reshape(waveform.shape)
                 
             logging.debug(f"Augmented waveform shape: {shifted_tensor.shape}")
             return shifted_tensor
@@ -48,12 +53,12 @@ class AudioAugmenter:
             # Ensure noise_level is between 0 and 1
             noise_level = max(0.0, min(1.0, noise_level))
             
-            # Calculate signal power
-            signal_power = waveform.norm(p=2)
+            # Calculate signal power (per clip when given a stacked batch)
+            signal_power = torch.linalg.vector_norm(waveform, dim=(-2, -1), keepdim=True)
             
             # Generate noise
-            noise = torch.randn_like(waveform)
-            noise_power = noise.norm(p=2)
+            noise = torch.randn(waveform.shape, dtype=waveform.dtype, generator=generators().torch)
+            noise_power = torch.linalg.vector_norm(noise, dim=(-2, -1), keepdim=True)
             
             # Scale noise to match desired SNR
             scaling_factor = signal_power / noise_power * noise_level
@@ -63,9 +68,8 @@ class AudioAugmenter:
             noisy_waveform = waveform + scaled_noise
             
             # Normalize to prevent clipping
-            max_val = torch.max(torch.abs(noisy_waveform))
-            if max_val > 1:
-                noisy_waveform = noisy_waveform / max_val
+            max_val = torch.amax(torch.abs(noisy_waveform), dim=(-2, -1), keepdim=True)
+            noisy_waveform = torch.where(max_val > 1, noisy_waveform / max_val, noisy_waveform)
                 
             return noisy_waveform
             
@@ -73,51 +77,59 @@ class AudioAugmenter:
             logging.error(f"Error in noise addition: {str(e)}")
             raise
 
-    def _time_mask(self, waveform, mask_param):
+    def _time_mask(self, waveform, mask_param, quality=TIERS['best']):
         """Apply time masking"""
-        time_masking = torchaudio.transforms.TimeMasking(time_mask_param=mask_param)
         # Convert to spectrogram for time masking
         spec = torchaudio.transforms.MelSpectrogram()(waveform)
-        masked_spec = time_masking(spec)
+        # A stacked batch draws a separate mask per clip
+        masked_spec = mask_along_axis(spec, mask_param, axis=-1, iid=waveform.dim() == 3)
         # Convert back to waveform using Griffin-Lim
-        griffin_lim = torchaudio.transforms.GriffinLim(
-            n_fft=spec.size(1) * 2 - 2,
-            n_iter=32
-        )
-        return griffin_lim(masked_spec)
+        return griffin_lim(masked_spec, n_fft=spec.size(-2) * 2 - 2, n_iter=quality['griffin_lim_iters'])
 
-    def _freq_mask(self, waveform, mask_param):
+    def _freq_mask(self, waveform, mask_param, quality=TIERS['best']):
         """Apply frequency masking"""
-        freq_masking = torchaudio.transforms.FrequencyMasking(freq_mask_param=mask_param)
         # Convert to spectrogram for frequency masking
         spec = torchaudio.transforms.MelSpectrogram()(waveform)
-        masked_spec = freq_masking(spec)
+        # A stacked batch draws a separate mask per clip
+        masked_spec = mask_along_axis(spec, mask_param, axis=-2, iid=waveform.dim() == 3)
         # Convert back to waveform using Griffin-Lim
-        griffin_lim = torchaudio.transforms.GriffinLim(
-            n_fft=spec.size(1) * 2 - 2,
-            n_iter=32
-        )
-        return griffin_lim(masked_spec)
+        return griffin_lim(masked_spec, n_fft=spec.size(-2) * 2 - 2, n_iter=quality['griffin_lim_iters'])
 
-    def _audio_to_base64(self, waveform, sample_rate):
-        """Convert audio tensor to base64 string"""
+    def _load_audio(self, audio_data):
+        """Load audio from a base64 data URL, raw bytes or a binary stream"""
+        if isinstance(audio_data, str):
+            # Remove the data URL prefix if present
+            if ',' in audio_data:
+                audio_data = audio_data.split(',')[1]
+            audio_data = io.BytesIO(base64.b64decode(audio_data))
+        elif isinstance(audio_data, (bytes, bytearray, memoryview)):
+            audio_data = io.BytesIO(audio_data)
+        return torchaudio.load(audio_data)
+
+    def _audio_to_bytes(self, waveform, sample_rate):
+        """Encode audio tensor as WAV bytes"""
         buffer = io.BytesIO()
         torchaudio.save(buffer, waveform, sample_rate, format="wav")
-        buffer.seek(0)
-        audio_b64 = base64.b64encode(buffer.getvalue()).decode()
+        return buffer.getvalue()
+
+    def _audio_to_base64(self, waveform, sample_rate):
+        """Convert audio tensor to base64 string"""
+        audio_b64 = base64.b64encode(self._audio_to_bytes(waveform, sample_rate)).decode()
         return f"data:audio/wav;base64,{audio_b64}"
 
-    def _apply_time_stretch(self, waveform, rate):
+    def _apply_time_stretch(self, waveform, rate, quality=TIERS['best']):
         """Apply time stretching to the audio waveform."""
+        n_fft = quality['n_fft']
+        hop_length = n_fft // 4
         if rate != 1.0:
             # Convert to mono if stereo
-            if waveform.size(0) > 1:
-                waveform = torch.mean(waveform, dim=0, keepdim=True)
+            if waveform.size(-2) > 1:
+                waveform = torch.mean(waveform, dim=-2, keepdim=True)
 
             # Create a complex spectrogram
             spec_transform = torchaudio.transforms.Spectrogram(
-                n_fft=2048,
-                hop_length=512,
+                n_fft=n_fft,
+                hop_length=hop_length,
                 power=None  # Get complex spectrogram
             )
             spec = spec_transform(waveform)
@@ -125,79 +137,136 @@ class AudioAugmenter:
             # Apply time stretch to the complex spectrogram
             stretch = torchaudio.transforms.TimeStretch(
                 fixed_rate=rate,
-                hop_length=512,
+                hop_length=hop_length,
                 n_freq=spec.shape[-2]
             )
             stretched_spec = stretch(spec)
 
             # Phase reconstruction using Griffin-Lim
-            griffin_lim = torchaudio.transforms.GriffinLim(
-                n_fft=2048,
-                hop_length=512
-            )
-            stretched_waveform = griffin_lim(torch.abs(stretched_spec))
+            stretched_waveform = griffin_lim(torch.abs(stretched_spec), n_fft=n_fft, hop_length=hop_length,
+                                             n_iter=quality['griffin_lim_iters'])
 
             return stretched_waveform
 
         return waveform
 
-    def augment(self, audio_data, options):
-        """Apply selected augmentation techniques"""
-        try:
-            logging.debug(f"Starting audio augmentation with options: {options}")
-            
-            # Remove the data URL prefix if present
-            if ',' in audio_data:
-                audio_data = audio_data.split(',')[1]
-            
-            # Decode base64 audio
-            audio_bytes = base64.b64decode(audio_data)
-            
-            # Create a buffer from the bytes
-            buffer = io.BytesIO(audio_bytes)
-            
-            # Load the audio file using torchaudio with soundfile backend
-            waveform, sample_rate = torchaudio.load(buffer)
-            logging.debug(f"Audio loaded successfully. Shape: {waveform.shape}, Sample rate: {sample_rate}")
+    def _uses_griffin_lim(self, options):
+        return bool(options.get('time_mask', {}).get('enabled') or
+                    options.get('freq_mask', {}).get('enabled') or
+                    (options.get('time_stretch', {}).get('enabled') and
+                     float(options['time_stretch'].get('rate', 1.0)) != 1.0))
+
+    def _output_rate(self, sample_rate, options):
+        """Sample rate of every step's output; lower quality tiers cap it for Griffin-Lim"""
+        if self._uses_griffin_lim(options):
+            return capped_rate(sample_rate, resolve_tier(options))
+        return sample_rate
+
+    def _apply_steps(self, recorder, waveform, sample_rate, options):
+        """Run the selected augmentations on a (channels, time) waveform or a stacked batch"""
+        quality = TIERS[resolve_tier(options)]
+        output_rate = self._output_rate(sample_rate, options)
+        if output_rate != sample_rate:
+            waveform = recorder.run('Downsample', torchaudio.functional.resample, waveform, sample_rate, output_rate)
+            sample_rate = output_rate
+
+        if options.get('time_stretch', {}).get('enabled'):
+            rate = float(options['time_stretch'].get('rate', 1.0))
+            waveform = recorder.run('Time Stretch', self._apply_time_stretch, waveform, rate, quality)
 
-            steps = {}
-            augmented_audio = waveform
+        # Pitch Shift
+        if options.get('pitch_shift', {}).get('enabled'):
+            n_steps = float(options['pitch_shift'].get('steps', 2))
+            waveform = recorder.run('Pitch Shift', self._pitch_shift, waveform, sample_rate, n_steps)
 
-            if options.get('time_stretch', {}).get('enabled'):
-                rate = float(options['time_stretch'].get('rate', 1.0))
-                augmented_audio = self._apply_time_stretch(augmented_audio, rate)
-                steps['Time Stretch'] = self._audio_to_base64(augmented_audio, sample_rate)
+        # Add Noise
+        if options.get('noise', {}).get('enabled'):
+            noise_level = float(options['noise'].get('level', 0.01))
+            waveform = recorder.run('Noise', self._add_noise, waveform, noise_level)
 
-            # Pitch Shift
-            if options.get('pitch_shift', {}).get('enabled'):
-                n_steps = float(options['pitch_shift'].get('steps', 2))
-                augmented_audio = self._pitch_shift(augmented_audio, sample_rate, n_steps)
-                steps['Pitch Shift'] = self._audio_to_base64(augmented_audio, sample_rate)
+        # Time Masking
+        if options.get('time_mask', {}).get('enabled'):
+            mask_param = int(options['time_mask'].get('param', 80))
+            waveform = recorder.run('Time Mask', self._time_mask, waveform, mask_param, quality)
 
-            # Add Noise
-            if options.get('noise', {}).get('enabled'):
-                noise_level = float(options['noise'].get('level', 0.01))
-                augmented_audio = self._add_noise(augmented_audio, noise_level)
-                steps['Noise'] = self._audio_to_base64(augmented_audio, sample_rate)
+        # Frequency Masking
+        if options.get('freq_mask', {}).get('enabled'):
+            mask_param = int(options['freq_mask'].get('param', 80))
+            waveform = recorder.run('Frequency Mask', self._freq_mask, waveform, mask_param, quality)
 
-            # Time Masking
-            if options.get('time_mask', {}).get('enabled'):
-                mask_param = int(options['time_mask'].get('param', 80))
-                augmented_audio = self._time_mask(augmented_audio, mask_param)
-                steps['Time Mask'] = self._audio_to_base64(augmented_audio, sample_rate)
+        return waveform
 
-            # Frequency Masking
-            if options.get('freq_mask', {}).get('enabled'):
-                mask_param = int(options['freq_mask'].get('param', 80))
-                augmented_audio = self._freq_mask(augmented_audio, mask_param)
-                steps['Frequency Mask'] = self._audio_to_base64(augmented_audio, sample_rate)
+    @cached(randomized=True)
+    def augment(self, audio_data, options, binary=False):
+        """Apply selected augmentation techniques
 
+        With binary=True the steps and result are WAV bytes instead of data URLs.
+        """
+        try:
+            logging.debug(f"Starting audio augmentation with options: {options}")
+
+            encode = self._audio_to_bytes if binary else self._audio_to_base64
+            # Late-bound: the output rate is known once the audio is decoded
+            recorder = StepRecorder(
+                lambda waveform: encode(waveform, output_rate), 'AudioAugmenter', options,
+                preview=lambda waveform: encode(*preview_audio(waveform, output_rate))
+            )
+
+            # Load the audio file using torchaudio with soundfile backend
+            with recorder.timed('Decode'):
+                waveform, sample_rate = self._load_audio(audio_data)
+            logging.debug(f"Audio loaded successfully. Shape: {waveform.shape}, Sample rate: {sample_rate}")
+            output_rate = self._output_rate(sample_rate, options)
+            augmented_audio = self._apply_steps(recorder, waveform, sample_rate, options)
 
             return {
-                'augmentation_steps': steps,
-                'augmented_audio': self._audio_to_base64(augmented_audio, sample_rate)
+                'augmentation_steps': recorder.steps,
+                'augmented_audio': recorder.encode(augmented_audio),
+                'quality': resolve_tier(options)
             }
 
         except Exception as e:
             logging.error(f"Error in augmentation: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
+
+    def augment_batch(self, audios, options, binary=False):
+        """Augment many clips with shared options
+
+        Clips with the same sample rate and shape are stacked into one
+        (batch, channels, time) tensor so every step runs once per stack;
+        noise and masks are still drawn per clip. Results keep input order;
+        inputs that fail get an error entry instead.
+        """
+        encode = self._audio_to_bytes if binary else self._audio_to_base64
+        results = [None] * len(audios)
+
+        groups = {}
+        for index, audio_data in enumerate(audios):
+            try:
+                waveform, sample_rate = self._load_audio(audio_data)
+                groups.setdefault((sample_rate, tuple(waveform.shape)), []).append((index, waveform))
+            except Exception as e:
+                results[index] = {'error': str(e)}
+
+        for (sample_rate, _), members in groups.items():
+            indices = [index for index, _ in members]
+            try:
+                output_rate = self._output_rate(sample_rate, options)
+                item_encode = lambda waveform, rate=output_rate: encode(waveform, rate)
+                preview = lambda waveform, rate=output_rate: encode(*preview_audio(waveform, rate))
+                recorders = [StepRecorder(item_encode, 'AudioAugmenter', options, preview=preview)
+                             for _ in members]
+                batch = torch.stack([waveform for _, waveform in members])
+                batch = self._apply_steps(BatchStepRecorder(recorders), batch, sample_rate, options)
+                for index, recorder, waveform in zip(indices, recorders, batch):
+                    results[index] = {
+                        'augmentation_steps': recorder.steps,
+                        'augmented_audio': recorder.encode(waveform),
+                        'quality': resolve_tier(options)
+                    }
+            except Exception as e:
+                logging.error(f"Error in batch augmentation: {str(e)}", exc_info=True)
+                for index in indices:
+                    results[index] = {'error': str(e)}
+
+        return results
@@ -3,6 +3,11 @@ import torchaudio
 import io
 import base64
 import logging
+from preprocessing.encoding import preview_audio
+from preprocessing.audio_quality import TIERS, resolve_tier, capped_rate
+from preprocessing.pipeline import StepRecorder, BatchStepRecorder
+from preprocessing.result_cache import cached
+from preprocessing.spectral import griffin_lim
 
 # Set the audio backend to soundfile
 torchaudio.set_audio_backend("soundfile")
@@ -12,71 +17,145 @@ class AudioPreprocessor:
         self.sample_rate = 16000
         logging.basicConfig(level=logging.DEBUG)
 
-    def preprocess(self, audio_data, options):
-        """Preprocess the audio with selected options"""
+    # Griffin-Lim starts from a random phase estimate
+    @cached(randomized=lambda options: bool(options.get('time_stretch') or options.get('mfcc')))
+    def preprocess(self, audio_data, options, binary=False):
+        """Preprocess the audio with selected options
+
+        With binary=True the steps and result are WAV bytes instead of data URLs.
+        """
         try:
             logging.debug(f"Starting audio preprocessing with options: {options}")
-            
-            # Remove the data URL prefix if present
-            if ',' in audio_data:
-                audio_data = audio_data.split(',')[1]
-            
-            # Decode base64 audio
-            audio_bytes = base64.b64decode(audio_data)
-            
-            # Create a buffer from the bytes
-            buffer = io.BytesIO(audio_bytes)
-            
+
+            encode = self._audio_to_bytes if binary else self._audio_to_base64
+            # Late-bound: the output rate is known once the audio is decoded
+            recorder = StepRecorder(
+                lambda waveform: encode(waveform, output_rate), 'AudioPreprocessor', options,
+                preview=lambda waveform: encode(*preview_audio(waveform, output_rate))
+            )
+
             # Load the audio file
             try:
-                waveform, sample_rate = torchaudio.load(buffer)
+                with recorder.timed('Decode'):
+                    waveform, sample_rate = self._load_audio(audio_data)
                 logging.debug(f"Audio loaded successfully. Shape: {waveform.shape}, Sample rate: {sample_rate}")
             except Exception as e:
                 logging.error(f"Error loading audio: {str(e)}")
                 raise
 
-            steps = {}
-            processed_audio = waveform
-
-            # Apply preprocessing steps
-            if options.get('resample'):
-                target_rate = int(options.get('target_sample_rate', 16000))
-                processed_audio = self._resample_audio(processed_audio, sample_rate, target_rate)
-                sample_rate = target_rate
-                steps['Resample'] = self._audio_to_base64(processed_audio, sample_rate)
-
-            if options.get('normalize'):
-                processed_audio = self._normalize_audio(processed_audio)
-                steps['Normalize'] = self._audio_to_base64(processed_audio, sample_rate)
-
-            if options.get('noise_reduction'):
-                processed_audio = self._apply_noise_reduction(processed_audio)
-                steps['Noise Reduction'] = self._audio_to_base64(processed_audio, sample_rate)
-
-            if options.get('time_stretch'):
-                rate = float(options.get('stretch_rate', 1.0))
-                processed_audio = self._apply_time_stretch(processed_audio, rate)
-                steps['Time Stretch'] = self._audio_to_base64(processed_audio, sample_rate)
-
-            if options.get('mfcc'):
-                processed_audio = self._apply_mfcc(processed_audio, sample_rate)
-                steps['MFCC'] = self._audio_to_base64(processed_audio, sample_rate)
+            output_rate = self._output_rate(sample_rate, options)
+            processed_audio = self._apply_steps(recorder, waveform, sample_rate, options)
 
             return {
-                'preprocessing_steps': steps,
-                'processed_audio': self._audio_to_base64(processed_audio, sample_rate)
+                'preprocessing_steps': recorder.steps,
+                'processed_audio': recorder.encode(processed_audio),
+                'quality': resolve_tier(options)
             }
 
         except Exception as e:
             logging.error(f"Error in preprocessing: {str(e)}", exc_info=True)
             raise
 
-    def _audio_to_base64(self, waveform, sample_rate):
-        """Convert audio tensor to base64 string"""
+    def _uses_griffin_lim(self, options):
+        return bool(options.get('mfcc') or
+                    (options.get('time_stretch') and float(options.get('stretch_rate', 1.0)) != 1.0))
+
+    def _output_rate(self, sample_rate, options):
+        """Sample rate of every step's output; resampling is always the first step"""
+        if options.get('resample'):
+            sample_rate = int(options.get('target_sample_rate', 16000))
+        if self._uses_griffin_lim(options):
+            sample_rate = capped_rate(sample_rate, resolve_tier(options))
+        return sample_rate
+
+    def _apply_steps(self, recorder, waveform, sample_rate, options):
+        """Run the selected steps on a (channels, time) waveform or a stacked batch"""
+        quality = TIERS[resolve_tier(options)]
+        output_rate = self._output_rate(sample_rate, options)
+        if options.get('resample'):
+            waveform = recorder.run('Resample', self._resample_audio, waveform, sample_rate, output_rate)
+            sample_rate = output_rate
+        elif output_rate != sample_rate:
+            # Lower quality tiers run Griffin-Lim at a capped sample rate
+            waveform = recorder.run('Downsample', self._resample_audio, waveform, sample_rate, output_rate)
+            sample_rate = output_rate
+
+        if options.get('normalize'):
+            waveform = recorder.run('Normalize', self._normalize_audio, waveform)
+
+        if options.get('noise_reduction'):
+            waveform = recorder.run('Noise Reduction', self._apply_noise_reduction, waveform)
+
+        if options.get('time_stretch'):
+            rate = float(options.get('stretch_rate', 1.0))
+            waveform = recorder.run('Time Stretch', self._apply_time_stretch, waveform, rate, quality)
+
+        if options.get('mfcc'):
+            waveform = recorder.run('MFCC', self._apply_mfcc, waveform, sample_rate, quality=quality)
+
+        return waveform
+
+    def preprocess_batch(self, audios, options, binary=False):
+        """Preprocess many clips with shared options
+
+        Clips with the same sample rate and shape are stacked into one
+        (batch, channels, time) tensor so every step runs once per stack.
+        Results keep input order; inputs that fail get an error entry instead.
+        """
+        encode = self._audio_to_bytes if binary else self._audio_to_base64
+        results = [None] * len(audios)
+
+        groups = {}
+        for index, audio_data in enumerate(audios):
+            try:
+                waveform, sample_rate = self._load_audio(audio_data)
+                groups.setdefault((sample_rate, tuple(waveform.shape)), []).append((index, waveform))
+            except Exception as e:
+                results[index] = {'error': str(e)}
+
+        for (sample_rate, _), members in groups.items():
+            indices = [index for index, _ in members]
+            try:
+                output_rate = self._output_rate(sample_rate, options)
+                item_encode = lambda waveform, rate=output_rate: encode(waveform, rate)
+                preview = lambda waveform, rate=output_rate: encode(*preview_audio(waveform, rate))
+                recorders = [StepRecorder(item_encode, 'AudioPreprocessor', options, preview=preview)
+                             for _ in members]
+                batch = torch.stack([waveform for _, waveform in members])
+                batch = self._apply_steps(BatchStepRecorder(recorders), batch, sample_rate, options)
+                for index, recorder, waveform in zip(indices, recorders, batch):
+                    results[index] = {
+                        'preprocessing_steps': recorder.steps,
+                        'processed_audio': recorder.encode(waveform),
+                        'quality': resolve_tier(options)
+                    }
+            except Exception as e:
+                logging.error(f"Error in batch preprocessing: {str(e)}", exc_info=True)
+                for index in indices:
+                    results[index] = {'error': str(e)}
+
+        return results
+
+    def _load_audio(self, audio_data):
+        """Load audio from a base64 data URL, raw bytes or a binary stream"""
+        if isinstance(audio_data, str):
+            # Remove the data URL prefix if present
+            if ',' in audio_data:
+                audio_data = audio_data.split(',')[1]
+            audio_data = io.BytesIO(base64.b64decode(audio_data))
+        elif isinstance(audio_data, (bytes, bytearray, memoryview)):
+            audio_data = io.BytesIO(audio_data)
+        return torchaudio.load(audio_data)
+
+    def _audio_to_bytes(self, waveform, sample_rate):
+        """Encode audio tensor as WAV bytes"""
         buffer = io.BytesIO()
         torchaudio.save(buffer, waveform, sample_rate, format="wav")
-        buffer.seek(0)
-        audio_b64 = base64.b64encode(buffer.getvalue()).decode()
+        return buffer.getvalue()
+
+    def _audio_to_base64(self, waveform, sample_rate):
+        """Convert audio tensor to base64 string"""
+        audio_b64 = base64.b64encode(self._audio_to_bytes(waveform, sample_rate)).decode()
         return f"data:audio/wav;base64,{audio_b64}"
 
     def _resample_audio(self, waveform, original_sample_rate, target_sample_rate):
@@ -91,8 +170,9 @@ class AudioPreprocessor:
 
     def _normalize_audio(self, waveform):
         """Normalize audio using mean and standard deviation"""
-        mean = torch.mean(waveform)
-        std = torch.std(waveform)
+        # Statistics over the last two dims, so a stacked batch is normalized per clip
+        mean = torch.mean(waveform, dim=(-2, -1), keepdim=True)
+        std = torch.std(waveform, dim=(-2, -1), keepdim=True)
         return (waveform - mean) / (std + 1e-8)
 
     def _apply_noise_reduction(self, waveform):
@@ -129,17 +209,19 @@ class AudioPreprocessor:
         
         return inverse_transform(cleaned_spec)
 
-    def _apply_time_stretch(self, waveform, rate):
+    def _apply_time_stretch(self, waveform, rate, quality=TIERS['best']):
         """Apply time stretching to the audio waveform."""
+        n_fft = quality['n_fft']
+        hop_length = n_fft // 4
         if rate != 1.0:
             # Convert to mono if stereo
-            if waveform.size(0) > 1:
-                waveform = torch.mean(waveform, dim=0, keepdim=True)
+            if waveform.size(-2) > 1:
+                waveform = torch.mean(waveform, dim=-2, keepdim=True)
 
             # Create a complex spectrogram
             spec_transform = torchaudio.transforms.Spectrogram(
-                n_fft=2048,
-                hop_length=512,
+                n_fft=n_fft,
+                hop_length=hop_length,
                 power=None  # Get complex spectrogram
             )
             spec = spec_transform(waveform)
@@ -147,33 +229,32 @@ class AudioPreprocessor:
             # Apply time stretch to the complex spectrogram
             stretch = torchaudio.transforms.TimeStretch(
                 fixed_rate=rate,
-                hop_length=512,
+                hop_length=hop_length,
                 n_freq=spec.shape[-2]
             )
             stretched_spec = stretch(spec)
 
             # Phase reconstruction using Griffin-Lim
-            griffin_lim = torchaudio.transforms.GriffinLim(
-                n_fft=2048,
-                hop_length=512
-            )
-            stretched_waveform = griffin_lim(torch.abs(stretched_spec))
+            stretched_waveform = griffin_lim(torch.abs(stretched_spec), n_fft=n_fft, hop_length=hop_length,
+                                             n_iter=quality['griffin_lim_iters'])
 
             return stretched_waveform
 
         return waveform
 
-    def _apply_mfcc(self, waveform, sample_rate, n_mfcc=13):
+    def _apply_mfcc(self, waveform, sample_rate, n_mfcc=13, quality=TIERS['best']):
         """Apply MFCC transform and reconstruct audio"""
+        n_fft = quality['n_fft']
+        hop_length = n_fft // 4
         try:
             # Convert to mono if stereo
-            if waveform.size(0) > 1:
-                waveform = torch.mean(waveform, dim=0, keepdim=True)
+            if waveform.size(-2) > 1:
+                waveform = torch.mean(waveform, dim=-2, keepdim=True)
                 
             # Create spectrogram transform
             spec_transform = torchaudio.transforms.Spectrogram(
-                n_fft=2048,
-                hop_length=512,
+                n_fft=n_fft,
+                hop_length=hop_length,
                 power=2.0
             )
             
@@ -182,9 +263,9 @@ class AudioPreprocessor:
                 sample_rate=sample_rate,
                 n_mfcc=n_mfcc,
                 melkwargs={
-                    'n_fft': 2048,
+                    'n_fft': n_fft,
                     'n_mels': 128,
-                    'hop_length': 512
+                    'hop_length': hop_length
                 }
             )
             
@@ -195,14 +276,8 @@ class AudioPreprocessor:
             _ = mfcc_transform(waveform)
             
             # Convert back to audio using Griffin-Lim
-            griffin_lim = torchaudio.transforms.GriffinLim(
-                n_fft=2048,
-                hop_length=512,
-                n_iter=32
-            )
-            
-            # Reconstruct audio from spectrogram
-            reconstructed = griffin_lim(spec)
+            reconstructed = griffin_lim(spec, n_fft=n_fft, hop_length=hop_length,
+                                        n_iter=quality['griffin_lim_iters'])
             
             return reconstructed.unsqueeze(0) if reconstructed.dim() == 1 else reconstructed
             
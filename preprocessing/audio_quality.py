@@ -0,0 +1,46 @@
+import os
+
+# Settings for the steps that rebuild a waveform with Griffin-Lim. 'best'
+# matches the original fixed settings; the lower tiers trade fidelity for
+# fewer iterations, a smaller FFT and a capped sample rate.
+TIERS = {
+    'fast': {'griffin_lim_iters': 8, 'n_fft': 1024, 'max_sample_rate': 16000},
+    'balanced': {'griffin_lim_iters': 16, 'n_fft': 2048, 'max_sample_rate': 22050},
+    'best': {'griffin_lim_iters': 32, 'n_fft': 2048, 'max_sample_rate': None},
+}
+
+DEFAULT_TIER = 'best'
+
+# Backlog (queued jobs plus requests waiting for an audio slot) at which
+# 'auto' drops to balanced and to fast
+AUTO_BALANCED_DEPTH = int(os.environ.get('AUDIO_AUTO_BALANCED_DEPTH', 2))
+AUTO_FAST_DEPTH = int(os.environ.get('AUDIO_AUTO_FAST_DEPTH', 8))
+
+
+def choose_tier(backlog):
+    """Pick the tier 'auto' means for the given backlog"""
+    if backlog >= AUTO_FAST_DEPTH:
+        return 'fast'
+    if backlog >= AUTO_BALANCED_DEPTH:
+        return 'balanced'
+    return 'best'
+
+
+def resolve_tier(options, backlog=0):
+    """Return the concrete tier named by options['quality']
+
+    'auto' is resolved against backlog; callers that know the server's load
+    resolve it before the options reach a processor.
+    """
+    quality = options.get('quality') or DEFAULT_TIER
+    if quality == 'auto':
+        return choose_tier(backlog)
+    if quality not in TIERS:
+        raise ValueError(f"Unknown audio quality '{quality}', expected one of {sorted(TIERS)} or 'auto'")
+    return quality
+
+
+def capped_rate(sample_rate, tier):
+    """The sample rate Griffin-Lim steps run at for this tier"""
+    limit = TIERS[tier]['max_sample_rate']
+    return min(sample_rate, limit) if limit else sample_rate
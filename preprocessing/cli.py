@@ -0,0 +1,304 @@
+"""Run a preprocessor or augmenter over a directory of files, offline.
+
+    python -m preprocessing.cli image augment samples/ out/ --options opts.json
+    python -m preprocessing.cli audio preprocess --manifest files.txt out/ --workers 8
+
+Each input is written to the output directory under its relative path with
+the modality's extension (.png, .wav, .off, or .json for text; .npy for
+images with "output_format": "npy"). Outputs are written atomically, so an
+interrupted run can be restarted and skips every item that already has an
+output. Failures are appended to _failures.jsonl in
+the output directory.
+
+Text preprocessing maps tokens to ids with one saved vocabulary (--vocab,
+by default _vocab in the output directory). If it does not exist yet, a
+first pass builds it from every input, so ids agree across workers and
+across restarted runs.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from preprocessing.processors import MODALITIES, processors
+
+EXTENSIONS = {
+    'text': ('.txt',),
+    'image': ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tif', '.tiff'),
+    'audio': ('.wav', '.flac', '.ogg', '.mp3'),
+    '3d': ('.off',),
+}
+
+OUTPUT_EXTENSIONS = {'text': '.json', 'image': '.png', 'audio': '.wav', '3d': '.off'}
+
+# (modality, role) -> key of the final result in the processor's output
+RESULT_KEYS = {
+    ('image', 'preprocess'): 'processed_image',
+    ('image', 'augment'): 'augmented_image',
+    ('audio', 'preprocess'): 'processed_audio',
+    ('audio', 'augment'): 'augmented_audio',
+    ('3d', 'preprocess'): 'processed_model',
+    ('3d', 'augment'): 'augmented_model',
+}
+
+ROLES = {'preprocess': 'preprocessor', 'augment': 'augmenter'}
+
+
+def load_options(path):
+    """Read processor options from a JSON or YAML file"""
+    if path is None:
+        return {}
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("YAML options need PyYAML: pip install pyyaml")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def find_inputs(modality, input_dir=None, manifest=None):
+    """Return (path, relative path) pairs from a directory walk or a manifest
+
+    Manifests list one path per line, relative to the manifest's directory;
+    blank lines and lines starting with # are ignored.
+    """
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        items = []
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                path = os.path.join(base, line)
+                relative = os.path.normpath(line)
+                # Keep outputs inside the output directory
+                if os.path.isabs(relative) or relative.startswith('..'):
+                    relative = os.path.basename(relative)
+                items.append((path, relative))
+        return items
+
+    items = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(EXTENSIONS[modality]):
+                path = os.path.join(root, name)
+                items.append((path, os.path.relpath(path, input_dir)))
+    return items
+
+
+def output_path(output_dir, relative, modality, options=None):
+    extension = OUTPUT_EXTENSIONS[modality]
+    # Images requested as float arrays are written as .npy
+    if modality == 'image' and (options or {}).get('output_format') == 'npy':
+        extension = '.npy'
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+
+
+def _write_atomic(path, data):
+    """Write to a temporary file and rename it, so partial outputs never look finished"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def _item_seed(seed, relative):
+    """Derive a stable per-item seed so reruns reproduce the same augmentations"""
+    digest = hashlib.sha256(f"{seed}:{relative}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big')
+
+
+def process_item(modality, role, path, relative, destination, options, seed, keep_steps):
+    """Worker entry point: run one file through the processor and write its output
+
+    Returns the number of input bytes read.
+    """
+    processor = processors.get(modality, ROLES[role])
+    options = dict(options)
+    if seed is not None:
+        options['seed'] = _item_seed(seed, relative)
+    if not keep_steps:
+        options['return_steps'] = 'none'
+
+    if modality == 'text':
+        if role == 'preprocess':
+            # Tokenized in chunks straight from the file, so large documents
+            # are never held in memory whole
+            with open(path, encoding='utf-8') as f:
+                result = processor.preprocess_stream(f, options)
+        else:
+            from preprocessing.text_augmentation import augment_args
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            result = processor.augment(text, *augment_args(options))
+        _write_atomic(destination, json.dumps(result).encode('utf-8'))
+        return os.path.getsize(path)
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    result = getattr(processor, role)(data, options, binary=True)
+
+    extension = OUTPUT_EXTENSIONS[modality]
+    steps_key = 'preprocessing_steps' if role == 'preprocess' else 'augmentation_steps'
+    steps_dir = os.path.splitext(destination)[0] + '.steps'
+    for name, output in result.get(steps_key, {}).items():
+        _write_atomic(os.path.join(steps_dir, name.replace(' ', '_').lower() + extension), output)
+    # The final output goes last: its existence marks the item as finished
+    _write_atomic(destination, result[RESULT_KEYS[(modality, role)]])
+    return len(data)
+
+
+def build_vocabulary(paths, options, destination):
+    """Collect the tokens of every text file into a vocabulary saved at destination
+
+    Ids follow the order tokens first appear in, reading the files in
+    order, as one process preprocessing them would have assigned them.
+    """
+    from preprocessing.vocabulary import Vocabulary
+
+    processor = processors.get('text', 'preprocessor')
+    vocabulary = Vocabulary(max_size=int(os.environ.get('TEXT_VOCAB_MAX_SIZE', 100000)) or None)
+    # Padded results only look up the first padding_length tokens
+    limit = int(options.get('padding_length', 20)) if options.get('padding') else None
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            vocabulary.lookup_many(processor.tokenize(f, options, limit))
+
+    # Saved beside the final path and renamed, so workers never load a half-written vocabulary
+    temporary = f"{destination.rstrip(os.sep)}.{os.getpid()}.tmp"
+    vocabulary.save(temporary)
+    os.replace(temporary, destination)
+    return len(vocabulary)
+
+
+def _configure_workers(workers):
+    """Keep worker processes from oversubscribing the CPU and caching unique inputs"""
+    if workers > 1:
+        for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+            os.environ.setdefault(name, '1')
+    os.environ.setdefault('RESULT_CACHE_MAX_BYTES', '0')
+
+
+def run(modality, role, items, output_dir, options, workers, seed=None,
+        keep_steps=False, overwrite=False, report_every=10.0, vocab=None):
+    """Process every item not already done and return a throughput summary
+
+    vocab is the text vocabulary directory (default: TEXT_VOCAB_PATH, then
+    _vocab in output_dir), built from all items if it does not exist.
+    """
+    pending = []
+    skipped = 0
+    for path, relative in items:
+        destination = output_path(output_dir, relative, modality, options)
+        if not overwrite and os.path.exists(destination):
+            skipped += 1
+        else:
+            pending.append((path, relative, destination))
+
+    print(f"{len(items)} inputs, {skipped} already done, {len(pending)} to process "
+          f"with {workers} worker(s)")
+    summary = {'total': len(items), 'skipped': skipped, 'completed': 0, 'failed': 0, 'bytes': 0}
+    if not pending:
+        summary.update(seconds=0.0, items_per_second=0.0, bytes_per_second=0.0)
+        return summary
+
+    _configure_workers(workers)
+    os.makedirs(output_dir, exist_ok=True)
+    if modality == 'text' and role == 'preprocess':
+        vocab = os.path.abspath(vocab or os.environ.get('TEXT_VOCAB_PATH') or os.path.join(output_dir, '_vocab'))
+        if not os.path.exists(os.path.join(vocab, 'meta.json')):
+            print(f"Building vocabulary at {vocab}")
+            size = build_vocabulary([path for path, _ in items], options, vocab)
+            print(f"{size} tokens in vocabulary")
+        # Spawned workers inherit the environment and load it read-only
+        os.environ['TEXT_VOCAB_PATH'] = vocab
+    failures_path = os.path.join(output_dir, '_failures.jsonl')
+
+    start = time.perf_counter()
+    last_report = start
+    # Spawned workers import only the modality they need, not the parent's state
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor, \
+            open(failures_path, 'a') as failures:
+        futures = {
+            executor.submit(process_item, modality, role, path, relative, destination,
+                            options, seed, keep_steps): relative
+            for path, relative, destination in pending
+        }
+        for future in as_completed(futures):
+            try:
+                summary['bytes'] += future.result()
+                summary['completed'] += 1
+            except Exception as e:
+                summary['failed'] += 1
+                failures.write(json.dumps({'input': futures[future], 'error': str(e)}) + '\n')
+                failures.flush()
+                logging.error(f"{futures[future]}: {e}")
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                last_report = now
+                done = summary['completed'] + summary['failed']
+                print(f"{done}/{len(pending)} done, {summary['failed']} failed, "
+                      f"{done / (now - start):.2f} items/s, "
+                      f"{summary['bytes'] / (now - start) / 1e6:.2f} MB/s")
+
+    seconds = time.perf_counter() - start
+    summary['seconds'] = seconds
+    summary['items_per_second'] = summary['completed'] / seconds
+    summary['bytes_per_second'] = summary['bytes'] / seconds
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n'.join(__doc__.splitlines()[1:])
+    )
+    parser.add_argument('modality', choices=sorted(MODALITIES))
+    parser.add_argument('role', choices=sorted(ROLES))
+    parser.add_argument('input_dir', nargs='?', help='directory to walk for inputs')
+    parser.add_argument('output_dir')
+    parser.add_argument('--manifest', help='file listing inputs, one path per line')
+    parser.add_argument('--options', help='JSON or YAML file of processor options')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int,
+                        help='seed augmentations per item so reruns reproduce them')
+    parser.add_argument('--keep-steps', action='store_true',
+                        help='also write every intermediate step next to each output')
+    parser.add_argument('--overwrite', action='store_true', help='reprocess items that already have outputs')
+    parser.add_argument('--report', help='write the throughput summary as JSON to this file')
+    parser.add_argument('--vocab', help='text vocabulary directory, built from the inputs if missing '
+                                        '(default: TEXT_VOCAB_PATH or OUTPUT_DIR/_vocab)')
+    args = parser.parse_args(argv)
+
+    if bool(args.input_dir) == bool(args.manifest):
+        parser.error('give either an input directory or --manifest')
+
+    items = find_inputs(args.modality, args.input_dir, args.manifest)
+    summary = run(args.modality, args.role, items, args.output_dir, load_options(args.options),
+                  max(1, args.workers), seed=args.seed, keep_steps=args.keep_steps,
+                  overwrite=args.overwrite, vocab=args.vocab)
+    print(f"Completed {summary['completed']}, failed {summary['failed']}, "
+          f"skipped {summary['skipped']} in {summary['seconds']:.1f}s "
+          f"({summary['items_per_second']:.2f} items/s, {summary['bytes_per_second'] / 1e6:.2f} MB/s)")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
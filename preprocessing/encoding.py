@@ -0,0 +1,90 @@
+"""Result encoders and step previews shared by a modality's preprocessor and augmenter
+
+Each helper imports its modality's libraries when first called, so loading
+this module does not pull in torch, trimesh or torchaudio for the others.
+"""
+import base64
+import io
+
+NPY_MIMETYPE = 'application/x-npy'
+
+
+# --- Images ------------------------------------------------------------------
+
+def uses_tensors(options):
+    """Whether the image steps run on one float tensor instead of PIL images"""
+    return bool(options.get('tensor_pipeline')) or options.get('output_format') == 'npy'
+
+
+def tensor_to_image(tensor):
+    """Convert a float CHW tensor to a PIL image, clipping it to [0, 1]"""
+    from torchvision import transforms
+    return transforms.functional.to_pil_image(tensor.clamp(0, 1))
+
+
+def tensor_to_npy(tensor):
+    """Encode a float CHW tensor as .npy bytes (float32, unclipped)"""
+    import numpy as np
+    buffered = io.BytesIO()
+    np.save(buffered, tensor.numpy().astype(np.float32, copy=False))
+    return buffered.getvalue()
+
+
+def final_encoder(options, binary):
+    """Encoder for the final image when output_format asks for .npy, else None"""
+    if options.get('output_format') != 'npy':
+        return None
+    if binary:
+        return tensor_to_npy
+    return lambda tensor: f"data:{NPY_MIMETYPE};base64,{base64.b64encode(tensor_to_npy(tensor)).decode()}"
+
+
+def preview_image(image, max_size=128):
+    """Shrink a PIL image or uint8/float tensor to a thumbnail for step previews"""
+    import torch
+    from torchvision import transforms
+    if isinstance(image, torch.Tensor) and image.is_floating_point():
+        image = tensor_to_image(image)
+    elif isinstance(image, torch.Tensor):
+        image = transforms.functional.to_pil_image(image)
+    else:
+        image = image.copy()
+    image.thumbnail((max_size, max_size))
+    return image
+
+
+# --- 3D ----------------------------------------------------------------------
+
+def preview_mesh(mesh, max_faces=2000):
+    """Decimate a mesh by vertex clustering for step previews"""
+    import numpy as np
+    import trimesh
+    if len(mesh.faces) <= max_faces:
+        return mesh
+    # A grid of this resolution leaves on the order of max_faces surface faces
+    resolution = max(4, int(np.sqrt(max_faces / 4)))
+    cell = max(mesh.extents.max(), 1e-12) / resolution
+    keys = np.floor((mesh.vertices - mesh.bounds[0]) / cell).astype(np.int64)
+    _, cluster = np.unique(keys, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+
+    counts = np.bincount(cluster)
+    vertices = np.zeros((len(counts), 3))
+    np.add.at(vertices, cluster, mesh.vertices)
+    vertices /= counts[:, None]
+
+    faces = cluster[mesh.faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    return trimesh.Trimesh(vertices=vertices, faces=faces[keep], process=False)
+
+
+# --- Audio -------------------------------------------------------------------
+
+def preview_audio(waveform, sample_rate, seconds=5, preview_rate=8000):
+    """Cut a clip to its first seconds at a low sample rate for step previews"""
+    import torchaudio
+    waveform = waveform[..., :int(sample_rate * seconds)]
+    if sample_rate > preview_rate:
+        waveform = torchaudio.functional.resample(waveform, sample_rate, preview_rate)
+        sample_rate = preview_rate
+    return waveform, sample_rate
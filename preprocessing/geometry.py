@@ -0,0 +1,135 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+# Transforms are 3x3 matrices acting on pixel coordinates centered on the
+# image (x to the right, y down), mapping input positions to output positions.
+
+
+def rotation(angle):
+    """Rotate counter-clockwise by angle degrees about the center, like transforms.functional.rotate"""
+    radians = math.radians(angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    return torch.tensor([[cos, sin, 0.0], [-sin, cos, 0.0], [0.0, 0.0, 1.0]], dtype=torch.float64)
+
+
+def flip(direction):
+    """Mirror horizontally or vertically"""
+    if direction == 'horizontal':
+        return torch.diag(torch.tensor([-1.0, 1.0, 1.0], dtype=torch.float64))
+    return torch.diag(torch.tensor([1.0, -1.0, 1.0], dtype=torch.float64))
+
+
+def scale(sx, sy):
+    return torch.diag(torch.tensor([sx, sy, 1.0], dtype=torch.float64))
+
+
+def translation(tx, ty):
+    return torch.tensor([[1.0, 0.0, tx], [0.0, 1.0, ty], [0.0, 0.0, 1.0]], dtype=torch.float64)
+
+
+def shear(degrees_x, degrees_y=0.0):
+    return torch.tensor([[1.0, math.tan(math.radians(degrees_x)), 0.0],
+                         [math.tan(math.radians(degrees_y)), 1.0, 0.0],
+                         [0.0, 0.0, 1.0]], dtype=torch.float64)
+
+
+class AffineStage:
+    """A chain of geometric operations composed into one matrix
+
+    Operations are added in the order they apply. Each returns the stage,
+    and resize() also changes the output size, so rotate, flip, resize,
+    translate and shear all end in one resampling pass by warp().
+    """
+
+    def __init__(self, width, height):
+        self.input_size = (width, height)
+        self.size = (width, height)
+        self.matrix = torch.eye(3, dtype=torch.float64)
+
+    def then(self, matrix, size=None):
+        stage = AffineStage(*self.input_size)
+        stage.matrix = matrix @ self.matrix
+        stage.size = size or self.size
+        return stage
+
+    def rotate(self, angle):
+        return self.then(rotation(angle))
+
+    def flip(self, direction):
+        return self.then(flip(direction))
+
+    def resize(self, width, height):
+        return self.then(scale(width / self.size[0], height / self.size[1]), (width, height))
+
+    def translate(self, tx, ty):
+        return self.then(translation(tx, ty))
+
+    def shear(self, degrees_x, degrees_y=0.0):
+        return self.then(shear(degrees_x, degrees_y))
+
+    def from_input(self, width, height):
+        """The same transform, reading from the input resized to width x height"""
+        stage = AffineStage(width, height)
+        stage.matrix = self.matrix @ scale(self.input_size[0] / width, self.input_size[1] / height)
+        stage.size = self.size
+        return stage
+
+    def theta(self):
+        """The 2x3 matrix affine_grid expects: normalized output to normalized input coordinates"""
+        (in_width, in_height), (out_width, out_height) = self.input_size, self.size
+        to_input = torch.diag(torch.tensor([2 / in_width, 2 / in_height, 1.0], dtype=torch.float64))
+        from_output = torch.diag(torch.tensor([out_width / 2, out_height / 2, 1.0], dtype=torch.float64))
+        return (to_input @ torch.linalg.inv(self.matrix) @ from_output)[:2].float()
+
+
+# Input pixels per output pixel above which warp() prefilters the input
+PREFILTER_RATIO = 2.0
+
+
+def _prefilter(batch, stages):
+    """Shrink a float batch ahead of a warp that downscales it by PREFILTER_RATIO or more
+
+    grid_sample reads one (bilinear: four) input pixels per output pixel,
+    so a large downscale skips most of the input and aliases. An
+    antialiased resize by the warp's scale along each input axis, like the
+    unfused Resize, averages them first; the stages are rebased onto the
+    smaller input.
+    """
+    # Input pixels covered by one output pixel, along each input axis
+    footprints = torch.stack([torch.linalg.inv(stage.matrix)[:2, :2].norm(dim=1) for stage in stages])
+    ratio_x, ratio_y = footprints.min(dim=0).values.tolist()
+    if max(ratio_x, ratio_y) < PREFILTER_RATIO:
+        return batch, stages
+
+    in_width, in_height = stages[0].input_size
+    width = max(1, round(in_width / ratio_x)) if ratio_x >= PREFILTER_RATIO else in_width
+    height = max(1, round(in_height / ratio_y)) if ratio_y >= PREFILTER_RATIO else in_height
+    batch = F.interpolate(batch, size=(height, width), mode='bilinear', align_corners=False, antialias=True)
+    return batch, [stage.from_input(width, height) for stage in stages]
+
+
+def warp(images, stages, mode='nearest'):
+    """Resample a CHW image or NCHW batch once through its AffineStage(s)
+
+    stages is one stage for all images or one per image; all must share
+    the output size. uint8 input is returned as uint8, float as float.
+    Pixels mapped from outside the input are filled with 0. Bilinear warps
+    that downscale by PREFILTER_RATIO or more are antialiased first.
+    """
+    single = images.dim() == 3
+    batch = images.unsqueeze(0) if single else images
+    if isinstance(stages, AffineStage):
+        stages = [stages] * batch.size(0)
+    source = batch if batch.is_floating_point() else batch.float()
+    if mode == 'bilinear':
+        source, stages = _prefilter(source, stages)
+    width, height = stages[0].size
+    theta = torch.stack([stage.theta() for stage in stages])
+    grid = F.affine_grid(theta, (batch.size(0), batch.size(1), height, width), align_corners=False)
+
+    warped = F.grid_sample(source, grid.to(batch.device), mode=mode, padding_mode='zeros', align_corners=False)
+    if not batch.is_floating_point():
+        warped = warped.round().clamp(0, 255).to(batch.dtype)
+    return warped[0] if single else warped
@@ -5,6 +5,12 @@ import io
 import base64
 import random
 import numpy as np
+from preprocessing.encoding import final_encoder, preview_image, tensor_to_image, uses_tensors
+from preprocessing.geometry import AffineStage, warp
+from preprocessing.pipeline import StepRecorder, BatchStepRecorder, check_cancelled, variant_count
+from preprocessing.randomness import generators
+from preprocessing.result_cache import cached
+
 
 class ImageAugmenter:
     def __init__(self):
@@ -23,66 +29,291 @@ class ImageAugmenter:
             flip_transform = transforms.RandomVerticalFlip(p=1.0)
         return flip_transform(image)
 
+    def resize(self, image, width, height):
+        """Resize image to width x height"""
+        return transforms.Resize((height, width))(image)
+
+    def _geometry(self, options):
+        """The selected geometric steps as (step name, AffineStage method, arguments), in order"""
+        steps = []
+        if options.get('rotation', {}).get('enabled'):
+            steps.append(('Rotation', 'rotate', (float(options['rotation'].get('angle', 30)),)))
+        if options.get('flip', {}).get('enabled'):
+            steps.append(('Flip', 'flip', (options['flip'].get('direction', 'horizontal'),)))
+        if options.get('resize', {}).get('enabled'):
+            steps.append(('Resize', 'resize', (int(options['resize'].get('width', 224)),
+                                               int(options['resize'].get('height', 224)))))
+        return steps
+
+    def _warp_geometry(self, recorder, image, steps):
+        """Apply the geometric steps to an image or batch with a single resampling pass
+
+        The steps are composed into one affine matrix per image. For a batch,
+        a step's arguments may be a list with one tuple per image (None
+        skips the step for that image). Intermediate step outputs are only
+        resampled when they are returned. Sampling is nearest-neighbour like
+        RandomRotation, or bilinear when resizing, with the input prefiltered
+        when the resize shrinks it 2x or more.
+        """
+        check_cancelled('step \'Geometry\'')
+        is_pil = not isinstance(image, torch.Tensor)
+        tensor = transforms.functional.pil_to_tensor(image) if is_pil else image
+        batched = tensor.dim() == 4
+        mode = 'bilinear' if any(method == 'resize' for _, method, _ in steps) else 'nearest'
+
+        def advance(stages, method, args):
+            per_image = args if isinstance(args, list) else [args] * len(stages)
+            return [stage if image_args is None else getattr(stage, method)(*image_args)
+                    for stage, image_args in zip(stages, per_image)]
+
+        def resample(stages):
+            warped = warp(tensor, stages if batched else stages[0], mode)
+            return transforms.functional.to_pil_image(warped) if is_pil else warped
+
+        stages = [AffineStage(tensor.size(-1), tensor.size(-2))] * (tensor.size(0) if batched else 1)
+        for name, method, args in steps[:-1]:
+            stages = advance(stages, method, args)
+            if recorder.wants(name):
+                recorder.record(name, resample(stages))
+
+        name, method, args = steps[-1]
+        stages = advance(stages, method, args)
+        with recorder.timed('Geometry'):
+            image = resample(stages)
+        recorder.record(name, image)
+        return image
+
     def adjust_brightness(self, image, factor):
         """Adjust image brightness"""
-        brightness_transform = transforms.ColorJitter(brightness=factor)
-        return brightness_transform(image)
+        if isinstance(image, torch.Tensor) and image.dim() == 4:
+            # Stacked batch: draw one ColorJitter factor per image
+            return self._scale_brightness(image, self._brightness_factors(image.size(0), factor))
+
+        # The factor ColorJitter would draw, taken from this call's generator
+        return transforms.functional.adjust_brightness(image, self._brightness_factors(1, factor).item())
+
+    def _brightness_factors(self, count, factor):
+        """Draw count brightness factors from ColorJitter's range"""
+        return torch.empty(count).uniform_(max(0.0, 1 - factor), 1 + factor, generator=generators().torch)
+
+    def _scale_brightness(self, images, factors):
+        """Scale each image of a uint8 or float batch by its own factor"""
+        if images.is_floating_point():
+            return (images * factors.view(-1, 1, 1, 1)).clamp(0, 1)
+        return (images.float() * factors.view(-1, 1, 1, 1)).clamp(0, 255).to(torch.uint8)
+
+    def _noise_like(self, tensor):
+        """Standard normal noise shaped like tensor, from this call's generator"""
+        return torch.randn(tensor.shape, dtype=tensor.dtype, generator=generators().torch)
 
     def add_noise(self, image, noise_level):
         """Add random noise to image"""
+        if isinstance(image, torch.Tensor) and image.is_floating_point():
+            # Float pipeline: no conversion needed
+            return torch.clamp(image + self._noise_like(image) * (noise_level/255.0), 0, 1)
+        if isinstance(image, torch.Tensor):
+            # Stacked uint8 batch: same scaling and uint8 cast as the PIL round trip
+            image_tensor = image.float() / 255
+            noise = self._noise_like(image_tensor) * (noise_level/255.0)
+            return torch.clamp(image_tensor + noise, 0, 1).mul(255).byte()
+
         # Convert to tensor
         to_tensor = transforms.ToTensor()
         image_tensor = to_tensor(image)
         
         # Add noise
-        noise = torch.randn_like(image_tensor) * (noise_level/255.0)
+        noise = self._noise_like(image_tensor) * (noise_level/255.0)
         noisy_tensor = torch.clamp(image_tensor + noise, 0, 1)
         
         # Convert back to PIL Image
         to_pil = transforms.ToPILImage()
         return to_pil(noisy_tensor)
 
-    def augment(self, image_data, options):
-        """Apply selected augmentation techniques"""
-        steps = {}
-        
-        # Convert base64 to PIL Image
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        augmented_image = image
-
-        if options.get('rotation', {}).get('enabled'):
-            angle = float(options['rotation'].get('angle', 30))
-            augmented_image = self.rotate(augmented_image, angle)
-            steps['Rotation'] = self._image_to_base64(augmented_image)
+    def _apply_steps(self, recorder, image, options):
+        """Run the selected augmentations on a PIL image, a float tensor or a stacked batch
 
-        if options.get('flip', {}).get('enabled'):
-            direction = options['flip'].get('direction', 'horizontal')
-            augmented_image = self.flip(augmented_image, direction)
-            steps['Flip'] = self._image_to_base64(augmented_image)
+        Rotation, flip and resize are fused into one warp unless
+        'fuse_geometry' is false.
+        """
+        geometry = self._geometry(options)
+        if geometry and options.get('fuse_geometry', True):
+            image = self._warp_geometry(recorder, image, geometry)
+        else:
+            methods = {'rotate': self.rotate, 'flip': self.flip, 'resize': self.resize}
+            for name, method, args in geometry:
+                image = recorder.run(name, methods[method], image, *args)
 
         if options.get('brightness', {}).get('enabled'):
             factor = float(options['brightness'].get('factor', 1.2))
-            augmented_image = self.adjust_brightness(augmented_image, factor)
-            steps['Brightness'] = self._image_to_base64(augmented_image)
+            image = recorder.run('Brightness', self.adjust_brightness, image, factor)
 
         if options.get('noise', {}).get('enabled'):
             noise_level = float(options['noise'].get('level', 25))
-            augmented_image = self.add_noise(augmented_image, noise_level)
-            steps['Noise'] = self._image_to_base64(augmented_image)
+            image = recorder.run('Noise', self.add_noise, image, noise_level)
+
+        return image
+
+    @cached(randomized=True)
+    def augment(self, image_data, options, binary=False):
+        """Apply selected augmentation techniques
+
+        With binary=True the steps and result are PNG bytes instead of data URLs.
+        'tensor_pipeline' and 'output_format': 'npy' work as in
+        ImagePreprocessor.preprocess: steps run on one float tensor and .npy
+        returns the final float32 CHW array.
+        """
+        num_variants = variant_count(options)
+        if num_variants > 1:
+            return self._augment_variants(image_data, options, binary, num_variants)
+
+        encode = self._image_to_bytes if binary else self._image_to_base64
+        tensors = uses_tensors(options)
+        recorder = StepRecorder((lambda image: encode(tensor_to_image(image))) if tensors else encode,
+                                'ImageAugmenter', options,
+                                preview=lambda image: encode(preview_image(image)))
+
+        with recorder.timed('Decode'):
+            augmented_image = self._load_image(image_data)
+            if tensors:
+                augmented_image = transforms.functional.to_tensor(augmented_image)
+        augmented_image = self._apply_steps(recorder, augmented_image, options)
 
         return {
-            'augmentation_steps': steps,
-            'augmented_image': self._image_to_base64(augmented_image)
+            'augmentation_steps': recorder.steps,
+            'augmented_image': recorder.encode(augmented_image, final_encoder(options, binary))
         }
 
-    def _image_to_base64(self, image):
-        """Convert PIL Image to base64 string"""
+    def _augment_variants(self, image_data, options, binary, num_variants):
+        """Draw num_variants augmentations of one image as a single batch
+
+        The image is decoded once and copied into an N-image batch; every
+        step then runs once over the batch, using torch's intra-op threads,
+        with random parameters drawn per variant: a rotation angle uniform
+        in [-angle, angle], a flip with probability 0.5 and a brightness
+        factor, plus independent noise. Rotation, flip and resize always run
+        as one fused warp here.
+        """
+        encode = self._image_to_bytes if binary else self._image_to_base64
+        tensors = uses_tensors(options)
+        if tensors:
+            encode_tensor = lambda image: encode(tensor_to_image(image))
+        else:
+            encode_tensor = lambda image: encode(transforms.functional.to_pil_image(image))
+        preview = lambda image: encode(preview_image(image))
+        recorders = [StepRecorder(encode_tensor, 'ImageAugmenter', options, preview=preview)
+                     for _ in range(num_variants)]
+        recorder = BatchStepRecorder(recorders)
+        parameters = [{} for _ in range(num_variants)]
+
+        with recorder.timed('Decode'):
+            image = self._load_image(image_data)
+            image = transforms.functional.to_tensor(image) if tensors else transforms.functional.pil_to_tensor(image)
+        # A view, not N copies: the first step writes a new batch
+        batch = image.unsqueeze(0).expand(num_variants, *image.shape)
+
+        geometry = []
+        for name, method, args in self._geometry(options):
+            if method == 'rotate':
+                # Negative angles are accepted like in the single-image path
+                limit = abs(float(args[0]))
+                angles = torch.empty(num_variants).uniform_(-limit, limit, generator=generators().torch).tolist()
+                for variant, angle in zip(parameters, angles):
+                    variant['angle'] = angle
+                args = [(angle,) for angle in angles]
+            elif method == 'flip':
+                flips = (torch.rand(num_variants, generator=generators().torch) < 0.5).tolist()
+                for variant, flipped in zip(parameters, flips):
+                    variant['flip'] = args[0] if flipped else None
+                args = [args if flipped else None for flipped in flips]
+            geometry.append((name, method, args))
+        if geometry:
+            batch = self._warp_geometry(recorder, batch, geometry)
+
+        if options.get('brightness', {}).get('enabled'):
+            factors = self._brightness_factors(num_variants, float(options['brightness'].get('factor', 1.2)))
+            for variant, factor in zip(parameters, factors.tolist()):
+                variant['brightness'] = factor
+            batch = recorder.run('Brightness', self._scale_brightness, batch, factors)
+
+        if options.get('noise', {}).get('enabled'):
+            noise_level = float(options['noise'].get('level', 25))
+            batch = recorder.run('Noise', self.add_noise, batch, noise_level)
+
+        encode_final = final_encoder(options, binary)
+        variants = [{
+            'augmentation_steps': item_recorder.steps,
+            'augmented_image': item_recorder.encode(image, encode_final),
+            'parameters': variant
+        } for item_recorder, image, variant in zip(recorders, batch, parameters)]
+        return dict(variants[0], variants=variants)
+
+    def augment_batch(self, images, options, binary=False):
+        """Augment many images with shared options
+
+        Images of equal size are stacked so every step runs once per stack;
+        random parameters are still drawn per image. Results keep input order;
+        inputs that fail get an error entry instead.
+        """
+        encode = self._image_to_bytes if binary else self._image_to_base64
+        tensors = uses_tensors(options)
+        if tensors:
+            encode_tensor = lambda image: encode(tensor_to_image(image))
+        else:
+            encode_tensor = lambda image: encode(transforms.functional.to_pil_image(image))
+        encode_final = final_encoder(options, binary)
+        results = [None] * len(images)
+
+        groups = {}
+        for index, image_data in enumerate(images):
+            try:
+                image = self._load_image(image_data)
+                if tensors:
+                    image = transforms.functional.to_tensor(image)
+                size = tuple(image.shape) if tensors else image.size
+                groups.setdefault(size, []).append((index, image))
+            except Exception as e:
+                results[index] = {'error': str(e)}
+
+        for members in groups.values():
+            indices = [index for index, _ in members]
+            try:
+                preview = lambda image: encode(preview_image(image))
+                recorders = [StepRecorder(encode_tensor, 'ImageAugmenter', options, preview=preview)
+                             for _ in members]
+                batch = torch.stack([image if tensors else transforms.functional.pil_to_tensor(image)
+                                     for _, image in members])
+                batch = self._apply_steps(BatchStepRecorder(recorders), batch, options)
+                for index, recorder, image in zip(indices, recorders, batch):
+                    results[index] = {
+                        'augmentation_steps': recorder.steps,
+                        'augmented_image': recorder.encode(image, encode_final)
+                    }
+            except Exception as e:
+                for index in indices:
+                    results[index] = {'error': str(e)}
+
+        return results
+
+    def _load_image(self, image_data):
+        """Open an image from a base64 data URL, raw bytes or a binary stream"""
+        if isinstance(image_data, str):
+            image_data = io.BytesIO(base64.b64decode(image_data.split(',')[1]))
+        elif isinstance(image_data, (bytes, bytearray, memoryview)):
+            image_data = io.BytesIO(image_data)
+        image = Image.open(image_data)
+        image.load()
+
+        # Convert to RGB if needed
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+
+    def _image_to_bytes(self, image):
+        """Encode PIL Image as PNG bytes"""
         buffered = io.BytesIO()
         image.save(buffered, format="PNG")
-        return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
\ No newline at end of file
+        return buffered.getvalue()
+
+    def _image_to_base64(self, image):
+        """Convert PIL Image to base64 string"""
+        return f"data:image/png;base64,{base64.b64encode(self._image_to_bytes(image)).decode()}"
\ No newline at end of file
@@ -3,7 +3,13 @@ from torchvision import transforms
 from PIL import Image
 import io
 import base64
+import time
 import numpy as np
+from preprocessing.encoding import final_encoder, preview_image, tensor_to_image, uses_tensors
+from preprocessing.pipeline import StepRecorder, BatchStepRecorder
+from preprocessing.randomness import generators
+from preprocessing.result_cache import cached
+
 
 class ImagePreprocessor:
     def __init__(self):
@@ -20,11 +26,18 @@ class ImagePreprocessor:
 
     def _normalize_image(self, image):
         """Normalize image using ImageNet statistics"""
-        to_tensor = transforms.ToTensor()
         normalize = transforms.Normalize(
             mean=[0.48, 0.45, 0.406],
             std=[0.229, 0.224, 0.225]
         )
+        if isinstance(image, torch.Tensor) and image.is_floating_point():
+            # Float pipeline: keep the normalized values themselves
+            return normalize(image)
+        if isinstance(image, torch.Tensor):
+            # Stacked uint8 batch: same scaling and uint8 cast as the PIL round trip
+            return normalize(image.float() / 255).mul(255).byte()
+
+        to_tensor = transforms.ToTensor()
         processed_tensor = normalize(to_tensor(image))
         
         # Convert back to PIL Image for display
@@ -37,52 +50,181 @@ class ImagePreprocessor:
         return grayscale_transform(image)
 
     def _apply_blur(self, image, kernel_size):
-        """Apply Gaussian blur to image"""
-        blur_transform = transforms.GaussianBlur(kernel_size)
-        return blur_transform(image)
+        """Apply Gaussian blur to image
 
-    def _image_to_base64(self, image):
-        """Convert PIL Image to base64 string"""
+        The sigma is drawn like GaussianBlur's default (0.1, 2.0) range, from
+        this call's generator.
+        """
+        sigma = torch.empty(1).uniform_(0.1, 2.0, generator=generators().torch).item()
+        return transforms.functional.gaussian_blur(image, [kernel_size, kernel_size], [sigma, sigma])
+
+    def _image_to_bytes(self, image):
+        """Encode PIL Image as PNG bytes"""
         buffered = io.BytesIO()
         image.save(buffered, format="PNG")
-        return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
+        return buffered.getvalue()
+
+    def _image_to_base64(self, image):
+        """Convert PIL Image to base64 string"""
+        return f"data:image/png;base64,{base64.b64encode(self._image_to_bytes(image)).decode()}"
+
+    def _decode_min_size(self, options):
+        """Smallest side a reduced decode may produce, or None to decode at full size
+
+        Resize is always the first step, so when it is enabled the image
+        only has to be decoded large enough to cover the target. Both sides
+        must cover the larger of the two target dimensions.
+        """
+        if not options.get('resize') or options.get('reduced_decode') is False:
+            return None
+        return max(int(options.get('resize_width', 224)), int(options.get('resize_height', 224)))
+
+    def _load_image(self, image_data, min_size=None):
+        """Open an image from a base64 data URL, raw bytes or a binary stream
+
+        With min_size, large images are decoded at a reduced size that keeps
+        both sides at least min_size: JPEGs through DCT scaling (draft), at
+        1/2, 1/4 or 1/8 of the full size, other formats by reduce() right
+        after decoding. Returns the image and a dict describing the decode.
+        """
+        if isinstance(image_data, str):
+            image_data = io.BytesIO(base64.b64decode(image_data.split(',')[1]))
+        elif isinstance(image_data, (bytes, bytearray, memoryview)):
+            image_data = io.BytesIO(image_data)
+        image = Image.open(image_data)
+        original_size = image.size
+        method = None
+        if min_size and image.format == 'JPEG' and min(original_size) >= 2 * min_size:
+            image.draft(image.mode, (min_size, min_size))
+            method = 'draft'
+        image.load()
 
-    def preprocess(self, image_data, options):
-        """Preprocess the image with selected options"""
-        steps = {}
-        
-        # Convert base64 to PIL Image
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        image = Image.open(io.BytesIO(image_bytes))
-        
         # Convert to RGB if needed
         if image.mode != 'RGB':
             image = image.convert('RGB')
-        
-        processed_image = image
 
+        if min_size and image.size == original_size:
+            method = None
+            factor = min(image.size) // min_size
+            if factor >= 2:
+                image = image.reduce(factor)
+                method = 'reduce'
+        return image, {
+            'method': method,
+            'scale': image.size[0] / original_size[0],
+            'original_size': list(original_size),
+            'decoded_size': list(image.size)
+        }
+
+    def _apply_steps(self, recorder, image, options):
+        """Run the selected steps on a PIL image, a float tensor or a stacked batch"""
         # Resize
         if options.get('resize'):
-            processed_image = self._resize_image(processed_image, options)
-            steps['Resize'] = self._image_to_base64(processed_image)
+            image = recorder.run('Resize', self._resize_image, image, options)
 
         # Normalize
         if options.get('normalize'):
-            processed_image = self._normalize_image(processed_image)
-            steps['Normalize'] = self._image_to_base64(processed_image)
+            image = recorder.run('Normalize', self._normalize_image, image)
 
         # Grayscale
         if options.get('grayscale'):
-            processed_image = self._convert_grayscale(processed_image)
-            steps['Grayscale'] = self._image_to_base64(processed_image)
+            image = recorder.run('Grayscale', self._convert_grayscale, image)
 
         # Blur
         if options.get('blur'):
             kernel_size = int(options.get('blur_kernel', 3))
-            processed_image = self._apply_blur(processed_image, kernel_size)
-            steps['Blur'] = self._image_to_base64(processed_image)
+            image = recorder.run('Blur', self._apply_blur, image, kernel_size)
+
+        return image
+
+    # The blur draws a random sigma on every call
+    @cached(randomized=lambda options: bool(options.get('blur')))
+    def preprocess(self, image_data, options, binary=False):
+        """Preprocess the image with selected options
+
+        With binary=True the steps and result are PNG bytes instead of data URLs.
+
+        With the 'tensor_pipeline' option the image is converted once to a
+        float tensor and every step runs on it, so normalized values are not
+        clipped between steps; only encoded outputs are. 'output_format':
+        'npy' implies it and returns the final float32 CHW array as .npy
+        data instead of a PNG.
+        """
+        encode = self._image_to_bytes if binary else self._image_to_base64
+        tensors = uses_tensors(options)
+        recorder = StepRecorder((lambda image: encode(tensor_to_image(image))) if tensors else encode,
+                                'ImagePreprocessor', options,
+                                preview=lambda image: encode(preview_image(image)))
+
+        start = time.perf_counter()
+        with recorder.timed('Decode'):
+            processed_image, decode = self._load_image(image_data, self._decode_min_size(options))
+            if tensors:
+                processed_image = transforms.functional.to_tensor(processed_image)
+        decode['seconds'] = time.perf_counter() - start
+        processed_image = self._apply_steps(recorder, processed_image, options)
 
         return {
-            'preprocessing_steps': steps,
-            'processed_image': self._image_to_base64(processed_image)
-        }
\ No newline at end of file
+            'preprocessing_steps': recorder.steps,
+            'processed_image': recorder.encode(processed_image, final_encoder(options, binary)),
+            'decode': decode
+        }
+
+    def preprocess_batch(self, images, options, binary=False):
+        """Preprocess many images with shared options
+
+        Images are resized one by one, then stacked by size so every later step
+        runs once per stack. Results keep input order; inputs that fail get an
+        error entry instead.
+        """
+        encode = self._image_to_bytes if binary else self._image_to_base64
+        tensors = uses_tensors(options)
+        if tensors:
+            encode_tensor = lambda image: encode(tensor_to_image(image))
+        else:
+            encode_tensor = lambda image: encode(transforms.functional.to_pil_image(image))
+        encode_final = final_encoder(options, binary)
+        min_size = self._decode_min_size(options)
+        results = [None] * len(images)
+        decodes = {}
+
+        groups = {}
+        for index, image_data in enumerate(images):
+            try:
+                recorder = StepRecorder(encode_tensor if tensors else encode, 'ImagePreprocessor', options,
+                                        preview=lambda image: encode(preview_image(image)))
+                start = time.perf_counter()
+                with recorder.timed('Decode'):
+                    image, decodes[index] = self._load_image(image_data, min_size)
+                    if tensors:
+                        image = transforms.functional.to_tensor(image)
+                decodes[index]['seconds'] = time.perf_counter() - start
+                if options.get('resize'):
+                    image = recorder.run('Resize', self._resize_image, image, options)
+                size = tuple(image.shape) if tensors else image.size
+                groups.setdefault(size, []).append((index, recorder, image))
+            except Exception as e:
+                results[index] = {'error': str(e)}
+
+        batch_options = dict(options, resize=False)
+        for members in groups.values():
+            indices = [index for index, _, _ in members]
+            recorders = [recorder for _, recorder, _ in members]
+            try:
+                # Later steps encode tensors instead of PIL images
+                for recorder in recorders:
+                    recorder.encoder = encode_tensor
+                batch = torch.stack([image if tensors else transforms.functional.pil_to_tensor(image)
+                                     for _, _, image in members])
+                batch = self._apply_steps(BatchStepRecorder(recorders), batch, batch_options)
+                for index, recorder, image in zip(indices, recorders, batch):
+                    results[index] = {
+                        'preprocessing_steps': recorder.steps,
+                        'processed_image': recorder.encode(image, encode_final),
+                        'decode': decodes[index]
+                    }
+            except Exception as e:
+                for index in indices:
+                    results[index] = {'error': str(e)}
+
+        return results
@@ -0,0 +1,206 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from preprocessing.metrics import STEP_SECONDS
+from preprocessing.pipeline import PipelineCancelled, step_context
+from preprocessing.processors import processors
+
+# Task name -> (modality, role, method) run inside a worker process
+TASKS = {
+    'preprocess-image': ('image', 'preprocessor', 'preprocess'),
+    'augment-image': ('image', 'augmenter', 'augment'),
+    'preprocess-audio': ('audio', 'preprocessor', 'preprocess'),
+    'augment-audio': ('audio', 'augmenter', 'augment'),
+    'preprocess-3d': ('3d', 'preprocessor', 'preprocess'),
+    'augment-3d': ('3d', 'augmenter', 'augment'),
+}
+
+
+def _run_task(job_id, task, payload, options, events, cancelled):
+    """Worker process entry point: run one task and report its steps"""
+    modality, role, method = TASKS[task]
+    processor = processors.get(modality, role)
+
+    events.put((job_id, {'event': 'job_started', 'time': time.time()}))
+
+    def on_step(event):
+        event['time'] = time.time()
+        events.put((job_id, event))
+
+    def should_cancel():
+        return job_id in cancelled
+
+    with step_context(on_step=on_step, should_cancel=should_cancel):
+        return getattr(processor, method)(payload, options)
+
+
+class JobQueueFull(Exception):
+    """Raised by submit when max_queued jobs are already waiting"""
+
+
+class JobQueue:
+    """Runs long preprocessing tasks in a local process pool
+
+    Jobs are submitted, polled and cancelled by id. No outside broker is
+    needed: step events flow back through a multiprocessing manager queue.
+    """
+
+    def __init__(self, max_workers=None, max_finished=256, max_queued=0):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_finished = max_finished
+        # 0 leaves the backlog unbounded
+        self.max_queued = max_queued
+        self._jobs = OrderedDict()
+        # Re-entrant: cancelling a queued future runs _finish in this thread
+        self._lock = threading.RLock()
+        self._executor = None
+        self._manager = None
+        self._events = None
+        self._cancelled = None
+
+    def _start(self):
+        """Start the worker pool and event listener on first use"""
+        # Spawned workers do not inherit the server's threads and locks
+        context = multiprocessing.get_context('spawn')
+        self._manager = context.Manager()
+        self._events = self._manager.Queue()
+        self._cancelled = self._manager.dict()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                job_id, event = self._events.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                if event['event'] == 'job_started':
+                    if job['status'] == 'queued':
+                        job['status'] = 'running'
+                    job['started_at'] = event['time']
+                elif event['event'] == 'step_started':
+                    job['progress']['current_step'] = event['step']
+                elif event['event'] == 'step_finished':
+                    progress = job['progress']
+                    progress['completed_steps'].append({'step': event['step'], 'seconds': event['seconds']})
+                    progress['current_step'] = None
+                    # Workers keep their own metrics; report their step times here
+                    STEP_SECONDS.observe(event['seconds'], processor=event['processor'], step=event['step'])
+
+    def submit(self, task, payload, options):
+        """Queue a task and return its job id
+
+        Raises ValueError for an unknown task and JobQueueFull when the
+        backlog is at max_queued.
+        """
+        if task not in TASKS:
+            raise ValueError(f"Unknown task: {task}")
+
+        with self._lock:
+            if self.max_queued > 0:
+                queued = sum(1 for job in self._jobs.values() if job['status'] == 'queued')
+                if queued >= self.max_queued:
+                    raise JobQueueFull(f"{queued} jobs are already queued, try again later")
+            if self._executor is None:
+                self._start()
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'task': task,
+                'status': 'queued',
+                'submitted_at': time.time(),
+                'progress': {'current_step': None, 'completed_steps': []},
+                'result': None,
+                'error': None
+            }
+            future = self._executor.submit(
+                _run_task, job_id, task, payload, options, self._events, self._cancelled
+            )
+            self._jobs[job_id]['future'] = future
+            self._evict()
+
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['finished_at'] = time.time()
+            if future.cancelled():
+                job['status'] = 'cancelled'
+            else:
+                error = future.exception()
+                if isinstance(error, PipelineCancelled):
+                    job['status'] = 'cancelled'
+                elif error is not None:
+                    logging.error(f"Job {job_id} ({job['task']}) failed: {error}")
+                    job['status'] = 'failed'
+                    job['error'] = str(error)
+                else:
+                    job['status'] = 'completed'
+                    job['result'] = future.result()
+            self._cancelled.pop(job_id, None)
+
+    def _evict(self):
+        """Forget the oldest finished jobs beyond max_finished"""
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job['status'] in ('completed', 'failed', 'cancelled')]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def status(self, job_id):
+        """Return the public status of a job, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            status = {
+                key: value for key, value in job.items()
+                if key not in ('future', 'result')
+            }
+            status['progress'] = dict(job['progress'])
+            status['progress']['completed_steps'] = list(job['progress']['completed_steps'])
+            return status
+
+    def result(self, job_id):
+        """Return (status, result) of a job, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return job['status'], job['result']
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or ask a running one to stop after its current step"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if job['status'] in ('completed', 'failed', 'cancelled'):
+                return False
+            if job['future'].cancel():
+                job['status'] = 'cancelled'
+            else:
+                self._cancelled[job_id] = True
+                job['status'] = 'cancelling'
+            return True
+
+    def stats(self):
+        """Count jobs by status"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return counts
@@ -0,0 +1,225 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import torch
+
+from preprocessing.metrics import MLM_QUEUE_SECONDS, MLM_BATCH_FILL, MLM_BATCH_SECONDS
+from preprocessing.pipeline import check_cancelled
+
+QUANTIZATIONS = ('int8',)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'preprocessing', 'fill-mask')
+
+
+def _quantized_path(model_name, quantize, cache_dir):
+    import transformers
+    # Pickled modules are tied to the library versions that wrote them
+    name = f"{model_name.replace('/', '--')}.{quantize}.torch-{torch.__version__}" \
+           f".transformers-{transformers.__version__}.pt"
+    return os.path.join(cache_dir, name)
+
+
+def _load_quantized_model(model_name, quantize, cache_dir):
+    """Return model_name with int8 dynamically quantized Linear layers, cached on disk
+
+    The first call builds the quantized model from the full-precision
+    checkpoint and saves it; later calls (and other processes) load the
+    saved module directly, without touching the float weights.
+    """
+    from transformers import AutoModelForMaskedLM
+
+    path = _quantized_path(model_name, quantize, cache_dir)
+    if os.path.exists(path):
+        try:
+            return torch.load(path, weights_only=False).eval()
+        except Exception as e:
+            logging.warning(f"Rebuilding unreadable quantized model {path}: {e}")
+
+    model = AutoModelForMaskedLM.from_pretrained(model_name).eval()
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    torch.save(quantized, temporary)
+    os.replace(temporary, path)
+    return quantized
+
+
+def load_fill_mask(model_name='bert-base-uncased', quantize=None, cache_dir=None):
+    """Build a fill-mask pipeline for model_name, optionally int8-quantized for CPU
+
+    Dynamic quantization stores the weights of every Linear layer as int8
+    and quantizes activations on the fly, which roughly quarters their
+    memory and speeds up CPU inference at a small cost in agreement with
+    the full model (see benchmarks/fill_mask.py).
+    """
+    from transformers import AutoTokenizer, pipeline
+
+    if not quantize:
+        return pipeline('fill-mask', model=model_name)
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantize}', expected one of {QUANTIZATIONS}")
+    model = _load_quantized_model(model_name, quantize, cache_dir or DEFAULT_CACHE_DIR)
+    return pipeline('fill-mask', model=model, tokenizer=AutoTokenizer.from_pretrained(model_name))
+
+
+class MaskedWordPredictor:
+    """Predicts every mask token in a batch of texts from one forward pass
+
+    The fill-mask pipeline runs the model once per call and returns
+    predictions for one mask at a time. This reads the top-k tokens for all
+    masked positions of all texts straight from the logits of a single
+    padded batch (split into max_batch_size texts per pass).
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=32):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.mask_token = tokenizer.mask_token
+        self._token_strings = {}
+
+    @classmethod
+    def from_pipeline(cls, pipeline, max_batch_size=32):
+        return cls(pipeline.model, pipeline.tokenizer, max_batch_size)
+
+    def _token_string(self, token_id):
+        # Decoded like the pipeline's token_str; the vocabulary is small enough to memoize
+        token_string = self._token_strings.get(token_id)
+        if token_string is None:
+            token_string = self.tokenizer.decode([token_id]).strip()
+            self._token_strings[token_id] = token_string
+        return token_string
+
+    def predict(self, texts, top_k=10):
+        """Return, for each text, one list of top_k token strings per mask in text order
+
+        Masks cut off by the model's maximum length get no predictions.
+        """
+        results = [[] for _ in texts]
+        for start in range(0, len(texts), self.max_batch_size):
+            batch = texts[start:start + self.max_batch_size]
+            encoded = self.tokenizer(batch, return_tensors='pt', padding=True, truncation=True)
+            with torch.inference_mode():
+                logits = self.model(**encoded).logits
+            rows, columns = (encoded['input_ids'] == self.tokenizer.mask_token_id).nonzero(as_tuple=True)
+            if not len(rows):
+                continue
+            top_ids = logits[rows, columns].topk(top_k, dim=-1).indices.tolist()
+            # nonzero() is row-major, so each text's masks come out in order
+            for row, token_ids in zip(rows.tolist(), top_ids):
+                results[start + row].append([self._token_string(token_id) for token_id in token_ids])
+        return results
+
+
+class _PendingPrediction:
+    def __init__(self, texts, top_k):
+        self.texts = texts
+        self.top_k = top_k
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Set when the caller stopped waiting, so the batcher skips it
+        self.abandoned = False
+
+
+class BatchingPredictor:
+    """Merges predict() calls from concurrent threads into shared forward passes
+
+    A background thread takes the first waiting call, keeps collecting
+    calls for up to max_wait seconds or until max_batch_size texts are
+    queued, and runs them through predictor as one padded batch. Each
+    caller blocks until its own share of the predictions is ready, or until
+    its step_context is cancelled or past its deadline.
+    """
+
+    # How often a waiting caller checks for cancellation
+    POLL_SECONDS = 0.1
+
+    def __init__(self, predictor, max_batch_size=32, max_wait=0.005):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.mask_token = predictor.mask_token
+        self._reset()
+
+    def _reset(self):
+        # A forked child inherits the worker attribute but not the thread
+        # (nor a usable queue or lock), so each process starts its own
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='mlm-batcher', daemon=True)
+                self._worker.start()
+
+    def predict(self, texts, top_k=10):
+        if not texts:
+            return []
+        pending = _PendingPrediction(list(texts), top_k)
+        self._ensure_worker()
+        self._queue.put(pending)
+        try:
+            while not pending.done.wait(self.POLL_SECONDS):
+                check_cancelled('masked word prediction')
+        except BaseException:
+            pending.abandoned = True
+            raise
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.texts)
+        return batch, size
+
+    def _run(self):
+        while True:
+            batch, size = self._collect()
+            batch = [pending for pending in batch if not pending.abandoned]
+            if not batch:
+                continue
+            size = sum(len(pending.texts) for pending in batch)
+            started = time.perf_counter()
+            for pending in batch:
+                MLM_QUEUE_SECONDS.observe(started - pending.enqueued)
+            MLM_BATCH_FILL.observe(min(1.0, size / self.max_batch_size))
+
+            try:
+                predictions = self.predictor.predict([text for pending in batch for text in pending.texts],
+                                                     top_k=max(pending.top_k for pending in batch))
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+                    pending.done.set()
+                continue
+            MLM_BATCH_SECONDS.observe(time.perf_counter() - started)
+
+            start = 0
+            for pending in batch:
+                item_predictions = predictions[start:start + len(pending.texts)]
+                start += len(pending.texts)
+                pending.result = [[candidates[:pending.top_k] for candidates in masks]
+                                  for masks in item_predictions]
+                pending.done.set()
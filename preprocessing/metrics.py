@@ -0,0 +1,147 @@
+import bisect
+import math
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+SIZE_BUCKETS = tuple(2 ** power for power in range(10, 31, 2))  # 1 KiB .. 1 GiB
+WAIT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets and optional labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self._series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), series['counts']):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', key + (('le', _format_value(bound)),), cumulative))
+                samples.append((f'{self.name}_sum', key, series['sum']))
+                samples.append((f'{self.name}_count', key, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in Prometheus text format
+
+    Collectors are callables run at scrape time that return
+    (name, type, help, [(labels_dict, value), ...]) tuples, for stats that
+    live elsewhere such as cache and job queue counters.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        for collector in self._collectors:
+            for name, metric_type, help, samples in collector():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    labels = tuple(sorted(labels.items()))
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+REQUESTS = metrics.counter(
+    'http_requests_total', 'HTTP requests by route, method and status')
+REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route')
+REQUEST_BYTES = metrics.histogram(
+    'http_request_size_bytes', 'HTTP request body size by route', SIZE_BUCKETS)
+RESPONSE_BYTES = metrics.histogram(
+    'http_response_size_bytes', 'HTTP response body size by route', SIZE_BUCKETS)
+STEP_SECONDS = metrics.histogram(
+    'pipeline_step_duration_seconds', 'Time spent in each pipeline step by processor')
+ENCODE_SECONDS = metrics.histogram(
+    'pipeline_encode_duration_seconds', 'Time spent encoding step and final outputs by processor')
+MLM_QUEUE_SECONDS = metrics.histogram(
+    'mlm_batch_queue_wait_seconds', 'Time MLM inputs wait to join a batched forward pass', WAIT_BUCKETS)
+MLM_BATCH_FILL = metrics.histogram(
+    'mlm_batch_fill_ratio', 'Texts per batched MLM forward pass as a fraction of the maximum batch size',
+    RATIO_BUCKETS)
+MLM_BATCH_SECONDS = metrics.histogram(
+    'mlm_batch_duration_seconds', 'Time spent in each batched MLM forward pass')
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+import time
+
+
+def _current_rss():
+    """Return the resident set size of this process in bytes, or None"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class ModelRegistry:
+    """Process-wide registry that loads each heavy model once, on first use"""
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._stats = {}
+        self._locks = {}
+
+    def register(self, name, loader):
+        """Register a zero-argument loader under the given name"""
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        """Return the model, loading it if this is the first request for it"""
+        if name in self._models:
+            return self._models[name]
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+
+        # Only one thread loads a given model; the others wait for it
+        with self._locks[name]:
+            if name not in self._models:
+                self._load(name)
+        return self._models[name]
+
+    def _load(self, name):
+        logging.debug(f"Loading model '{name}'")
+        rss_before = _current_rss()
+        start = time.perf_counter()
+
+        model = self._loaders[name]()
+
+        load_seconds = time.perf_counter() - start
+        rss_after = _current_rss()
+        rss_delta = None
+        if rss_before is not None and rss_after is not None:
+            rss_delta = rss_after - rss_before
+
+        self._stats[name] = {
+            'load_seconds': load_seconds,
+            'rss_delta_bytes': rss_delta
+        }
+        self._models[name] = model
+        logging.debug(f"Loaded model '{name}' in {load_seconds:.2f}s")
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def warm_up(self, names=None):
+        """Load the given models (all registered models by default) up front"""
+        for name in names or list(self._loaders):
+            self.get(name)
+        return self.stats()
+
+    def stats(self):
+        """Report load time and resident memory growth for every model"""
+        report = {}
+        for name in self._loaders:
+            report[name] = {'loaded': name in self._models}
+            report[name].update(self._stats.get(name, {}))
+        return {'process_rss_bytes': _current_rss(), 'models': report}
+
+
+def _load_fill_mask():
+    from preprocessing.masked_lm import load_fill_mask
+    # FILL_MASK_MODEL picks the checkpoint (e.g. distilbert-base-uncased);
+    # FILL_MASK_QUANTIZE=int8 quantizes it for CPU inference, cached under
+    # FILL_MASK_CACHE_DIR
+    return load_fill_mask(os.environ.get('FILL_MASK_MODEL', 'bert-base-uncased'),
+                          os.environ.get('FILL_MASK_QUANTIZE') or None,
+                          os.environ.get('FILL_MASK_CACHE_DIR') or None)
+
+
+def _load_masked_lm():
+    from preprocessing.masked_lm import MaskedWordPredictor, BatchingPredictor
+    # Shares the fill-mask pipeline's model and tokenizer
+    max_batch_size = int(os.environ.get('MLM_MAX_BATCH_SIZE', 32))
+    predictor = MaskedWordPredictor.from_pipeline(registry.get('fill-mask'), max_batch_size)
+    # Concurrent requests wait up to MLM_BATCH_WAIT_MS to share a forward pass; 0 disables it
+    max_wait = float(os.environ.get('MLM_BATCH_WAIT_MS', 5)) / 1000
+    if max_wait <= 0:
+        return predictor
+    return BatchingPredictor(predictor, max_batch_size, max_wait)
+
+
+def _load_wordnet():
+    import nltk
+    nltk.download('wordnet', quiet=True)
+    from nltk.corpus import wordnet
+    wordnet.ensure_loaded()
+    return wordnet
+
+
+def _load_synonym_index():
+    from preprocessing.synonyms import DEFAULT_INDEX_PATH, load_when_ready
+    # Memory-mapped from SYNONYM_INDEX_PATH (see python -m preprocessing.synonyms).
+    # Until it exists, words are looked up in WordNet while a background
+    # thread builds it, unless SYNONYM_INDEX_BUILD=0; SYNONYM_CACHE_SIZE words
+    # outside the index are cached
+    return load_when_ready(os.environ.get('SYNONYM_INDEX_PATH') or DEFAULT_INDEX_PATH,
+                           int(os.environ.get('SYNONYM_CACHE_SIZE', 10000)),
+                           build=os.environ.get('SYNONYM_INDEX_BUILD', '1') != '0')
+
+
+def _load_pos_tagger():
+    import nltk
+    # Newer NLTK releases ship the English model under a separate name
+    nltk.download('averaged_perceptron_tagger', quiet=True)
+    nltk.download('averaged_perceptron_tagger_eng', quiet=True)
+    from nltk.tag import PerceptronTagger
+    return PerceptronTagger()
+
+
+def _load_basic_english():
+    from torchtext.data.utils import get_tokenizer
+    return get_tokenizer('basic_english')
+
+
+registry = ModelRegistry()
+registry.register('fill-mask', _load_fill_mask)
+registry.register('masked-lm', _load_masked_lm)
+registry.register('wordnet', _load_wordnet)
+registry.register('synonym-index', _load_synonym_index)
+registry.register('pos-tagger', _load_pos_tagger)
+registry.register('basic-english', _load_basic_english)
@@ -0,0 +1,227 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from preprocessing.metrics import STEP_SECONDS, ENCODE_SECONDS
+
+
+class PipelineCancelled(Exception):
+    """Raised between steps when the caller cancelled the pipeline"""
+
+
+class PipelineTimeout(PipelineCancelled):
+    """Raised between steps once the caller's deadline has passed"""
+
+
+class InvalidOptions(ValueError):
+    """Raised for option values a pipeline refuses to run with"""
+
+
+# Every variant is a full result, so the count a caller may request is capped
+MAX_VARIANTS = int(os.environ.get('MAX_VARIANTS', 16))
+
+
+def variant_count(options):
+    """Read the 'num_variants' option, rejecting values above MAX_VARIANTS"""
+    try:
+        num_variants = max(1, int((options or {}).get('num_variants', 1)))
+    except (TypeError, ValueError):
+        raise InvalidOptions(f"num_variants must be an integer, got {options['num_variants']!r}")
+    if num_variants > MAX_VARIANTS:
+        raise InvalidOptions(f"num_variants must be at most {MAX_VARIANTS}, got {num_variants}")
+    return num_variants
+
+
+class StepContext:
+    """Per-call hooks that the steps of a running pipeline report to"""
+
+    def __init__(self, on_step=None, should_cancel=None, on_result=None, deadline=None):
+        self.on_step = on_step
+        self.should_cancel = should_cancel
+        self.on_result = on_result
+        self.deadline = deadline
+        self.timed_out = False
+
+    @property
+    def observed(self):
+        """Whether the caller watches individual steps, so results must not come from a cache"""
+        return bool(self.on_step or self.on_result)
+
+
+_current_context = contextvars.ContextVar('step_context', default=None)
+
+
+@contextmanager
+def step_context(on_step=None, should_cancel=None, on_result=None, deadline=None):
+    """Report the steps of pipelines run inside this block to on_step
+
+    on_step receives one event dict when a step starts and one when it ends.
+    should_cancel is polled before every step; returning True aborts the
+    pipeline with PipelineCancelled. on_result, if given, receives each
+    step's name and encoded output as soon as it is recorded; the output is
+    then dropped instead of being kept for the final result. Once deadline
+    (a time.monotonic() value) has passed, the next step raises
+    PipelineTimeout. The StepContext is bound by the with statement.
+    """
+    context = StepContext(on_step, should_cancel, on_result, deadline)
+    token = _current_context.set(context)
+    try:
+        yield context
+    finally:
+        _current_context.reset(token)
+
+
+def current_step_context():
+    """Return the StepContext the caller installed, or None"""
+    return _current_context.get()
+
+
+def check_cancelled(where='step'):
+    """Raise PipelineCancelled if the current caller asked to stop
+
+    Long-running steps call this between iterations so cancellation does not
+    have to wait for the whole step to finish.
+    """
+    context = _current_context.get()
+    if context is None:
+        return
+    if context.deadline is not None and time.monotonic() > context.deadline:
+        context.timed_out = True
+        raise PipelineTimeout(f"Timed out during {where}")
+    if context.should_cancel and context.should_cancel():
+        raise PipelineCancelled(f"Cancelled during {where}")
+
+
+def _wanted_steps(options):
+    """Read the 'return_steps' option: 'all' (default), 'none', or a list of step names"""
+    wanted = (options or {}).get('return_steps', 'all')
+    if wanted in (None, True, 'all'):
+        return None
+    if wanted in (False, 'none'):
+        return frozenset()
+    if isinstance(wanted, str):
+        wanted = wanted.split(',')
+    return frozenset(name.strip() for name in wanted)
+
+
+class StepRecorder:
+    """Runs the steps of one pipeline, timing them and collecting their encoded results
+
+    Every step duration and encode duration is recorded in the metrics
+    registry under the processor's name, so processors never time steps
+    themselves.
+
+    options decide which step outputs are kept: 'return_steps' selects them
+    (see _wanted_steps) and 'step_previews' encodes them with preview, a
+    cheaper encoder producing thumbnails, short clips or decimated meshes.
+    Steps that are not kept are never encoded.
+    """
+
+    def __init__(self, encoder, processor='unknown', options=None, preview=None):
+        self.encoder = encoder
+        self.processor = processor
+        self.wanted = _wanted_steps(options)
+        self.preview = preview if preview and (options or {}).get('step_previews') else None
+        self.steps = {}
+        self.context = _current_context.get() or StepContext()
+
+    def _emit(self, event):
+        if self.context.on_step:
+            event['processor'] = self.processor
+            self.context.on_step(event)
+
+    def run(self, name, fn, *args, **kwargs):
+        """Run fn as the step called name and record its encoded output"""
+        check_cancelled(f"step '{name}'")
+        self._emit({'event': 'step_started', 'step': name})
+        start = time.perf_counter()
+        output = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        STEP_SECONDS.observe(seconds, processor=self.processor, step=name)
+        self.record(name, output)
+        self._emit({'event': 'step_finished', 'step': name, 'seconds': seconds})
+        return output
+
+    @contextmanager
+    def timed(self, name):
+        """Time a block that produces no step output, such as Decode"""
+        self._emit({'event': 'step_started', 'step': name})
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        STEP_SECONDS.observe(seconds, processor=self.processor, step=name)
+        self._emit({'event': 'step_finished', 'step': name, 'seconds': seconds})
+
+    def wants(self, name):
+        """Whether the output of step name is returned"""
+        return self.wanted is None or name in self.wanted
+
+    def encode(self, output, encoder=None):
+        """Encode a step or final output for the response"""
+        start = time.perf_counter()
+        encoded = (encoder or self.encoder)(output)
+        ENCODE_SECONDS.observe(time.perf_counter() - start, processor=self.processor)
+        return encoded
+
+    def record(self, name, output):
+        """Record the output of a step that ran outside run()"""
+        if not self.wants(name):
+            return
+        encoded = self.encode(output, self.preview)
+        if self.context.on_result:
+            self.context.on_result(name, encoded)
+        else:
+            self.steps[name] = encoded
+
+
+class BatchStepRecorder:
+    """Runs each step once over a stacked batch and records every item's output
+
+    items are the StepRecorders of the batch members, in batch order. split
+    turns a batch output into the per-item outputs they encode.
+    """
+
+    def __init__(self, items, split=list):
+        self.items = items
+        self.split = split
+        self.processor = items[0].processor if items else 'unknown'
+        self.context = _current_context.get() or StepContext()
+
+    def _emit(self, event):
+        if self.context.on_step:
+            event['processor'] = self.processor
+            event['batch_size'] = len(self.items)
+            self.context.on_step(event)
+
+    def run(self, name, fn, *args, **kwargs):
+        """Run fn once on the batch and record each item's part of the output"""
+        check_cancelled(f"step '{name}'")
+        self._emit({'event': 'step_started', 'step': name})
+        start = time.perf_counter()
+        output = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        STEP_SECONDS.observe(seconds, processor=self.processor, step=name)
+        self.record(name, output)
+        self._emit({'event': 'step_finished', 'step': name, 'seconds': seconds})
+        return output
+
+    @contextmanager
+    def timed(self, name):
+        """Time a block over the whole batch that records nothing itself"""
+        self._emit({'event': 'step_started', 'step': name})
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        STEP_SECONDS.observe(seconds, processor=self.processor, step=name)
+        self._emit({'event': 'step_finished', 'step': name, 'seconds': seconds})
+
+    def wants(self, name):
+        """Whether any item returns the output of step name"""
+        return any(recorder.wants(name) for recorder in self.items)
+
+    def record(self, name, output):
+        """Record each item's part of a batch output produced outside run()"""
+        if self.wants(name):
+            for recorder, item in zip(self.items, self.split(output)):
+                recorder.record(name, item)
@@ -0,0 +1,69 @@
+import importlib
+import logging
+import threading
+import time
+
+# Modality -> role -> (module, class). Modules are imported on first use so a
+# deployment that only serves text never pays for torch, librosa or trimesh.
+MODALITIES = {
+    'text': {
+        'preprocessor': ('preprocessing.text_preprocessing', 'TextPreprocessor'),
+        'augmenter': ('preprocessing.text_augmentation', 'TextAugmenter'),
+    },
+    'image': {
+        'preprocessor': ('preprocessing.image_preprocessing', 'ImagePreprocessor'),
+        'augmenter': ('preprocessing.image_augmentation', 'ImageAugmenter'),
+    },
+    'audio': {
+        'preprocessor': ('preprocessing.audio_preprocessing', 'AudioPreprocessor'),
+        'augmenter': ('preprocessing.audio_augmentation', 'AudioAugmenter'),
+    },
+    '3d': {
+        'preprocessor': ('preprocessing.threed_preprocessing', 'ThreeDPreprocessor'),
+        'augmenter': ('preprocessing.threed_augmentation', 'ThreeDAugmenter'),
+    },
+}
+
+
+class ProcessorLoader:
+    """Imports each modality's processors on first use and keeps one instance of each"""
+
+    def __init__(self, modalities=MODALITIES):
+        self.modalities = modalities
+        self._instances = {}
+        self._load_seconds = {}
+        self._lock = threading.Lock()
+
+    def get(self, modality, role):
+        """Return the shared processor instance, importing its module if needed"""
+        instance = self._instances.get((modality, role))
+        if instance is not None:
+            return instance
+        if role not in self.modalities.get(modality, {}):
+            raise KeyError(f"Unknown processor: {modality} {role}")
+
+        with self._lock:
+            if (modality, role) not in self._instances:
+                module_name, class_name = self.modalities[modality][role]
+                start = time.perf_counter()
+                module = importlib.import_module(module_name)
+                self._instances[(modality, role)] = getattr(module, class_name)()
+                self._load_seconds[module_name] = time.perf_counter() - start
+                logging.debug(f"Loaded {module_name} in {self._load_seconds[module_name]:.2f}s")
+        return self._instances[(modality, role)]
+
+    def load(self, modalities=None):
+        """Import the given modalities (all by default) ahead of the first request"""
+        for modality in modalities or list(self.modalities):
+            for role in self.modalities[modality]:
+                self.get(modality, role)
+
+    def stats(self):
+        """Report which modules are loaded and how long each took to import"""
+        return {
+            'loaded': sorted(f"{modality}:{role}" for modality, role in self._instances),
+            'load_seconds': dict(self._load_seconds)
+        }
+
+
+processors = ProcessorLoader()
@@ -0,0 +1,52 @@
+import contextvars
+import random
+from contextlib import contextmanager
+
+
+class Generators:
+    """The random sources of one processor call
+
+    random is a random.Random, numpy a NumPy RandomState and torch a
+    torch.Generator, all seeded from seed and private to the call, so
+    concurrent calls never share or rewind each other's streams. Without a
+    seed they are the process-wide generators (torch is then None, which
+    torch functions read as their default generator).
+    """
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.random = random if seed is None else random.Random(seed)
+        self._numpy = None
+        self._torch = None
+
+    @property
+    def numpy(self):
+        if self._numpy is None:
+            import numpy as np
+            self._numpy = np.random if self.seed is None else np.random.RandomState(self.seed % 2**32)
+        return self._numpy
+
+    @property
+    def torch(self):
+        if self._torch is None and self.seed is not None:
+            import torch
+            self._torch = torch.Generator().manual_seed(self.seed)
+        return self._torch
+
+
+_current_generators = contextvars.ContextVar('generators', default=Generators())
+
+
+@contextmanager
+def seeded(seed):
+    """Give the steps run inside this block their own Generators seeded from seed"""
+    token = _current_generators.set(Generators(seed))
+    try:
+        yield
+    finally:
+        _current_generators.reset(token)
+
+
+def generators():
+    """Return the Generators of the running call, the process-wide ones if it is unseeded"""
+    return _current_generators.get()
@@ -0,0 +1,180 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from preprocessing.pipeline import PipelineCancelled, current_step_context
+from preprocessing.randomness import seeded
+
+
+def _result_size(value):
+    """Approximate the memory held by a processor result, in bytes"""
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_result_size(k) + _result_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_result_size(item) for item in value)
+    return 8
+
+
+def make_key(namespace, data, options, *extra):
+    """Hash the input bytes plus normalized options into a cache key"""
+    digest = hashlib.sha256(namespace.encode('utf-8'))
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    elif not isinstance(data, (bytes, bytearray, memoryview)):
+        data = json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+    digest.update(hashlib.sha256(data).digest())
+    digest.update(json.dumps([options, extra], sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _Pending:
+    """A computation that concurrent identical requests wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    """Bounded LRU cache of processor results with request coalescing
+
+    Entries are evicted oldest-first once their combined size exceeds
+    max_bytes. Identical requests that arrive while the first one is still
+    computing wait for it instead of computing again. Cached results are
+    shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        """Return the cached result for key, computing it at most once
+
+        A waiter whose owner was cancelled or timed out computes the result
+        itself, since the owner's deadline is not its own.
+        """
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                pending = self._pending.get(key)
+                owner = pending is None
+                if owner:
+                    pending = self._pending[key] = _Pending()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+            if owner:
+                return self._compute(key, pending, compute)
+            pending.done.wait()
+            if isinstance(pending.error, PipelineCancelled):
+                continue
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+    def _compute(self, key, pending, compute):
+        try:
+            result = compute()
+        except Exception as e:
+            pending.error = e
+            raise
+        else:
+            pending.result = result
+            self._store(key, result)
+            return result
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.done.set()
+
+    def _store(self, key, result):
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = (result, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'in_flight': len(self._pending)
+            }
+
+
+# Process-wide cache; RESULT_CACHE_MAX_BYTES=0 disables it
+result_cache = ResultCache(int(os.environ.get('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024)))
+
+def cached(randomized=False):
+    """Serve a processor's preprocess/augment results from result_cache
+
+    randomized is a bool or a function of the options telling whether the
+    result depends on random draws. Such calls are cached only when options
+    carry a 'seed', which seeds the Generators their steps draw from;
+    without one they always recompute. Calls
+    whose step_context watches steps (jobs, streaming) bypass the cache so
+    their step events still fire.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, data, options, *args, **kwargs):
+            # Read uploaded streams once so they can be hashed and reused
+            if hasattr(data, 'read'):
+                data = data.read()
+
+            is_random = randomized(options) if callable(randomized) else randomized
+            seed = options.get('seed') if isinstance(options, dict) else None
+            if is_random and seed is not None:
+                seed = int(seed)
+
+                def compute():
+                    with seeded(seed):
+                        return method(self, data, options, *args, **kwargs)
+            else:
+                def compute():
+                    return method(self, data, options, *args, **kwargs)
+
+            context = current_step_context()
+            if (result_cache.max_bytes <= 0 or (is_random and seed is None)
+                    or (context is not None and context.observed)):
+                return compute()
+
+            namespace = f"{type(self).__name__}.{method.__name__}"
+            key = make_key(namespace, data, options, args, kwargs)
+            return result_cache.get_or_compute(key, compute)
+        return wrapper
+    return decorator
@@ -0,0 +1,59 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class ResultStore:
+    """Bounded in-memory store for binary results that clients fetch by URL
+
+    Holds at most max_items results and max_bytes of data (0 for no byte
+    limit), evicting the least recently fetched first. A result expires
+    ttl_seconds after it was stored or last fetched.
+    """
+
+    def __init__(self, max_items=512, ttl_seconds=600, max_bytes=256 * 1024 * 1024):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, data, mimetype):
+        """Store bytes and return the id to fetch them with"""
+        result_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._items[result_id] = (time.monotonic(), data, mimetype)
+            self._size += len(data)
+            # Drop the least recently used results once the store is full;
+            # a result larger than max_bytes is still kept on its own
+            while len(self._items) > 1 and (len(self._items) > self.max_items or
+                                            0 < self.max_bytes < self._size):
+                self._pop_oldest()
+        return result_id
+
+    def get(self, result_id):
+        """Return (data, mimetype) or None if the result is unknown or expired"""
+        with self._lock:
+            self._expire()
+            item = self._items.get(result_id)
+            if item is None:
+                return None
+            self._items[result_id] = (time.monotonic(), item[1], item[2])
+            self._items.move_to_end(result_id)
+        return item[1], item[2]
+
+    def _pop_oldest(self):
+        _, (_, data, _) = self._items.popitem(last=False)
+        self._size -= len(data)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._items:
+            # Items are ordered by last use, so the first is the stalest
+            used, _, _ = next(iter(self._items.values()))
+            if used >= cutoff:
+                break
+            self._pop_oldest()
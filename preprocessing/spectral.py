@@ -0,0 +1,57 @@
+import torch
+
+from preprocessing.randomness import generators
+
+# torchaudio's GriffinLim and masking transforms draw from torch's global
+# generator; these are the same algorithms drawing from the call's own.
+
+
+def griffin_lim(specgram, n_fft, hop_length=None, n_iter=32, power=2.0, momentum=0.99):
+    """Reconstruct a waveform from a power spectrogram, like torchaudio.transforms.GriffinLim
+
+    The initial phase is random, so the result depends on the call's
+    generator.
+    """
+    hop_length = hop_length or n_fft // 2
+    window = torch.hann_window(n_fft, device=specgram.device)
+    momentum = momentum / (1 + momentum)
+
+    shape = specgram.size()
+    specgram = specgram.reshape([-1] + list(shape[-2:])).pow(1 / power)
+    complex_dtype = torch.complex128 if specgram.dtype == torch.float64 else torch.complex64
+    angles = torch.rand(specgram.size(), dtype=complex_dtype, generator=generators().torch).to(specgram.device)
+
+    previous = torch.tensor(0.0, dtype=specgram.dtype, device=specgram.device)
+    for _ in range(n_iter):
+        inverse = torch.istft(specgram * angles, n_fft=n_fft, hop_length=hop_length, window=window)
+        rebuilt = torch.stft(inverse, n_fft=n_fft, hop_length=hop_length, window=window, center=True,
+                             pad_mode='reflect', normalized=False, onesided=True, return_complex=True)
+        angles = rebuilt
+        if momentum:
+            angles = angles - previous.mul_(momentum)
+        angles = angles.div(angles.abs().add(1e-16))
+        previous = rebuilt
+
+    waveform = torch.istft(specgram * angles, n_fft=n_fft, hop_length=hop_length, window=window)
+    return waveform.reshape(shape[:-2] + waveform.shape[-1:])
+
+
+def mask_along_axis(specgram, mask_param, axis, iid=False):
+    """Zero one random band of up to mask_param bins along axis (-2 frequency, -1 time)
+
+    Like torchaudio's FrequencyMasking and TimeMasking: one band for the
+    whole tensor, or with iid one band per spectrogram of the leading
+    dimensions.
+    """
+    generator = generators().torch
+    draws = specgram.shape[:-2] if iid else ()
+    size = specgram.size(axis)
+    value = torch.rand(draws, generator=generator) * mask_param
+    start = (torch.rand(draws, generator=generator) * (size - value)).long()
+    end = start + value.long()
+
+    bins = torch.arange(size, device=specgram.device)
+    if axis == -2:
+        bins = bins.unsqueeze(-1)
+    start, end = start[..., None, None].to(specgram.device), end[..., None, None].to(specgram.device)
+    return specgram.masked_fill((bins >= start) & (bins < end), 0.0)
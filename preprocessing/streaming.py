@@ -0,0 +1,79 @@
+import json
+import logging
+import queue
+import threading
+
+from preprocessing.pipeline import PipelineCancelled, PipelineTimeout, check_cancelled, step_context
+
+_DONE = object()
+# Events the pipeline may run ahead of a slow client; it waits for room after that
+MAX_PENDING_EVENTS = 4
+_POLL_SECONDS = 0.1
+
+
+def stream_steps(fn, *args, deadline=None, **kwargs):
+    """Run a pipeline in a thread and yield its step results as they finish
+
+    Yields {'event': 'step', 'step': name, 'output': ...} for every recorded
+    step, then {'event': 'result', 'result': ...} with the final result (its
+    steps dict is empty, each step was already sent) or {'event': 'error',
+    'error': ...}. Each output is released once the consumer has taken it.
+    Closing the generator early, e.g. when the client disconnects, cancels
+    the pipeline before its next step, as does passing deadline. At most
+    MAX_PENDING_EVENTS outputs wait for the consumer at a time.
+    """
+    events = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+    cancelled = threading.Event()
+
+    def put(event, where=None):
+        """Wait for room for event until the consumer goes away (or, at a step, the deadline passes)"""
+        while not cancelled.is_set():
+            try:
+                events.put(event, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                if where:
+                    check_cancelled(where)
+
+    def on_result(name, output):
+        where = f"streaming of {name}"
+        put({'event': 'step', 'step': name, 'output': output}, where)
+        # Stop now, not at the next step, if the client left while this one waited
+        check_cancelled(where)
+
+    def run():
+        try:
+            with step_context(should_cancel=cancelled.is_set, on_result=on_result, deadline=deadline):
+                result = fn(*args, **kwargs)
+            put({'event': 'result', 'result': result})
+        except PipelineTimeout as e:
+            put({'event': 'error', 'error': str(e)})
+        except PipelineCancelled:
+            logging.debug("Streamed pipeline cancelled by the client")
+        except Exception as e:
+            logging.error(f"Error in streamed pipeline: {str(e)}", exc_info=True)
+            put({'event': 'error', 'error': str(e)})
+        finally:
+            put(_DONE)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            event = events.get()
+            if event is _DONE:
+                return
+            yield event
+    finally:
+        cancelled.set()
+
+
+def ndjson(events):
+    """Format events as newline-delimited JSON"""
+    for event in events:
+        yield json.dumps(event) + '\n'
+
+
+def server_sent_events(events):
+    """Format events as text/event-stream messages named after their event type"""
+    for event in events:
+        yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,164 @@
+"""Precomputed WordNet synonyms, built ahead of serving with:
+
+    python -m preprocessing.synonyms [--path DIR]
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from preprocessing.model_registry import registry
+from preprocessing.vocabulary import FIRST_ID, UNK_ID, FrozenVocabulary, load_vocabulary
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'preprocessing', 'synonyms')
+
+
+def wordnet_synonyms(word):
+    """Lemma names sharing a synset with word, excluding word itself, sorted"""
+    synonyms = set()
+    for synset in registry.get('wordnet').synsets(word):
+        for lemma in synset.lemmas():
+            if lemma.name().lower() != word.lower():
+                synonyms.add(lemma.name())
+    return sorted(synonyms)
+
+
+class SynonymIndex:
+    """Precomputed WordNet synonyms stored in flat, memory-mappable arrays
+
+    Every WordNet lemma name (lowercased) maps to a slice of candidates, a
+    list of ids into a table of synonym strings. Both string tables are
+    FrozenVocabulary arrays, so the index is shared read-only by every
+    worker process. Words outside the index, such as inflected forms, are
+    looked up in WordNet and kept in an LRU of cache_size entries.
+    """
+
+    def __init__(self, words=None, lemmas=None, offsets=None, candidates=None, cache_size=10000):
+        self.words = words
+        self.lemmas = lemmas
+        self.offsets = offsets
+        self.candidates = candidates
+        self._fallback = functools.lru_cache(maxsize=cache_size)(wordnet_synonyms)
+
+    @classmethod
+    def build(cls, cache_size=10000):
+        """Compute the synonyms of every WordNet lemma name"""
+        wordnet = registry.get('wordnet')
+        names = sorted({name.lower() for name in wordnet.all_lemma_names()})
+        synonyms = [wordnet_synonyms(name) for name in names]
+        lemmas = sorted({synonym for candidates in synonyms for synonym in candidates})
+        lemma_ids = {lemma: index for index, lemma in enumerate(lemmas)}
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(candidates) for candidates in synonyms])
+        candidates = np.fromiter((lemma_ids[synonym] for candidates in synonyms for synonym in candidates),
+                                 dtype=np.int32, count=int(offsets[-1]))
+        return cls(FrozenVocabulary.from_tokens(names), FrozenVocabulary.from_tokens(lemmas),
+                   offsets, candidates, cache_size)
+
+    def save(self, path):
+        """Write the index to a directory that load() can memory-map"""
+        os.makedirs(path, exist_ok=True)
+        self.words.save(os.path.join(path, 'words'))
+        self.lemmas.save(os.path.join(path, 'lemmas'))
+        np.save(os.path.join(path, 'offsets.npy'), np.asarray(self.offsets))
+        np.save(os.path.join(path, 'candidates.npy'), np.asarray(self.candidates))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'words': len(self.words), 'lemmas': len(self.lemmas),
+                       'candidates': len(self.candidates)}, f)
+
+    @classmethod
+    def load(cls, path, cache_size=10000):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        # Empty arrays cannot be memory-mapped
+        mmap_mode = 'r' if meta['candidates'] else None
+        return cls(load_vocabulary(os.path.join(path, 'words')),
+                   load_vocabulary(os.path.join(path, 'lemmas')),
+                   np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, 'candidates.npy'), mmap_mode=mmap_mode),
+                   cache_size)
+
+    def synonyms(self, word):
+        """Return the synonyms of word, as get_synonyms() would find them in WordNet"""
+        if self.words is not None:
+            word_id = self.words.lookup(word.lower())
+            if word_id != UNK_ID:
+                index = word_id - FIRST_ID
+                candidates = self.candidates[self.offsets[index]:self.offsets[index + 1]]
+                return [self.lemmas.token(FIRST_ID + int(candidate)) for candidate in candidates]
+        return self._fallback(word.lower())
+
+    def use(self, index):
+        """Start answering from the tables of another (loaded) index"""
+        self.lemmas = index.lemmas
+        self.offsets = index.offsets
+        self.candidates = index.candidates
+        # Set last: synonyms() only reads the other tables once words is set
+        self.words = index.words
+
+    def cache_info(self):
+        return self._fallback.cache_info()._asdict()
+
+
+def load_or_build(path=DEFAULT_INDEX_PATH, cache_size=10000):
+    """Load the index at path, building and saving it from WordNet the first time"""
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return SynonymIndex.load(path, cache_size)
+    logging.info(f"Building synonym index at {path}")
+    index = SynonymIndex.build(cache_size)
+    # Saved beside the final path and renamed, so concurrent builders never
+    # load a half-written index
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    index.save(temporary)
+    try:
+        os.replace(temporary, path)
+    except OSError:
+        # Another process finished first
+        logging.debug(f"Synonym index at {path} already exists")
+        shutil.rmtree(temporary, ignore_errors=True)
+    return SynonymIndex.load(path, cache_size)
+
+
+def load_when_ready(path=DEFAULT_INDEX_PATH, cache_size=10000, build=True):
+    """Return the index at path, or one answering from WordNet word by word until it exists
+
+    With build, a missing index is built by a background thread and swapped
+    in once saved, so no request waits for the full WordNet scan; otherwise
+    it is expected from `python -m preprocessing.synonyms`.
+    """
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return SynonymIndex.load(path, cache_size)
+    index = SynonymIndex(cache_size=cache_size)
+    if not build:
+        logging.warning(f"No synonym index at {path}; build it with python -m preprocessing.synonyms")
+        return index
+
+    def run():
+        try:
+            index.use(load_or_build(path, cache_size))
+            logging.info(f"Synonym index at {path} is ready")
+        except Exception as e:
+            logging.error(f"Building the synonym index failed: {str(e)}", exc_info=True)
+
+    threading.Thread(target=run, name='synonym-index-build', daemon=True).start()
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the WordNet synonym index the text augmenter serves from')
+    parser.add_argument('--path', default=os.environ.get('SYNONYM_INDEX_PATH') or DEFAULT_INDEX_PATH,
+                        help='index directory (default: SYNONYM_INDEX_PATH or %(default)s)')
+    args = parser.parse_args(argv)
+    index = load_or_build(args.path)
+    print(f"Synonym index at {args.path}: {len(index.words)} words, {len(index.candidates)} candidates")
+
+
+if __name__ == '__main__':
+    main()
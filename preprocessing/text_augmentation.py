@@ -1,146 +1,187 @@
-from transformers import pipeline
-import random
-from nltk.corpus import wordnet
-import nltk
+from preprocessing.model_registry import registry
+from preprocessing.pipeline import StepRecorder, BatchStepRecorder, variant_count
+from preprocessing.randomness import generators
+from preprocessing.result_cache import cached
 
-# Download required NLTK data
-nltk.download('wordnet')
-nltk.download('averaged_perceptron_tagger')
+# Placeholders that augmentation never replaces, deletes or copies
+SPECIAL_TOKENS = frozenset(['<PAD>', '[MASK]'])
 
 class TextAugmenter:
     def __init__(self):
-        # Load MLM model for word replacement
-        self.unmasker = pipeline('fill-mask', model='bert-base-uncased')
         self.mask_token = '[MASK]'
-        
-    def word_replacement_mlm(self, text, n_words=1):
-        """Replace random words using BERT MLM"""
-        words = text.split()
+
+    @property
+    def unmasker(self):
+        """Shared fill-mask pipeline, loaded once per process"""
+        return registry.get('fill-mask')
+
+    @property
+    def masked_lm(self):
+        """Shared predictor reading every mask from one forward pass"""
+        return registry.get('masked-lm')
+
+    def _choose_positions(self, words, n_words):
+        # Words holding a mask token are kept: the tokenizer reads it as a mask
+        replaceable_positions = [i for i, word in enumerate(words)
+                                 if word not in SPECIAL_TOKENS and self.mask_token not in word]
+        return generators().random.sample(replaceable_positions, min(n_words, len(replaceable_positions)))
+
+    def _mask_slots(self, masked, chosen):
+        """For every mask token of a masked text, in order, the chosen position it covers
+
+        Mask tokens the input already contained get None: the model predicts
+        them too, and their predictions must not shift onto chosen words.
+        """
+        slots = []
+        for index, word in enumerate(masked):
+            if index in chosen:
+                slots.append(index)
+            else:
+                slots.extend([None] * word.count(self.mask_token))
+        return slots
+
+    def _mask_requests(self, words, positions, mode):
+        """Return the masked texts for one text and, per text, the slots of its masks (see _mask_slots)
+
+        'joint' masks every chosen position in one text; 'independent' makes
+        one single-mask text per position, so each word is predicted from
+        otherwise intact context.
+        """
+        if mode == 'joint':
+            masked = list(words)
+            for pos in positions:
+                masked[pos] = self.mask_token
+            return [' '.join(masked)], [self._mask_slots(masked, set(positions))]
+        if mode == 'independent':
+            requests = []
+            slots = []
+            for pos in positions:
+                masked = list(words)
+                masked[pos] = self.mask_token
+                requests.append(' '.join(masked))
+                slots.append(self._mask_slots(masked, {pos}))
+            return requests, slots
+        raise ValueError(f"Unknown MLM replacement mode: {mode}")
+
+    def _apply_predictions(self, words, positions, predictions):
+        """Replace each chosen word with its best prediction that differs from it"""
         changes = {'positions': [], 'old_words': [], 'new_words': []}
-        
-        if not words:
-            return text, changes
-            
-        # Randomly select words to replace (excluding special tokens)
-        replaceable_positions = [i for i, word in enumerate(words) 
-                               if word not in ['<PAD>', '[MASK]']]
-        
-        if not replaceable_positions:
-            return text, changes
-        
-        # Randomly select n positions to replace
-        n_words = min(n_words, len(replaceable_positions))
-        positions_to_replace = random.sample(replaceable_positions, n_words)
-        
-        for pos in positions_to_replace:
+        new_words = {}
+        for pos, candidates in predictions.items():
             original_word = words[pos].lower()
-            
-            # Create masked text
-            words[pos] = self.mask_token
-            masked_text = ' '.join(words)
-        
-            # Get predictions and filter out the original word
-            predictions = self.unmasker(masked_text)
-            filtered_predictions = [
-                pred for pred in predictions 
-                if pred['token_str'].lower() != original_word
-            ]
-            
-            # If we have filtered predictions, use them; otherwise try again
-            if filtered_predictions:
-                new_word = filtered_predictions[0]['token_str']
-            else:
-                # If no alternative found, try getting more predictions
-                predictions = self.unmasker(masked_text, top_k=10)
-                filtered_predictions = [
-                    pred for pred in predictions 
-                    if pred['token_str'].lower() != original_word
-                ]
-                new_word = filtered_predictions[0]['token_str'] if filtered_predictions else original_word
-        
-            # Replace word
+            new_words[pos] = next((candidate for candidate in candidates
+                                   if candidate.lower() != original_word), original_word)
+
+        # Changes are reported in the order the positions were chosen
+        words = list(words)
+        for pos in positions:
+            original_word = words[pos].lower()
+            new_word = new_words.get(pos, original_word)
             words[pos] = new_word
-            
-            # Only track changes if we actually replaced with a different word
             if new_word.lower() != original_word:
                 changes['positions'].append(pos)
                 changes['old_words'].append(original_word)
                 changes['new_words'].append(new_word)
-        
-        return ' '.join(words), changes
-        
-    def random_insertion(self, text, n_words=1):
-        """Insert words randomly from the existing vocabulary"""
-        words = text.split()
+        return words, changes
+
+    def _mlm_tokens_batch(self, token_lists, n_words=1, mode='joint'):
+        """Token-list form of word_replacement_mlm_batch: returns (words, changes) pairs"""
+        items = []
+        requests = []
+        covered = []
+        for words in token_lists:
+            positions = self._choose_positions(words, n_words)
+            item_requests, item_covered = self._mask_requests(words, positions, mode) if positions else ([], [])
+            items.append((words, positions, len(requests), len(item_requests)))
+            requests.extend(item_requests)
+            covered.extend(item_covered)
+
+        predictions = self.masked_lm.predict(requests, top_k=10) if requests else []
+
+        results = []
+        for words, positions, first, count in items:
+            if not positions:
+                results.append((words, {'positions': [], 'old_words': [], 'new_words': []}))
+                continue
+            item_predictions = {}
+            for request_slots, request_predictions in zip(covered[first:first + count],
+                                                          predictions[first:first + count]):
+                # Masks cut off by truncation are missing from the end
+                item_predictions.update((pos, candidates) for pos, candidates in zip(request_slots, request_predictions)
+                                        if pos is not None)
+            results.append(self._apply_predictions(words, positions, item_predictions))
+        return results
+
+    def word_replacement_mlm(self, text, n_words=1, mode='joint'):
+        """Replace random words using BERT MLM
+
+        All chosen words are predicted in a single forward pass: masked
+        together in one text ('joint') or as one batch of single-mask texts
+        ('independent').
+        """
+        return self.word_replacement_mlm_batch([text], n_words, mode)[0]
+
+    def word_replacement_mlm_batch(self, texts, n_words=1, mode='joint'):
+        """Replace random words in many texts with one batched MLM prediction
+
+        Top-10 candidates are read from the logits for every mask, so the
+        original word can be skipped without a second call.
+        """
+        results = []
+        for text, (words, changes) in zip(texts, self._mlm_tokens_batch([text.split() for text in texts],
+                                                                         n_words, mode)):
+            results.append((' '.join(words) if changes['positions'] else text, changes))
+        return results
+
+    def _insert_tokens(self, words, n_words=1):
+        """Insert n_words copies of random existing words in one pass over words"""
         changes = {'positions': [], 'new_words': []}
-        
-        if not words:
-            return text, changes
-            
-        insertable_words = [w for w in words if w not in ['<PAD>', '[MASK]']]
+        insertable_words = [w for w in words if w not in SPECIAL_TOKENS]
         if not insertable_words:
-            return text, changes
-        
-        # Sort positions in ascending order to track shifts
-        insert_positions = []
-        for _ in range(n_words):
-            position = random.randint(0, len(words))
-            insert_positions.append(position)
-        
-        # Sort positions to handle shifts correctly
-        insert_positions.sort()
-        
-        # Track position shifts
-        position_shift = 0
-        
-        for pos in insert_positions:
-            word_to_insert = random.choice(insertable_words)
-            actual_position = pos + position_shift
-            
-            # Insert word
-            words.insert(actual_position, word_to_insert)
-            
-            # Track changes with original position
-            changes['positions'].append(actual_position)
+            return words, changes
+
+        rng = generators().random
+        insert_positions = sorted(rng.randint(0, len(words)) for _ in range(n_words))
+        result = []
+        start = 0
+        # Each earlier insertion shifts the later ones right by one
+        for shift, pos in enumerate(insert_positions):
+            result.extend(words[start:pos])
+            start = pos
+            word_to_insert = rng.choice(insertable_words)
+            result.append(word_to_insert)
+            changes['positions'].append(pos + shift)
             changes['new_words'].append(word_to_insert)
-            
-            # Increment shift for next insertion
-            position_shift += 1
-        
-        return ' '.join(words), changes
-        
-    def random_deletion(self, text, n_words=1):
-        """Randomly delete words"""
-        words = text.split()
+        result.extend(words[start:])
+        return result, changes
+
+    def random_insertion(self, text, n_words=1):
+        """Insert words randomly from the existing vocabulary"""
+        words, changes = self._insert_tokens(text.split(), n_words)
+        return (' '.join(words) if changes['positions'] else text), changes
+
+    def _delete_tokens(self, words, n_words=1):
+        """Delete n_words random words other than special tokens"""
         changes = {'positions': [], 'deleted_words': []}
-        
-        if not words:
-            return text, changes
-            
-        # Don't delete special tokens or try to delete more words than available
-        deletable_positions = [i for i, word in enumerate(words) 
-                             if word not in ['<PAD>', '[MASK]']]
-        
+        deletable_positions = [i for i, word in enumerate(words) if word not in SPECIAL_TOKENS]
         if not deletable_positions:
-            return text, changes
+            return words, changes
 
-        # Ensure we don't try to delete more words than available
-        n_words = min(n_words, len(deletable_positions))
-        
-        # Select positions to delete (no need to sort)
-        positions_to_delete = random.sample(deletable_positions, n_words)
-        
-        # Create the result by marking deleted words with strikethrough
-        result_words = []
+        positions_to_delete = set(generators().random.sample(deletable_positions,
+                                                             min(n_words, len(deletable_positions))))
+        result = []
         for i, word in enumerate(words):
             if i in positions_to_delete:
-                # Keep the word in place but mark it as deleted
                 changes['positions'].append(i)
                 changes['deleted_words'].append(word)
             else:
-                result_words.append(word)
-        
-        return ' '.join(result_words), changes
+                result.append(word)
+        return result, changes
+
+    def random_deletion(self, text, n_words=1):
+        """Randomly delete words"""
+        words, changes = self._delete_tokens(text.split(), n_words)
+        return (' '.join(words) if changes['positions'] else text), changes
         
     def word_replacement(self, text, n_words=1):
         """Replace random word with another from vocabulary"""
@@ -148,10 +189,11 @@ class TextAugmenter:
         if len(words) < 2:  # Need at least 2 words to replace
             return text
         
+        rng = generators().random
         for _ in range(n_words):
             # Select positions for replacement
-            pos = random.randint(0, len(words) - 1)
-            replacement = random.choice(words)  # Use existing word as replacement
+            pos = rng.randint(0, len(words) - 1)
+            replacement = rng.choice(words)  # Use existing word as replacement
             words[pos] = replacement
         
         augmented_text = ' '.join(words)
@@ -159,7 +201,8 @@ class TextAugmenter:
         
     def get_wordnet_pos(self, word):
         """Map POS tag to first character lemmatize() accepts"""
-        tag = nltk.pos_tag([word])[0][1][0].upper()
+        wordnet = registry.get('wordnet')
+        tag = registry.get('pos-tagger').tag([word])[0][1][0].upper()
         tag_dict = {"J": wordnet.ADJ,
                    "N": wordnet.NOUN,
                    "V": wordnet.VERB,
@@ -167,99 +210,181 @@ class TextAugmenter:
         return tag_dict.get(tag, wordnet.NOUN)
 
     def get_synonyms(self, word):
-        """Get synonyms for a word"""
-        synonyms = []
-        for syn in wordnet.synsets(word):
-            for lemma in syn.lemmas():
-                if lemma.name().lower() != word.lower():  # Don't include the word itself
-                    synonyms.append(lemma.name())
-        return list(set(synonyms))  # Remove duplicates
+        """Get synonyms for a word from the shared synonym index"""
+        return registry.get('synonym-index').synonyms(word)
 
-    def synonym_replacement(self, text, n_words=1):
-        """Replace random words with synonyms"""
-        words = text.split()
+    def _synonym_tokens(self, words, n_words=1):
+        """Replace up to n_words random words that have synonyms
+
+        Words are visited in random order and only until n_words of them
+        have synonyms, so long texts are not looked up word by word.
+        """
         changes = {'positions': [], 'old_words': [], 'new_words': []}
-        
-        if not words:
-            return text, changes
+        candidate_positions = [i for i, word in enumerate(words) if word not in SPECIAL_TOKENS]
+        rng = generators().random
+        rng.shuffle(candidate_positions)
 
-        # Find replaceable words (those with synonyms)
-        replaceable_positions = []
-        for i, word in enumerate(words):
-            if word not in ['<PAD>', '[MASK]']:
-                synonyms = self.get_synonyms(word)
-                if synonyms:
-                    replaceable_positions.append((i, word, synonyms))
-        
-        if not replaceable_positions:
-            return text, changes
-        
-        # Randomly select n words to replace
-        n_words = min(n_words, len(replaceable_positions))
-        positions_to_replace = random.sample(replaceable_positions, n_words)
-        
-        for pos, word, synonyms in positions_to_replace:
-            synonym = random.choice(synonyms)
+        words = list(words)
+        for pos in candidate_positions:
+            if len(changes['positions']) >= n_words:
+                break
+            word = words[pos]
+            synonyms = self.get_synonyms(word)
+            if not synonyms:
+                continue
+            synonym = rng.choice(synonyms)
             words[pos] = synonym
-            
-            # Track changes
             changes['positions'].append(pos)
             changes['old_words'].append(word)
             changes['new_words'].append(synonym)
-        
-        return ' '.join(words), changes
+        return words, changes
 
+    def synonym_replacement(self, text, n_words=1):
+        """Replace random words with synonyms"""
+        words, changes = self._synonym_tokens(text.split(), n_words)
+        return (' '.join(words) if changes['positions'] else text), changes
+
+    @cached(randomized=True)
     def augment(self, text, options, n_words):
-        """Apply selected augmentation techniques"""
-        steps = {}
-        augmented_text = text
-        
+        """Apply selected augmentation techniques
+
+        The text is split into tokens once and every method works on token
+        lists. With options['num_variants'] = K, K independent variants are
+        drawn in the same call (each step runs over all of them at once, and
+        MLM replacement predicts every variant in one batch); they are
+        returned under 'variants', the first also at the top level. K is at
+        most MAX_VARIANTS. A 'seed' option makes the variants reproducible.
+        """
         # Convert input to text if it's a dictionary
         if isinstance(text, dict) and 'tokens' in text:
-            augmented_text = ' '.join(text['tokens'])
-        
+            text = ' '.join(text['tokens'])
+
+        num_variants = variant_count(options)
+        # Step outputs are joined back into text only if they are returned
+        recorders = [StepRecorder(lambda output: {'text': ' '.join(output[0]), 'changes': output[1]},
+                                  'TextAugmenter', options)
+                     for _ in range(num_variants)]
+        batch = BatchStepRecorder(recorders)
+        tokens = text.split()
+        variants = [tokens] * num_variants
+        changed = False
+
+        def apply(step_name, method, key):
+            outputs = batch.run(step_name, lambda: [method(words, n_words[key]) for words in variants])
+            return [words for words, _ in outputs], any(changes['positions'] for _, changes in outputs)
+
         if options.get('synonym_replacement'):
-            augmented_text, changes = self.synonym_replacement(
-                augmented_text, 
-                n_words=n_words['synonym_replacement']
-            )
-            steps['Synonym Replacement'] = {
-                'text': augmented_text,
-                'changes': changes
-            }
-            
+            variants, step_changed = apply('Synonym Replacement', self._synonym_tokens, 'synonym_replacement')
+            changed = changed or step_changed
+
         if options.get('mlm_replacement'):
-            augmented_text, changes = self.word_replacement_mlm(
-                augmented_text, 
-                n_words=n_words['mlm_replacement']
-            )
-            steps['Word Replacement'] = {
-                'text': augmented_text,
-                'changes': changes
-            }
-            
+            mode = options.get('mlm_mode', 'joint')
+            outputs = batch.run('Word Replacement', self._mlm_tokens_batch,
+                                variants, n_words['mlm_replacement'], mode)
+            variants = [words for words, _ in outputs]
+            changed = changed or any(changes['positions'] for _, changes in outputs)
+
         if options.get('random_insertion'):
-            augmented_text, changes = self.random_insertion(
-                augmented_text, 
-                n_words=n_words['random_insertion']
-            )
-            steps['Random Insertion'] = {
-                'text': augmented_text,
-                'changes': changes
-            }
-            
+            variants, step_changed = apply('Random Insertion', self._insert_tokens, 'random_insertion')
+            changed = changed or step_changed
+
         if options.get('random_deletion'):
-            augmented_text, changes = self.random_deletion(
-                augmented_text, 
-                n_words=n_words['random_deletion']
+            variants, step_changed = apply('Random Deletion', self._delete_tokens, 'random_deletion')
+            changed = changed or step_changed
+
+        # Untouched input keeps its original whitespace
+        results = [{
+            'augmentation_steps': recorder.steps,
+            'augmented_text': ' '.join(words) if changed else text
+        } for recorder, words in zip(recorders, variants)]
+        result = dict(results[0])
+        if num_variants > 1:
+            result['variants'] = results
+        return result
+
+    def augment_batch(self, texts, options, n_words):
+        """Augment many texts with shared options, keeping per-item errors
+
+        MLM replacement runs batched across all texts; the other methods are
+        cheap and run per text.
+        """
+        results = []
+        for text in texts:
+            if isinstance(text, dict) and 'tokens' in text:
+                text = ' '.join(text['tokens'])
+            if not isinstance(text, str):
+                results.append({'error': 'Expected text or a dict with tokens'})
+                continue
+            results.append({'augmentation_steps': {}, 'augmented_text': text})
+
+        # Used for its return_steps filter only; steps here are recorded by hand
+        selection = StepRecorder(None, 'TextAugmenter', options)
+
+        def apply(step_name, method, key):
+            for result in results:
+                if 'error' in result:
+                    continue
+                try:
+                    augmented_text, changes = method(result['augmented_text'], n_words=n_words[key])
+                    result['augmented_text'] = augmented_text
+                    if selection.wants(step_name):
+                        result['augmentation_steps'][step_name] = {'text': augmented_text, 'changes': changes}
+                except Exception as e:
+                    result.clear()
+                    result['error'] = str(e)
+
+        if options.get('synonym_replacement'):
+            apply('Synonym Replacement', self.synonym_replacement, 'synonym_replacement')
+
+        if options.get('mlm_replacement'):
+            pending = [result for result in results if 'error' not in result]
+            replaced = self.word_replacement_mlm_batch(
+                [result['augmented_text'] for result in pending],
+                n_words=n_words['mlm_replacement'],
+                mode=options.get('mlm_mode', 'joint')
             )
-            steps['Random Deletion'] = {
-                'text': augmented_text,
-                'changes': changes
-            }
-        
-        print(steps)
-        return {
-            'augmentation_steps': steps,
-            'augmented_text': augmented_text
-        } 
\ No newline at end of file
+            for result, (augmented_text, changes) in zip(pending, replaced):
+                result['augmented_text'] = augmented_text
+                if selection.wants('Word Replacement'):
+                    result['augmentation_steps']['Word Replacement'] = {'text': augmented_text, 'changes': changes}
+
+        if options.get('random_insertion'):
+            apply('Random Insertion', self.random_insertion, 'random_insertion')
+
+        if options.get('random_deletion'):
+            apply('Random Deletion', self.random_deletion, 'random_deletion')
+
+        return results
+
+
+def augment_args(options):
+    """Convert /augment-style options into TextAugmenter.augment's (options, n_words)"""
+    processed_options = {
+        'synonym_replacement': options.get('synonym_replacement', {}).get('enabled', False),
+        'mlm_replacement': options.get('mlm_replacement', {}).get('enabled', False),
+        'random_insertion': options.get('random_insertion', {}).get('enabled', False),
+        'random_deletion': options.get('random_deletion', {}).get('enabled', False)
+    }
+    
+    # Get n_words for each method
+    n_words = {
+        'synonym_replacement': options.get('synonym_replacement', {}).get('n_words', 3),
+        'mlm_replacement': options.get('mlm_replacement', {}).get('n_words', 3),
+        'random_insertion': options.get('random_insertion', {}).get('n_words', 3),
+        'random_deletion': options.get('random_deletion', {}).get('n_words', 2)
+    }
+
+    # 'joint' masks all chosen words together, 'independent' masks one per text
+    if options.get('mlm_replacement', {}).get('mode'):
+        processed_options['mlm_mode'] = options['mlm_replacement']['mode']
+
+    # Several augmented variants of the text in one call
+    if options.get('num_variants') is not None:
+        processed_options['num_variants'] = options['num_variants']
+
+    # A seed makes the augmentation reproducible and therefore cacheable;
+    # step selection is handled by StepRecorder
+    for key in ('seed', 'return_steps', 'step_previews'):
+        if options.get(key) is not None:
+            processed_options[key] = options[key]
+    return processed_options, n_words
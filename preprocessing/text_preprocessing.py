@@ -1,9 +1,75 @@
-from torchtext.data.utils import get_tokenizer
+import codecs
+import io
+import os
+import re
 import string
 
+import numpy as np
+
+from preprocessing.model_registry import registry
+from preprocessing.pipeline import StepRecorder
+from preprocessing.result_cache import cached
+from preprocessing.vocabulary import PAD_ID, Vocabulary, load_vocabulary
+
+# Text is tokenized in pieces of about this many characters, so large
+# documents never need more than one lowercased copy of a piece at a time
+CHUNK_SIZE = 1 << 20
+
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+# basic_english deletes double quotes first, turns '<br />', ';' and ':' into
+# spaces after that, and splits the rest of _TOKEN's punctuation off into
+# tokens of their own
+_QUOTE_TABLE = str.maketrans('', '', '"')
+_SEPARATOR_TABLE = str.maketrans(';:', '  ')
+_TOKEN = re.compile(r"'|[.,()!?]|[^\s'.,()!?]+")
+_LAST_SPACE = re.compile(r'\s(?=\S*$)')
+
+
+def _cut_point(piece, keep_br):
+    """Index of the last whitespace piece can be cut at, or None"""
+    end = len(piece)
+    while True:
+        match = _LAST_SPACE.search(piece, 0, end)
+        if match is None:
+            return None
+        # The space inside '<br />' is not a cut point, so the tag stays whole
+        if not (keep_br and piece[max(0, match.start() - 3):match.start()].lower() == '<br'):
+            return match.start()
+        end = match.start()
+
+
+def _chunks(text, chunk_size=None, keep_br=True):
+    """Yield pieces of a str, bytes or text/binary stream that each end on whitespace
+
+    With keep_br, a piece never ends inside '<br />', so basic_english's
+    replacement of it sees the whole tag.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        text = bytes(text).decode('utf-8')
+    if isinstance(text, str):
+        pieces = (text[start:start + chunk_size] for start in range(0, len(text), chunk_size))
+    else:
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        pieces = iter(lambda: text.read(chunk_size), '' if isinstance(text, io.TextIOBase) else b'')
+        if not isinstance(text, io.TextIOBase):
+            pieces = (decoder.decode(piece) for piece in pieces)
+
+    carry = ''
+    for piece in pieces:
+        piece = carry + piece
+        end = _cut_point(piece, keep_br)
+        if end is None:
+            carry = piece
+            continue
+        head, carry = piece[:end], piece[end:]
+        yield head
+    if carry:
+        yield carry
+
+
 class TextPreprocessor:
     def __init__(self):
-        self.tokenizer = get_tokenizer('basic_english')
         # Common English stop words
         self.stop_words = set(['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 
                              'you', "you're", "you've", "you'll", "you'd", 'your', 'yours', 
@@ -18,8 +84,20 @@ class TextPreprocessor:
                              'through', 'during', 'before', 'after', 'above', 'below', 'to', 
                              'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over', 'under', 
                              'again', 'further', 'then', 'once'])
-        self.vocab = {}  # Dictionary to store word-to-id mapping
-        self.next_id = 100  # Start token IDs from 1 (reserve 0 for padding)
+        # Word-to-id mapping. TEXT_VOCAB_PATH loads a saved vocabulary read-only
+        # and memory-mapped, so worker processes share one copy and ids stay
+        # stable across restarts; otherwise ids are assigned as words are
+        # seen, up to TEXT_VOCAB_MAX_SIZE, after which new words get the UNK id.
+        vocab_path = os.environ.get('TEXT_VOCAB_PATH')
+        if vocab_path:
+            self.vocab = load_vocabulary(vocab_path)
+        else:
+            self.vocab = Vocabulary(max_size=int(os.environ.get('TEXT_VOCAB_MAX_SIZE', 100000)) or None)
+
+    @property
+    def tokenizer(self):
+        """Shared basic_english tokenizer from the model registry"""
+        return registry.get('basic-english')
 
     def pad_sequence(self, sequence, max_length, pad_value=0):
         """Pad or truncate sequence to specified length"""
@@ -29,51 +107,165 @@ class TextPreprocessor:
 
     def get_token_id(self, token):
         """Get or create unique token ID"""
-        if token == '<PAD>':
-            return 0
-        if token not in self.vocab:
-            self.vocab[token] = self.next_id
-            self.next_id += 1
-        return self.vocab[token]
+        return self.vocab.lookup(token)
 
+    def _tokenize_chunk(self, chunk, remove_punctuation):
+        """Lowercase and split one piece of text exactly as basic_english would"""
+        chunk = chunk.lower()
+        if remove_punctuation:
+            # Nothing basic_english treats specially survives punctuation
+            # removal ('<br />' becomes 'br'), and it never touches whitespace,
+            # so pieces can be split on their own
+            return chunk.translate(_PUNCTUATION_TABLE).split()
+        return _TOKEN.findall(chunk.translate(_QUOTE_TABLE).replace('<br />', ' ').translate(_SEPARATOR_TABLE))
+
+    def tokenize(self, text, options, limit=None):
+        """Normalize, tokenize and drop stop words in one pass over the text
+
+        text may be a str, bytes or a text/binary stream; it is processed in
+        CHUNK_SIZE pieces. Tokens match basic_english run after the selected
+        text-level steps. With limit, reading stops once that many tokens
+        are kept.
+        """
+        remove_punctuation = bool(options.get('punctuation_removal'))
+        stop_words = self.stop_words if options.get('stopword_removal') else None
+        words = []
+        for chunk in _chunks(text, keep_br=not remove_punctuation):
+            tokens = self._tokenize_chunk(chunk, remove_punctuation)
+            if stop_words is not None:
+                # Tokens are already lowercase
+                tokens = [token for token in tokens if token not in stop_words]
+            words.extend(tokens)
+            if limit is not None and len(words) >= limit:
+                return words[:limit]
+        return words
+
+    @cached()
     def preprocess(self, text, options):
-        steps = {}
-        processed_text = text
+        return self._preprocess(text, options)
+
+    def preprocess_stream(self, stream, options):
+        """Preprocess a text or binary file object without reading it into memory at once
+
+        Only the Case Normalization and Punctuation Removal step strings need
+        the whole text; the stream is read fully only when those are returned.
+        """
+        return self._preprocess(stream, options)
+
+    def _preprocess(self, text, options):
+        # Text steps record the string; token steps record the words joined by spaces
+        recorder = StepRecorder(lambda output: output if isinstance(output, str) else ' '.join(output),
+                                'TextPreprocessor', options)
         
         # Get padding length from options
-        padding_length = options.get('padding_length', 20)  # Default to 20 if not specified
-        
-        # Text-level preprocessing
-        # Case normalization
-        if options.get('case_normalization'):
-            processed_text = text.lower()
-            steps['Case Normalization'] = processed_text
-        
-        # Punctuation removal
-        if options.get('punctuation_removal'):
-            processed_text = processed_text.translate(str.maketrans('', '', string.punctuation))
-            steps['Punctuation Removal'] = processed_text
+        padding_length = int(options.get('padding_length', 20))  # Default to 20 if not specified
         
-        # Now perform tokenization after all text-level preprocessing
-        words = self.tokenizer(processed_text)
-        # Token-level preprocessing
-        # Stop word removal
+        # Text-level steps are fused into tokenize(); their full strings are
+        # only built when the caller asked for them
+        case_step = options.get('case_normalization') and recorder.wants('Case Normalization')
+        punctuation_step = options.get('punctuation_removal') and recorder.wants('Punctuation Removal')
+        if case_step or punctuation_step:
+            if not isinstance(text, str):
+                text = ''.join(_chunks(text))
+            processed_text = text
+            if case_step:
+                processed_text = recorder.run('Case Normalization', str.lower, text)
+            if punctuation_step:
+                base = processed_text if options.get('case_normalization') else text
+                recorder.run('Punctuation Removal', base.translate, _PUNCTUATION_TABLE)
+
+        # Padding keeps only the first padding_length words, so stop reading
+        # there unless the full stop-word step string is wanted
+        limit = None
+        if options.get('padding') and not (options.get('stopword_removal') and recorder.wants('Stop Word Removal')):
+            limit = padding_length
+        with recorder.timed('Tokenize'):
+            words = self.tokenize(text, options, limit)
         if options.get('stopword_removal'):
-            words = [word for word in words if word.lower() not in self.stop_words]
-            steps['Stop Word Removal'] = ' '.join(words)
+            recorder.record('Stop Word Removal', words)
         
         # Generate unique token IDs
-        token_ids = [self.get_token_id(word) for word in words]
+        token_ids = self.vocab.lookup_many(words)
 
         # Padding (if selected)
         if options.get('padding'):
-            words = self.pad_sequence(words, padding_length, pad_value='<PAD>') 
+            words = recorder.run('Padding', self.pad_sequence, words, padding_length, pad_value='<PAD>')
             token_ids = self.pad_sequence(token_ids, padding_length, pad_value=0)
-            steps['Padding'] = ' '.join(words)
 
         return {
-            'preprocessing_steps': steps,
+            'preprocessing_steps': recorder.steps,
             'tokens': words,
             'token_ids': token_ids,
             'original_length': len(words)
         }
+
+    def preprocess_batch(self, texts, options):
+        """Preprocess many texts with shared options, keeping per-item errors"""
+        results = []
+        for text in texts:
+            try:
+                results.append(self.preprocess(text, options))
+            except Exception as e:
+                results.append({'error': str(e)})
+        return results
+
+    def _id_matrix(self, ids, length=None):
+        """Pad a list of id sequences into an int32 matrix with mask and lengths"""
+        lengths = np.fromiter((len(sequence) for sequence in ids), dtype=np.int32, count=len(ids))
+        if length is None:
+            length = int(lengths.max()) if len(ids) else 0
+        attention_mask = np.arange(length, dtype=np.int32) < lengths[:, None]
+        token_ids = np.full((len(ids), length), PAD_ID, dtype=np.int32)
+        # The mask is row-major, so it selects slots in the order of the flattened ids
+        token_ids[attention_mask] = np.fromiter((token_id for sequence in ids for token_id in sequence),
+                                                dtype=np.int32, count=int(lengths.sum()))
+        return {'token_ids': token_ids, 'attention_mask': attention_mask.astype(np.uint8), 'lengths': lengths}
+
+    def encode_batch(self, texts, options, bucket_size=None, return_tensors='np'):
+        """Turn many texts into padded id matrices instead of per-text lists
+
+        Returns {'token_ids': int32 [n, length], 'attention_mask': uint8
+        [n, length], 'lengths': int32 [n]}. With the 'padding' option every
+        row has padding_length columns (longer texts are truncated);
+        otherwise rows are padded to the longest text.
+
+        With bucket_size, texts are sorted by length and split into groups
+        of that many, each padded only to its own longest text; the result
+        is then {'buckets': [...]} where each bucket also has 'indices', the
+        positions of its rows in texts. return_tensors='pt' gives torch
+        tensors instead of NumPy arrays. Step outputs are not recorded.
+        """
+        limit = int(options.get('padding_length', 20)) if options.get('padding') else None
+        ids = [self.vocab.lookup_many(self.tokenize(text, options, limit)) for text in texts]
+
+        if bucket_size:
+            order = sorted(range(len(ids)), key=lambda index: len(ids[index]))
+            batches = []
+            for start in range(0, len(order), bucket_size):
+                indices = order[start:start + bucket_size]
+                batch = self._id_matrix([ids[index] for index in indices], limit)
+                batch['indices'] = np.asarray(indices, dtype=np.int64)
+                batches.append(batch)
+            result = {'buckets': batches}
+        else:
+            result = self._id_matrix(ids, limit)
+
+        if return_tensors == 'pt':
+            import torch
+            convert = lambda batch: {key: torch.from_numpy(array) for key, array in batch.items()}
+            return {'buckets': [convert(batch) for batch in result['buckets']]} if bucket_size else convert(result)
+        return result
+
+
+def save_batch(batch, file):
+    """Write an encode_batch() result as an uncompressed .npz archive
+
+    Bucketed results store each array as "<name>.<bucket>", e.g.
+    "token_ids.0" and "indices.0".
+    """
+    if 'buckets' in batch:
+        arrays = {f"{name}.{number}": array
+                  for number, bucket in enumerate(batch['buckets']) for name, array in bucket.items()}
+    else:
+        arrays = batch
+    np.savez(file, **arrays)
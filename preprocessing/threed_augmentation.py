@@ -2,16 +2,23 @@ import numpy as np
 import trimesh
 import io
 from scipy.spatial.transform import Rotation
+from preprocessing.encoding import preview_mesh
+from preprocessing.pipeline import StepRecorder
+from preprocessing.randomness import generators
+from preprocessing.result_cache import cached
 
 class ThreeDAugmenter:
     def __init__(self):
         pass
 
     def _load_off_file(self, data):
-        """Load OFF file data into trimesh"""
-        temp_buffer = io.StringIO(data)
+        """Load OFF data from a string, raw bytes or a binary stream into trimesh"""
+        if isinstance(data, str):
+            data = io.StringIO(data)
+        elif isinstance(data, (bytes, bytearray, memoryview)):
+            data = io.BytesIO(data)
         try:
-            mesh = trimesh.load(temp_buffer, file_type='off')
+            mesh = trimesh.load(data, file_type='off')
             return mesh
         except Exception as e:
             print(f"Error loading OFF file: {str(e)}")
@@ -21,7 +28,7 @@ class ThreeDAugmenter:
         """Apply random rotation to the mesh"""
         try:
             # Generate random rotation matrix
-            rotation = Rotation.random()
+            rotation = Rotation.random(random_state=generators().numpy)
             rotation_matrix = rotation.as_matrix()  # This gives us a 3x3 matrix
             
             # Convert to 4x4 transformation matrix
@@ -38,7 +45,7 @@ class ThreeDAugmenter:
     def random_scale(self, mesh, factor):
         """Apply random scaling within range"""
         try:
-            scale = 1.0 + np.random.uniform(-factor, factor)
+            scale = 1.0 + generators().numpy.uniform(-factor, factor)
             mesh.apply_scale(scale)
             return mesh
         except Exception as e:
@@ -49,7 +56,7 @@ class ThreeDAugmenter:
         """Add random noise to vertex positions"""
         try:
             vertices = mesh.vertices
-            noise = np.random.normal(0, amplitude, vertices.shape)
+            noise = generators().numpy.normal(0, amplitude, vertices.shape)
             mesh.vertices = vertices + noise
             return mesh
         except Exception as e:
@@ -61,7 +68,7 @@ class ThreeDAugmenter:
         try:
             vertices = mesh.vertices
             # Create a smooth deformation field
-            noise = np.random.normal(0, strength, vertices.shape)
+            noise = generators().numpy.normal(0, strength, vertices.shape)
             # Apply smoothing to the noise
             vertex_neighbors = trimesh.graph.vertex_adjacency_graph(mesh.faces)
             for _ in range(3):  # Smooth the noise field
@@ -79,6 +86,10 @@ class ThreeDAugmenter:
             print(f"Error in random_deformation: {str(e)}")
             raise
 
+    def _mesh_to_off_bytes(self, mesh):
+        """Encode mesh as UTF-8 OFF bytes"""
+        return self._mesh_to_off_string(mesh).encode('utf-8')
+
     def _mesh_to_off_string(self, mesh):
         """Convert mesh to OFF format string"""
         try:
@@ -101,46 +112,59 @@ class ThreeDAugmenter:
             print(f"Error in _mesh_to_off_string: {str(e)}")
             raise
 
-    def augment(self, model_data, options):
+    @cached(randomized=True)
+    def augment(self, model_data, options, binary=False):
         """Apply selected augmentation techniques"""
         try:
             print("Starting augmentation...")
             print(f"Received options: {options}")
 
-            mesh = self._load_off_file(model_data)
+            encode = self._mesh_to_off_bytes if binary else self._mesh_to_off_string
+            recorder = StepRecorder(encode, 'ThreeDAugmenter', options,
+                                    preview=lambda mesh: encode(preview_mesh(mesh)))
+            with recorder.timed('Decode'):
+                mesh = self._load_off_file(model_data)
             augmented_mesh = mesh.copy()
-            steps = {}
 
             if options.get('rotation', {}).get('enabled'):
                 print("Applying random rotation...")
-                augmented_mesh = self.random_rotation(augmented_mesh)
-                steps['Rotation'] = self._mesh_to_off_string(augmented_mesh)
+                augmented_mesh = recorder.run('Rotation', self.random_rotation, augmented_mesh)
 
             if options.get('scale', {}).get('enabled'):
                 print("Applying random scaling...")
                 factor = float(options['scale'].get('factor', 0.2))
-                augmented_mesh = self.random_scale(augmented_mesh, factor)
-                steps['Scale'] = self._mesh_to_off_string(augmented_mesh)
+                augmented_mesh = recorder.run('Scale', self.random_scale, augmented_mesh, factor)
 
             if options.get('noise', {}).get('enabled'):
                 print("Adding surface noise...")
                 amplitude = float(options['noise'].get('amplitude', 0.01))
-                augmented_mesh = self.add_surface_noise(augmented_mesh, amplitude)
-                steps['Noise'] = self._mesh_to_off_string(augmented_mesh)
+                augmented_mesh = recorder.run('Noise', self.add_surface_noise, augmented_mesh, amplitude)
 
             if options.get('deform', {}).get('enabled'):
                 print("Applying random deformation...")
                 strength = float(options['deform'].get('strength', 0.1))
-                augmented_mesh = self.random_deformation(augmented_mesh, strength)
-                steps['Deform'] = self._mesh_to_off_string(augmented_mesh)
+                augmented_mesh = recorder.run('Deform', self.random_deformation, augmented_mesh, strength)
 
-            print(f"Augmentation steps: {steps}")
+            print(f"Augmentation steps: {list(recorder.steps)}")
 
             return {
-                'augmentation_steps': steps,
-                'augmented_model': self._mesh_to_off_string(augmented_mesh)
+                'augmentation_steps': recorder.steps,
+                'augmented_model': recorder.encode(augmented_mesh)
             }
 
         except Exception as e:
             print(f"Error in augment: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def augment_batch(self, models, options, binary=False):
+        """Augment many meshes with shared options, keeping per-item errors
+
+        Meshes cannot be stacked, so each runs through augment() in turn.
+        """
+        results = []
+        for model_data in models:
+            try:
+                results.append(self.augment(model_data, options, binary=binary))
+            except Exception as e:
+                results.append({'error': str(e)})
+        return results
@@ -1,16 +1,22 @@
 import numpy as np
 import trimesh
 import io
+from preprocessing.encoding import preview_mesh
+from preprocessing.pipeline import StepRecorder, check_cancelled
+from preprocessing.result_cache import cached
 
 class ThreeDPreprocessor:
     def __init__(self):
         pass
 
     def _load_off_file(self, data):
-        """Load OFF file data into trimesh"""
-        temp_buffer = io.StringIO(data)
+        """Load OFF data from a string, raw bytes or a binary stream into trimesh"""
+        if isinstance(data, str):
+            data = io.StringIO(data)
+        elif isinstance(data, (bytes, bytearray, memoryview)):
+            data = io.BytesIO(data)
         try:
-            mesh = trimesh.load(temp_buffer, file_type='off')
+            mesh = trimesh.load(data, file_type='off')
             return mesh
         except Exception as e:
             print(f"Error loading OFF file: {str(e)}")
@@ -73,6 +79,7 @@ class ThreeDPreprocessor:
         try:
             smoothed_mesh = mesh.copy()
             for _ in range(int(iterations)):
+                check_cancelled('Smooth')
                 vertices = smoothed_mesh.vertices
                 # Simple Laplacian smoothing
                 vertex_neighbors = trimesh.graph.vertex_adjacency_graph(smoothed_mesh.faces)
@@ -92,6 +99,10 @@ class ThreeDPreprocessor:
             print(f"Error in smooth_surface: {str(e)}")
             raise
 
+    def _mesh_to_off_bytes(self, mesh):
+        """Encode mesh as UTF-8 OFF bytes"""
+        return self._mesh_to_off_string(mesh).encode('utf-8')
+
     def _mesh_to_off_string(self, mesh):
         """Convert mesh to OFF format string"""
         try:
@@ -114,43 +125,56 @@ class ThreeDPreprocessor:
             print(f"Error in _mesh_to_off_string: {str(e)}")
             raise
 
-    def preprocess(self, model_data, options):
+    @cached()
+    def preprocess(self, model_data, options, binary=False):
         """Preprocess the 3D model with selected options"""
         try:
             print("Starting preprocessing...")
             print(f"Received options: {options}")
 
-            mesh = self._load_off_file(model_data)
+            encode = self._mesh_to_off_bytes if binary else self._mesh_to_off_string
+            recorder = StepRecorder(encode, 'ThreeDPreprocessor', options,
+                                    preview=lambda mesh: encode(preview_mesh(mesh)))
+            with recorder.timed('Decode'):
+                mesh = self._load_off_file(model_data)
             processed_mesh = mesh.copy()
-            steps = {}
 
             if options.get('normalize'):
                 print("Applying normalization...")
-                processed_mesh = self.normalize_scale(processed_mesh)
-                steps['Normalize'] = self._mesh_to_off_string(processed_mesh)
+                processed_mesh = recorder.run('Normalize', self.normalize_scale, processed_mesh)
 
             if options.get('center'):
                 print("Centering model...")
-                processed_mesh = self.center_model(processed_mesh)
-                steps['Center'] = self._mesh_to_off_string(processed_mesh)
+                processed_mesh = recorder.run('Center', self.center_model, processed_mesh)
 
             if options.get('simplify'):
                 print("Simplifying mesh...")
                 ratio = float(options.get('simplify_ratio', 0.5))
-                processed_mesh = self.simplify_mesh(processed_mesh, ratio)
-                steps['Simplify'] = self._mesh_to_off_string(processed_mesh)
+                processed_mesh = recorder.run('Simplify', self.simplify_mesh, processed_mesh, ratio)
 
             if options.get('smooth'):
                 print("Smoothing surface...")
                 iterations = int(options.get('smooth_iterations', 1))
-                processed_mesh = self.smooth_surface(processed_mesh, iterations)
-                steps['Smooth'] = self._mesh_to_off_string(processed_mesh)
+                processed_mesh = recorder.run('Smooth', self.smooth_surface, processed_mesh, iterations)
 
             return {
-                'preprocessing_steps': steps,
-                'processed_model': self._mesh_to_off_string(processed_mesh)
+                'preprocessing_steps': recorder.steps,
+                'processed_model': recorder.encode(processed_mesh)
             }
 
         except Exception as e:
             print(f"Error in preprocess: {str(e)}")
-            raise 
\ No newline at end of file
+            raise 
+
+    def preprocess_batch(self, models, options, binary=False):
+        """Preprocess many meshes with shared options, keeping per-item errors
+
+        Meshes cannot be stacked, so each runs through preprocess() in turn.
+        """
+        results = []
+        for model_data in models:
+            try:
+                results.append(self.preprocess(model_data, options, binary=binary))
+            except Exception as e:
+                results.append({'error': str(e)})
+        return results
@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+PAD_TOKEN = '<PAD>'
+UNK_TOKEN = '<UNK>'
+PAD_ID = 0
+UNK_ID = 1
+# Learned tokens start here; the ids below are reserved for special tokens
+FIRST_ID = 100
+
+_EMPTY = -1
+
+# Tokens, known or unknown, FrozenVocabulary memoizes per process
+MEMO_SIZE = 1 << 17
+
+
+def _hash(data):
+    # Stable across processes, unlike hash(), so saved tables stay valid
+    return zlib.crc32(data)
+
+
+class Vocabulary:
+    """Growing token-to-id mapping shared by concurrent requests
+
+    Unknown tokens get the next free id until max_size tokens are known;
+    after that they map to UNK_ID. Lookups of known tokens take no lock.
+    """
+
+    def __init__(self, tokens=(), max_size=None):
+        self.max_size = max_size
+        self._ids = {}
+        self._tokens = []
+        self._lock = threading.Lock()
+        for token in tokens:
+            self.lookup(token)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, token):
+        return token in self._ids
+
+    def lookup(self, token):
+        """Return the id of token, adding it if there is room"""
+        if token == PAD_TOKEN:
+            return PAD_ID
+        token_id = self._ids.get(token)
+        if token_id is not None:
+            return token_id
+        with self._lock:
+            token_id = self._ids.get(token)
+            if token_id is None:
+                if self.max_size is not None and len(self._tokens) >= self.max_size:
+                    return UNK_ID
+                token_id = FIRST_ID + len(self._tokens)
+                self._tokens.append(token)
+                self._ids[token] = token_id
+            return token_id
+
+    def lookup_many(self, tokens):
+        return [self.lookup(token) for token in tokens]
+
+    def token(self, token_id):
+        """Return the token for an id (PAD_TOKEN/UNK_TOKEN for the reserved ones)"""
+        if token_id == PAD_ID:
+            return PAD_TOKEN
+        if token_id < FIRST_ID:
+            return UNK_TOKEN
+        return self._tokens[token_id - FIRST_ID]
+
+    def freeze(self):
+        """Return a read-only, array-backed copy of the current tokens"""
+        with self._lock:
+            tokens = list(self._tokens)
+        return FrozenVocabulary.from_tokens(tokens)
+
+    def save(self, path):
+        self.freeze().save(path)
+
+
+class FrozenVocabulary:
+    """Read-only vocabulary stored in flat arrays
+
+    Tokens are concatenated UTF-8 bytes indexed by an offsets array, and
+    ids are found through an open-addressing hash table, so lookups need no
+    lock and the arrays can be memory-mapped from disk and shared by every
+    worker process. Unknown tokens map to UNK_ID.
+
+    Probing the table costs a crc32 and an array read per token, so each
+    process keeps a dict in front of it with the ids of the first MEMO_SIZE
+    tokens it looks up. Frequent tokens show up early, so a fixed set serves
+    most lookups without the per-hit bookkeeping of an LRU.
+    """
+
+    def __init__(self, data, offsets, table):
+        self._data = data
+        self._offsets = offsets
+        self._table = table
+        self._mask = len(table) - 1
+        self._memo = {}
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        encoded = [token.encode('utf-8') for token in tokens]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(token) for token in encoded])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        # Power-of-two table at most half full keeps probe chains short
+        size = 1
+        while size < 2 * max(1, len(encoded)):
+            size *= 2
+        table = np.full(size, _EMPTY, dtype=np.int32)
+        mask = size - 1
+        for index, token in enumerate(encoded):
+            slot = _hash(token) & mask
+            while table[slot] != _EMPTY:
+                slot = (slot + 1) & mask
+            table[slot] = index
+        return cls(data, offsets, table)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _bytes(self, index):
+        return self._data[self._offsets[index]:self._offsets[index + 1]].tobytes()
+
+    def _index(self, token):
+        encoded = token.encode('utf-8')
+        slot = _hash(encoded) & self._mask
+        while True:
+            index = int(self._table[slot])
+            if index == _EMPTY:
+                return None
+            if self._bytes(index) == encoded:
+                return index
+            slot = (slot + 1) & self._mask
+
+    def __contains__(self, token):
+        return self._index(token) is not None
+
+    def lookup(self, token):
+        """Return the id of token, or UNK_ID if it is not in the vocabulary"""
+        token_id = self._memo.get(token)
+        if token_id is None:
+            if token == PAD_TOKEN:
+                return PAD_ID
+            index = self._index(token)
+            token_id = UNK_ID if index is None else FIRST_ID + index
+            if len(self._memo) < MEMO_SIZE:
+                self._memo[token] = token_id
+        return token_id
+
+    def lookup_many(self, tokens):
+        memo = self._memo
+        return [memo[token] if token in memo else self.lookup(token) for token in tokens]
+
+    def token(self, token_id):
+        if token_id == PAD_ID:
+            return PAD_TOKEN
+        if token_id < FIRST_ID:
+            return UNK_TOKEN
+        return self._bytes(token_id - FIRST_ID).decode('utf-8')
+
+    def freeze(self):
+        return self
+
+    def save(self, path):
+        """Write the arrays to a directory that load_vocabulary() can memory-map"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'data.npy'), np.asarray(self._data))
+        np.save(os.path.join(path, 'offsets.npy'), np.asarray(self._offsets))
+        np.save(os.path.join(path, 'table.npy'), np.asarray(self._table))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'size': len(self), 'first_id': FIRST_ID, 'pad_id': PAD_ID, 'unk_id': UNK_ID}, f)
+
+
+def load_vocabulary(path, frozen=True, mmap=True, max_size=None):
+    """Load a saved vocabulary
+
+    Frozen vocabularies are memory-mapped read-only by default. With
+    frozen=False the tokens are copied into a growing Vocabulary instead.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('first_id', FIRST_ID) != FIRST_ID:
+        raise ValueError(f"Vocabulary at {path} uses first id {meta['first_id']}, expected {FIRST_ID}")
+
+    # Empty arrays cannot be memory-mapped
+    mmap_mode = 'r' if mmap and meta['size'] else None
+    vocabulary = FrozenVocabulary(
+        np.load(os.path.join(path, 'data.npy'), mmap_mode=mmap_mode),
+        np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode),
+        np.load(os.path.join(path, 'table.npy'), mmap_mode=mmap_mode),
+    )
+    if frozen:
+        return vocabulary
+    return Vocabulary((vocabulary.token(FIRST_ID + index) for index in range(len(vocabulary))),
+                      max_size=max_size)
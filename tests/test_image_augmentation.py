@@ -0,0 +1,58 @@
+import io
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('torch')
+pytest.importorskip('torchvision')
+Image = pytest.importorskip('PIL.Image')
+
+from preprocessing.image_augmentation import ImageAugmenter
+from preprocessing.result_cache import result_cache
+
+
+@pytest.fixture
+def image_bytes():
+    pixels = np.random.default_rng(0).integers(0, 256, (24, 32, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _variant_options(angle):
+    return {
+        'rotation': {'enabled': True, 'angle': angle},
+        'flip': {'enabled': True, 'direction': 'horizontal'},
+        'output_format': 'npy',
+        'return_steps': 'none',
+    }
+
+
+@pytest.mark.parametrize('angle', [30, -30])
+def test_variants_match_single_image_runs(image_bytes, angle):
+    augmenter = ImageAugmenter()
+    result_cache.clear()
+    options = dict(_variant_options(angle), num_variants=4, seed=7)
+    variants = augmenter.augment(image_bytes, options, binary=True)['variants']
+    assert len(variants) == 4
+
+    for variant in variants:
+        parameters = variant['parameters']
+        assert abs(parameters['angle']) <= abs(angle)
+        single_options = _variant_options(parameters['angle'])
+        single_options['flip']['enabled'] = parameters['flip'] is not None
+        single = augmenter.augment(image_bytes, single_options, binary=True)
+
+        expected = np.load(io.BytesIO(single['augmented_image']))
+        actual = np.load(io.BytesIO(variant['augmented_image']))
+        np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+
+def test_variants_are_reproducible_for_a_seed(image_bytes):
+    augmenter = ImageAugmenter()
+    options = dict(_variant_options(-45), num_variants=3, seed=11)
+    result_cache.clear()
+    first = [variant['parameters'] for variant in augmenter.augment(image_bytes, options, binary=True)['variants']]
+    result_cache.clear()
+    second = [variant['parameters'] for variant in augmenter.augment(image_bytes, options, binary=True)['variants']]
+    assert first == second
@@ -0,0 +1,52 @@
+import pytest
+
+from preprocessing.model_registry import registry
+from preprocessing.text_augmentation import TextAugmenter
+
+
+class _WordAfterPredictor:
+    """Predicts, for every mask token, 'after-<previous word>' like a real model would per mask"""
+
+    mask_token = '[MASK]'
+
+    def predict(self, texts, top_k=10):
+        results = []
+        for text in texts:
+            words = text.split()
+            masks = []
+            for index, word in enumerate(words):
+                previous = words[index - 1] if index else '<s>'
+                masks.extend([[f"after-{previous}"]] * word.count(self.mask_token))
+            results.append(masks)
+        return results
+
+
+@pytest.fixture
+def augmenter(monkeypatch):
+    monkeypatch.setitem(registry._models, 'masked-lm', _WordAfterPredictor())
+    return TextAugmenter()
+
+
+@pytest.mark.parametrize('mode', ['joint', 'independent'])
+@pytest.mark.parametrize('text', [
+    'the quick brown fox jumps over the lazy dog',
+    '[MASK] quick brown [MASK] jumps over the lazy dog',
+    'the quick x[MASK]y fox jumps [MASK] the lazy dog [MASK]',
+])
+def test_mlm_predictions_land_on_their_positions(augmenter, text, mode):
+    texts = [text, 'a b c d e f', text]
+    results = augmenter.word_replacement_mlm_batch(texts, n_words=3, mode=mode)
+
+    for original, (augmented, changes) in zip(texts, results):
+        words = original.split()
+        assert len(augmented.split()) == len(words)
+        assert len(changes['positions']) == min(3, sum('[MASK]' not in word for word in words))
+        for pos, old, new in zip(changes['positions'], changes['old_words'], changes['new_words']):
+            assert old == words[pos].lower()
+            assert '[MASK]' not in words[pos]
+            # joint masks may cover the previous word too; independent ones never do
+            previous = words[pos - 1] if pos else '<s>'
+            assert new == f"after-{previous}" or (mode == 'joint' and new == 'after-[MASK]')
+        for pos, word in enumerate(words):
+            if '[MASK]' in word:
+                assert augmented.split()[pos] == word
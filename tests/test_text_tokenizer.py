@@ -0,0 +1,60 @@
+import io
+import string
+
+import pytest
+
+pytest.importorskip('numpy')
+data_utils = pytest.importorskip('torchtext.data.utils')
+
+from preprocessing import text_preprocessing
+from preprocessing.text_preprocessing import TextPreprocessor
+
+PUNCTUATED = (
+    'Meet me at 12:30; bring "snacks", (and) drinks! Is it ok?.. '
+    "It's a word;word and a:b test.<br />Next line<br />\"quoted\" "
+    'Ends with colon: semicolon; and "<br />" ...?!'
+)
+
+
+@pytest.fixture
+def preprocessor():
+    return TextPreprocessor()
+
+
+BR_EDGES = [
+    'hello world<br />',
+    'x<br />y z',
+    'a<br /> <br />b<br />',
+    'rx/ra.><br\na: a:\nb\n',
+    '<BR /><br /><br/>end',
+]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1 << 20])
+@pytest.mark.parametrize('text', [PUNCTUATED * 3] + BR_EDGES)
+def test_fused_tokenizer_matches_basic_english(preprocessor, monkeypatch, chunk_size, text):
+    monkeypatch.setattr(text_preprocessing, 'CHUNK_SIZE', chunk_size)
+    basic_english = data_utils.get_tokenizer('basic_english')
+
+    assert preprocessor.tokenize(text, {}) == basic_english(text)
+    assert preprocessor.tokenize(io.BytesIO(text.encode('utf-8')), {}) == basic_english(text)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1 << 20])
+@pytest.mark.parametrize('text', [PUNCTUATED * 3] + BR_EDGES)
+def test_punctuation_removal_matches_translate_then_basic_english(preprocessor, monkeypatch, chunk_size, text):
+    monkeypatch.setattr(text_preprocessing, 'CHUNK_SIZE', chunk_size)
+    basic_english = data_utils.get_tokenizer('basic_english')
+    expected = basic_english(text.translate(str.maketrans('', '', string.punctuation)))
+    options = {'punctuation_removal': True}
+
+    assert preprocessor.tokenize(text, options) == expected
+    assert preprocessor.tokenize(io.BytesIO(text.encode('utf-8')), options) == expected
+
+
+def test_punctuation_removal_glues_br_like_baseline(preprocessor):
+    assert preprocessor.tokenize('hello world<br />', {'punctuation_removal': True}) == ['hello', 'worldbr']
+
+
+def test_separators_split_tokens(preprocessor):
+    assert preprocessor.tokenize('12:30 word;word', {}) == ['12', '30', 'word', 'word']